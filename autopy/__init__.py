@@ -1 +1,10 @@
-from autopy.type.autopy_type import AutoPy
\ No newline at end of file
+# the entry points are imported on first use, so importing a light module of the package (e.g. autopy.metrics or the
+# cli) does not import the completion client and its dependencies
+def __getattr__(name):
+    if name == "AutoPy":
+        from autopy.type.autopy_type import AutoPy
+        return AutoPy
+    if name == "AutoPyML":
+        from autopy.ml.autopy_ml import AutoPyML
+        return AutoPyML
+    raise AttributeError(f"module 'autopy' has no attribute {name!r}")
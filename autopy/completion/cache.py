@@ -0,0 +1,139 @@
+"""
+On-disk cache of completions.
+
+Entries are content addressed - the key is a hash of the model, the prompt instructions and the normalized code that
+was sent, so an unchanged file (or chunk) never reaches the api twice. the cache is a single sqlite file, bounded by
+size with least recently used eviction and an optional time to live.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path(os.getenv("AUTOPY_CACHE_DIR", Path.home() / ".cache" / "autopy"))
+
+
+def normalize_code(code: str) -> str:
+    """
+    normalize code before hashing so that trailing whitespaces and line endings do not change the key
+    :param code: the code to normalize
+    :return: the normalized code
+    """
+    return "\n".join(line.rstrip() for line in code.strip("\n").splitlines())
+
+
+def make_key(model: str, instructions: str, code: str) -> str:
+    """
+    create the cache key of a completion
+    :param model: the model that creates the completion
+    :param instructions: the instructions part of the prompt
+    :param code: the code part of the prompt
+    :return: hex digest that identifies the completion
+    """
+    digest = hashlib.sha256()
+    for part in (model, instructions.strip(), normalize_code(code)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CompletionCache:
+    def __init__(
+            self,
+            path: Union[str, Path, None] = None,
+            max_size: int = 256 * 1024 * 1024,
+            ttl: Optional[float] = None
+    ) -> None:
+        """
+        sqlite backed completion cache with lru eviction.
+        :param path: path to the sqlite file, defaults to completions.sqlite3 in DEFAULT_CACHE_DIR
+        :param max_size: maximal total size of the cached completions in bytes
+        :param ttl: time to live of an entry in seconds, None means entries never expire
+        """
+        if path is None:
+            path = DEFAULT_CACHE_DIR / "completions.sqlite3"
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        get a completion from the cache
+        :param key: key created by make_key
+        :return: the cached completion or None if it is missing or expired
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT text, created FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, text: str) -> None:
+        """
+        store a completion and evict the least recently used entries if the cache is too big
+        :param key: key created by make_key
+        :param text: the completion text
+        """
+        now = time.time()
+        size = len(text.encode("utf-8"))
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions (key, text, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, text, size, now, now)
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total <= self.max_size:
+            return
+        evicted = 0
+        for key, size in self._connection.execute(
+                "SELECT key, size FROM completions ORDER BY accessed ASC").fetchall():
+            if total <= self.max_size:
+                break
+            self._connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.debug(f"evicted {evicted} completions from the cache")
+
+    def clear(self) -> None:
+        """remove every entry from the cache"""
+        with self._lock:
+            self._connection.execute("DELETE FROM completions")
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def __bool__(self) -> bool:
+        # an empty cache is still a cache, `if cache:` must not skip it because it has no entries yet
+        return True
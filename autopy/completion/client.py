@@ -0,0 +1,400 @@
+"""
+Shared completion client.
+
+every request of AutoPy, AutoPyML and the chunked path goes through CompletionClient. the client runs the requests on
+an asyncio event loop and takes care of:
+- bounding the number of requests in flight with a semaphore
+- retrying rate limit and transient errors with exponential backoff and jitter
+- per request timeouts
+- the completion cache and the rate limiter
+
+the backend that actually creates the completion is pluggable, OpenAIBackend talks to the openai api (or to any server
+that speaks the same protocol, see autopy.completion.fake) and any async callable with the same signature can be used
+instead.
+"""
+import asyncio
+import logging
+import queue
+import random
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from autopy import metrics
+from autopy.completion.cache import CompletionCache
+from autopy.completion.rate_limit import RateLimiter
+from autopy.completion.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# names of the openai.error exceptions that are worth retrying, matched by name so that the backend can be replaced
+# by a stand-in that raises exceptions with the same names without depending on openai
+RETRYABLE_ERRORS = {"RateLimitError", "APIError", "Timeout", "ServiceUnavailableError", "APIConnectionError", "TryAgain"}
+
+
+class CompletionError(Exception):
+    pass
+
+
+class Completion:
+    def __init__(self, text: str, prompt_tokens: int = 0, completion_tokens: int = 0, cached: bool = False,
+                 valid: bool = True, error: Optional[CompletionError] = None) -> None:
+        """
+        the result of a completion request
+        :param text: the completion text
+        :param prompt_tokens: number of tokens in the prompt, as reported by the backend
+        :param completion_tokens: number of tokens in the completion, as reported by the backend
+        :param cached: whether the completion was taken from the cache
+        :param valid: False if the completion failed the validation of the request (after all the retries)
+        :param error: the error of a request that failed (after all the retries) in acomplete_many, its text is empty
+        """
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached = cached
+        self.valid = valid
+        self.error = error
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class CompletionRequest:
+    def __init__(self, prompt: str, max_tokens: int, model: str, cache_key: Optional[str] = None,
+                 validate: Optional[Callable[[str], bool]] = None) -> None:
+        """
+        :param prompt: the prompt to complete
+        :param max_tokens: maximal number of tokens in the completion
+        :param model: the model to use
+        :param cache_key: key of the completion in the cache (see autopy.completion.cache.make_key), None skips the cache
+        :param validate: optional check of the completion text, invalid completions are requested again and are never
+        cached
+        """
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.model = model
+        self.cache_key = cache_key
+        self.validate = validate
+
+
+# a backend is an async callable (model, prompt, max_tokens) -> Completion. backends that can stream also have a
+# `stream(model, prompt, max_tokens)` method which is an async iterator of the completion text
+Backend = Callable[[str, str, int], Awaitable[Completion]]
+
+
+class OpenAIBackend:
+    def __init__(self, api_key: Optional[str] = None, api_base: Optional[str] = None) -> None:
+        """
+        backend that creates completions with the openai completion api
+        :param api_key: openai api key, defaults to openai.api_key
+        :param api_base: base url of the api, point it to a local server to replace the remote api
+        """
+        self.api_key = api_key
+        self.api_base = api_base
+
+    def _kwargs(self, model: str, prompt: str, max_tokens: int) -> Dict[str, Any]:
+        kwargs = {"model": model, "prompt": prompt, "max_tokens": max_tokens}
+        if self.api_key:
+            kwargs["api_key"] = self.api_key
+        if self.api_base:
+            kwargs["api_base"] = self.api_base
+        return kwargs
+
+    async def __call__(self, model: str, prompt: str, max_tokens: int) -> Completion:
+        import openai
+
+        kwargs = self._kwargs(model, prompt, max_tokens)
+        if hasattr(openai.Completion, "acreate"):
+            response = await openai.Completion.acreate(**kwargs)
+        else:
+            response = await asyncio.to_thread(openai.Completion.create, **kwargs)
+        usage = response.get("usage", {})
+        return Completion(
+            text=response["choices"][0]["text"],
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+        )
+
+    async def stream(self, model: str, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        """yield the completion text as it is generated"""
+        import openai
+
+        kwargs = self._kwargs(model, prompt, max_tokens)
+        kwargs["stream"] = True
+        if hasattr(openai.Completion, "acreate"):
+            async for chunk in await openai.Completion.acreate(**kwargs):
+                yield chunk["choices"][0]["text"]
+        else:
+            # the blocking generator is advanced on a worker thread
+            chunks = await asyncio.to_thread(openai.Completion.create, **kwargs)
+            end = object()
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, end)
+                if chunk is end:
+                    break
+                yield chunk["choices"][0]["text"]
+
+
+def is_retryable(error: BaseException) -> bool:
+    """whether a failed request should be sent again"""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+def is_context_length_error(error: BaseException) -> bool:
+    """whether the request failed because the prompt and max_tokens do not fit in the context of the model"""
+    return type(error).__name__ == "InvalidRequestError" and (
+            "max_tokens" in str(error) or "maximum context length" in str(error))
+
+
+class CompletionClient:
+    def __init__(
+            self,
+            backend: Optional[Backend] = None,
+            max_concurrency: int = 8,
+            max_retries: int = 5,
+            max_invalid_retries: int = 1,
+            timeout: Optional[float] = 120.0,
+            base_delay: float = 1.0,
+            max_delay: float = 60.0,
+            cache: Optional[CompletionCache] = None,
+            rate_limiter: Optional[RateLimiter] = None
+    ) -> None:
+        """
+        :param backend: async callable (model, prompt, max_tokens) -> Completion, defaults to OpenAIBackend
+        :param max_concurrency: maximal number of requests in flight
+        :param max_retries: maximal number of retries of a single request
+        :param max_invalid_retries: maximal number of times a completion that failed validation is requested again
+        :param timeout: timeout of a single attempt in seconds, None means no timeout
+        :param base_delay: the delay before the first retry, doubled on every retry
+        :param max_delay: upper bound of the delay between two retries
+        :param cache: optional completion cache
+        :param rate_limiter: optional rate limiter, shared by every request of the client
+        """
+        self.backend = backend or OpenAIBackend()
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_invalid_retries = max_invalid_retries
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.requests = 0
+        self.retries = 0
+        self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    def backoff(self, attempt: int) -> float:
+        """exponential backoff with full jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def _handle_failure(self, error: Exception, attempt: int, max_tokens: int) -> int:
+        """
+        decide what to do with a failed attempt - raise, or wait and return the max_tokens of the next attempt
+        :param error: the error of the attempt
+        :param attempt: the number of the attempt, starting from 0
+        :param max_tokens: the max_tokens of the attempt
+        :return: the max_tokens of the next attempt
+        :raise CompletionError: if the request should not be retried
+        """
+        if attempt == self.max_retries:
+            raise CompletionError(f"request failed after {attempt + 1} attempts: {error}") from error
+        if is_context_length_error(error):
+            # the prompt is bigger than estimated, leave more room for it
+            max_tokens = int(max_tokens * 0.9)
+            logger.info(f"max_tokens was too high, reducing it to {max_tokens}")
+        elif is_retryable(error):
+            delay = self.backoff(attempt)
+            logger.warning(f"request failed ({type(error).__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+        else:
+            raise CompletionError(str(error)) from error
+        metrics.increment("retries", error=type(error).__name__)
+        self.retries += 1
+        return max_tokens
+
+    async def _acquire(self, request: CompletionRequest, max_tokens: int) -> None:
+        """wait for the rate limiter, if there is one"""
+        if self.rate_limiter:
+            waited = await asyncio.to_thread(
+                self.rate_limiter.acquire, count_tokens(request.prompt, request.model) + max_tokens)
+            if waited:
+                metrics.record("rate_limit_wait", waited)
+
+    async def acomplete(self, request: CompletionRequest) -> Completion:
+        """
+        complete a single request
+        :param request: the request to complete
+        :return: the completion
+        """
+        if self.cache is not None and request.cache_key:
+            text = self.cache.get(request.cache_key)
+            if text is not None and (request.validate is None or request.validate(text)):
+                metrics.increment("cache_hits")
+                return Completion(text, cached=True)
+            metrics.increment("cache_misses")
+
+        max_tokens = request.max_tokens
+        attempt = 0
+        invalid_attempts = 0
+        async with self._semaphore():
+            while True:
+                await self._acquire(request, max_tokens)
+                try:
+                    self.requests += 1
+                    with metrics.timer("request", model=request.model):
+                        completion = await asyncio.wait_for(
+                            self.backend(request.model, request.prompt, max_tokens), self.timeout)
+                except Exception as e:
+                    max_tokens = await self._handle_failure(e, attempt, max_tokens)
+                    attempt += 1
+                    continue
+
+                metrics.increment("tokens_in", completion.prompt_tokens)
+                metrics.increment("tokens_out", completion.completion_tokens)
+                completion.valid = request.validate is None or request.validate(completion.text)
+                if completion.valid or invalid_attempts == self.max_invalid_retries:
+                    break
+                # the completion failed validation, only this request is sent again
+                logger.info("the completion is not valid, requesting it again")
+                metrics.increment("invalid_completions")
+                metrics.increment("retries")
+                invalid_attempts += 1
+                self.retries += 1
+
+        if self.cache is not None and request.cache_key and completion.valid:
+            self.cache.put(request.cache_key, completion.text)
+        return completion
+
+    async def acomplete_many(self, requests: List[CompletionRequest]) -> List[Completion]:
+        """
+        complete many requests concurrently, no more than max_concurrency are in flight at the same time. a request
+        that fails does not fail the others - its completion is empty, not valid and carries the error
+        :param requests: the requests to complete
+        :return: the completions, in the order of the requests
+        """
+        completions = []
+        for result in await asyncio.gather(*(self.acomplete(request) for request in requests), return_exceptions=True):
+            if isinstance(result, CompletionError):
+                logger.warning(f"a completion request failed, it is left out: {result}")
+                metrics.increment("failed_requests")
+                result = Completion("", valid=False, error=result)
+            elif isinstance(result, BaseException):
+                raise result
+            completions.append(result)
+        return completions
+
+    async def astream(self, request: CompletionRequest) -> AsyncIterator[str]:
+        """
+        stream the completion of a request. failures before the first piece of text are retried like in acomplete,
+        a failure in the middle of the stream is raised. the full text is cached when the stream ends (if it is valid).
+        :param request: the request to complete
+        :return: async iterator of the completion text
+        """
+        if self.cache is not None and request.cache_key:
+            text = self.cache.get(request.cache_key)
+            if text is not None and (request.validate is None or request.validate(text)):
+                metrics.increment("cache_hits")
+                yield text
+                return
+            metrics.increment("cache_misses")
+        if not hasattr(self.backend, "stream"):
+            yield (await self.acomplete(request)).text
+            return
+
+        max_tokens = request.max_tokens
+        attempt = 0
+        parts = []
+        async with self._semaphore():
+            while True:
+                await self._acquire(request, max_tokens)
+                stream = self.backend.stream(request.model, request.prompt, max_tokens).__aiter__()
+                try:
+                    self.requests += 1
+                    with metrics.timer("first_token", model=request.model):
+                        first = await asyncio.wait_for(stream.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    first = None
+                except Exception as e:
+                    max_tokens = await self._handle_failure(e, attempt, max_tokens)
+                    attempt += 1
+                    continue
+                break
+            if first is not None:
+                parts.append(first)
+                yield first
+                while True:
+                    try:
+                        delta = await asyncio.wait_for(stream.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    parts.append(delta)
+                    yield delta
+
+        text = "".join(parts)
+        metrics.increment("tokens_in", count_tokens(request.prompt, request.model))
+        metrics.increment("tokens_out", count_tokens(text, request.model))
+        if self.cache is not None and request.cache_key and (request.validate is None or request.validate(text)):
+            self.cache.put(request.cache_key, text)
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        the blocking api runs every request on a single background loop, so the concurrency limit is shared by all the
+        threads that use the client
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="autopy-completion-loop", daemon=True).start()
+            return self._loop
+
+    def complete(self, request: CompletionRequest) -> Completion:
+        """blocking version of acomplete"""
+        return asyncio.run_coroutine_threadsafe(self.acomplete(request), self._event_loop()).result()
+
+    def complete_many(self, requests: List[CompletionRequest]) -> List[Completion]:
+        """blocking version of acomplete_many"""
+        return asyncio.run_coroutine_threadsafe(self.acomplete_many(requests), self._event_loop()).result()
+
+    def stream(self, request: CompletionRequest) -> Iterator[str]:
+        """
+        blocking version of astream. closing the iterator (or breaking out of a loop over it) cancels the request.
+        """
+        deltas: "queue.Queue[Any]" = queue.Queue()
+        end = object()
+
+        async def pump() -> None:
+            try:
+                async for delta in self.astream(request):
+                    deltas.put(delta)
+                deltas.put(end)
+            except Exception as e:
+                deltas.put(e)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._event_loop())
+        try:
+            while True:
+                item = deltas.get()
+                if item is end:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    def close(self) -> None:
+        """stop the background event loop"""
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
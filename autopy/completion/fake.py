@@ -0,0 +1,161 @@
+"""
+Local stand-ins for the completion api.
+
+FakeBackend can be passed directly to CompletionClient, FakeCompletionServer is a small http server that speaks the
+/v1/completions protocol of openai, so the real OpenAIBackend (and the openai library) can be pointed at it with
+OpenAIBackend(api_base=server.api_base).
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import AsyncIterator, Callable, Optional
+
+from autopy.completion.client import Completion
+
+Responder = Callable[[str], str]
+
+
+def echo_responder(prompt: str) -> str:
+    """respond with the prompt itself, good enough for exercising the pipeline"""
+    return prompt
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+class RateLimitError(Exception):
+    """injected failure, it has the name of the openai error so CompletionClient retries it"""
+
+
+class FakeBackend:
+    def __init__(self, responder: Responder = echo_responder, latency: float = 0.0, stream_chunk_size: int = 16,
+                 tokens_per_second: Optional[float] = None, failure_rate: float = 0.0,
+                 seed: Optional[int] = None) -> None:
+        """
+        in-process backend for CompletionClient
+        :param responder: creates the completion text out of the prompt
+        :param latency: seconds to wait before every response
+        :param stream_chunk_size: number of characters in every piece of a streamed response
+        :param tokens_per_second: generation speed, the response takes completion tokens / tokens_per_second seconds
+        more (None means instant)
+        :param failure_rate: probability that a request fails with RateLimitError
+        :param seed: seed of the failures, for reproducible runs
+        """
+        self.responder = responder
+        self.latency = latency
+        self.stream_chunk_size = stream_chunk_size
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    async def _respond(self, prompt: str) -> str:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self.failures += 1
+            raise RateLimitError("injected failure")
+        return self.responder(prompt)
+
+    def _generation_time(self, text: str) -> float:
+        return count_words(text) / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    async def __call__(self, model: str, prompt: str, max_tokens: int) -> Completion:
+        text = await self._respond(prompt)
+        if self.tokens_per_second:
+            await asyncio.sleep(self._generation_time(text))
+        return Completion(text, prompt_tokens=count_words(prompt), completion_tokens=count_words(text))
+
+    async def stream(self, model: str, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        text = await self._respond(prompt)
+        for start in range(0, len(text), self.stream_chunk_size):
+            piece = text[start:start + self.stream_chunk_size]
+            await asyncio.sleep(self._generation_time(piece))
+            yield piece
+
+
+class FakeCompletionServer:
+    def __init__(self, responder: Responder = echo_responder, host: str = "127.0.0.1", port: int = 0) -> None:
+        """
+        http server that implements the completions endpoint of openai
+        :param responder: creates the completion text out of the prompt
+        :param host: host to bind
+        :param port: port to bind, 0 picks a free port
+        """
+        self.responder = responder
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                if not self.path.rstrip("/").endswith("/completions"):
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                server.requests += 1
+                prompt = body.get("prompt", "")
+                text = server.responder(prompt)
+                if body.get("stream"):
+                    self._stream(body, text)
+                    return
+                payload = json.dumps({
+                    "id": f"cmpl-fake-{server.requests}",
+                    "object": "text_completion",
+                    "model": body.get("model"),
+                    "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": "stop"}],
+                    "usage": {
+                        "prompt_tokens": count_words(prompt),
+                        "completion_tokens": count_words(text),
+                        "total_tokens": count_words(prompt) + count_words(text),
+                    },
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, body: dict, text: str) -> None:
+                # server sent events, one event per word like the real api
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for piece in re.findall(r"\S*\s*", text):
+                    if not piece:
+                        continue
+                    event = {"object": "text_completion", "model": body.get("model"),
+                             "choices": [{"text": piece, "index": 0, "logprobs": None, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_base(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeCompletionServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeCompletionServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
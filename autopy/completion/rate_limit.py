@@ -0,0 +1,68 @@
+"""
+Client side rate limiting of completion requests.
+
+openai limits both the number of requests and the number of tokens per minute, the limiter keeps a sliding window of
+the last minute and blocks the caller until the next request fits in both limits.
+"""
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+WINDOW_SECONDS = 60.0
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None) -> None:
+        """
+        thread safe sliding window rate limiter.
+        :param requests_per_minute: maximal number of requests in a minute, None means unlimited
+        :param tokens_per_minute: maximal number of tokens (prompt + completion) in a minute, None means unlimited
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._lock = threading.Lock()
+        self._window: Deque[Tuple[float, int]] = deque()
+        self._window_tokens = 0
+
+    def _expire(self, now: float) -> None:
+        while self._window and now - self._window[0][0] >= WINDOW_SECONDS:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+
+    def _wait_time(self, now: float, tokens: int) -> float:
+        """seconds to wait until a request of `tokens` tokens fits in the window, 0 if it fits now"""
+        wait = 0.0
+        if self.requests_per_minute is not None and len(self._window) >= self.requests_per_minute:
+            wait = max(wait, self._window[len(self._window) - self.requests_per_minute][0] + WINDOW_SECONDS - now)
+        if self.tokens_per_minute is not None and self._window_tokens + tokens > self.tokens_per_minute:
+            # a request bigger than the whole budget is allowed once the window is empty
+            excess = self._window_tokens + tokens - self.tokens_per_minute
+            for timestamp, window_tokens in self._window:
+                excess -= window_tokens
+                if excess <= 0:
+                    wait = max(wait, timestamp + WINDOW_SECONDS - now)
+                    break
+            else:
+                if self._window:
+                    wait = max(wait, self._window[-1][0] + WINDOW_SECONDS - now)
+        return wait
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        block until a request of `tokens` tokens is allowed and record it
+        :param tokens: the number of tokens the request is expected to use
+        :return: the number of seconds the caller waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    self._window.append((now, tokens))
+                    self._window_tokens += tokens
+                    return waited
+            time.sleep(wait)
+            waited += wait
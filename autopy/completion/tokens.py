@@ -0,0 +1,142 @@
+"""
+Token budgeting.
+
+counts tokens with the tokenizer of the model (tiktoken) so prompts and completions can be sized up front instead of
+guessing and retrying when the api rejects the request. if tiktoken is not installed (or its encoding can't be
+downloaded) the counter falls back to an estimation that splits the text the same way the tokenizer does before
+applying bpe and never counts less than one token per piece.
+"""
+import logging
+import math
+import re
+from functools import lru_cache
+from typing import Optional
+
+from autopy.models.models import ModelType
+
+logger = logging.getLogger(__name__)
+
+# the encodings of the completion models, models that are not listed use r50k_base (gpt-2 / gpt-3 vocabulary)
+ENCODINGS = {
+    ModelType.TEXT_DAVINCI_003.value: "p50k_base",
+    ModelType.TEXT_DAVINCI_002.value: "p50k_base",
+    ModelType.CODE_DAVINCI_003.value: "p50k_base",
+    ModelType.CODE_DAVINCI_002.value: "p50k_base",
+}
+DEFAULT_ENCODING = "r50k_base"
+
+# number of tokens the prompt and the completion can use together
+CONTEXT_SIZES = {
+    ModelType.TEXT_DAVINCI_003.value: 4097,
+    ModelType.TEXT_DAVINCI_002.value: 4097,
+    ModelType.CODE_DAVINCI_003.value: 8001,
+    ModelType.CODE_DAVINCI_002.value: 8001,
+}
+DEFAULT_CONTEXT_SIZE = 2049
+
+# the pre-tokenization pattern of the gpt-2 family of tokenizers
+PIECES = re.compile(r"""'s|'t|'re|'ve|'m|'ll|'d| ?[^\W\d_]+| ?\d+| ?[^\s\w]+|\s+(?!\S)|\s+""")
+
+# the typed code the model returns is the original code plus the hints, about a third longer
+TYPED_OUTPUT_RATIO = 1.35
+
+
+def context_size(model: str) -> int:
+    """
+    :param model: name of the model
+    :return: number of tokens the prompt and the completion of the model can use together
+    """
+    return CONTEXT_SIZES.get(model, DEFAULT_CONTEXT_SIZE)
+
+
+@lru_cache(maxsize=None)
+def _encoding(name: str):
+    """
+    the tiktoken encoding, or None if tiktoken is not installed or the encoding can't be loaded. tiktoken is imported on
+    the first count, and downloads the file of the encoding the first time it is used (which fails offline)
+    """
+    try:
+        import tiktoken
+    except ImportError:  # pragma: no cover - depends on the environment
+        logger.debug("tiktoken is not installed, token counts are estimated")
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except (OSError, ValueError) as e:
+        # the download errors of requests are OSErrors, a corrupted download is a ValueError
+        logger.warning(f"the {name} encoding can't be loaded, token counts are estimated: {e}")
+        return None
+
+
+def _estimate(text: str) -> int:
+    """estimation of the token count, every pre-tokenized piece is at least one token and long pieces are split"""
+    tokens = 0
+    for piece in PIECES.findall(text):
+        if piece.isspace():
+            tokens += 1 if "\n" not in piece else piece.count("\n")
+        elif piece.isascii():
+            tokens += max(1, math.ceil(len(piece.strip()) / 4))
+        else:
+            tokens += len(piece.encode("utf-8"))
+    return tokens
+
+
+@lru_cache(maxsize=8192)
+def _count(text: str, encoding: str) -> int:
+    tokenizer = _encoding(encoding)
+    if tokenizer is None:
+        return _estimate(text)
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def count_tokens(text: str, model: str = ModelType.TEXT_DAVINCI_003.value) -> int:
+    """
+    count the tokens of a text, the counts are cached so counting the same chunk again is free
+    :param text: the text to count
+    :param model: the model that will read the text
+    :return: the number of tokens
+    """
+    return _count(text, ENCODINGS.get(model, DEFAULT_ENCODING))
+
+
+def completion_budget(prompt: str, model: str, reserve: int = 16, limit: Optional[int] = None) -> int:
+    """
+    the maximal number of tokens the model can complete for a prompt
+    :param prompt: the prompt
+    :param model: name of the model
+    :param reserve: tokens to keep free as a safety margin
+    :param limit: optional upper bound of the result
+    :return: the value to send as max_tokens
+    :raise ValueError: if the prompt does not leave any room for the completion
+    """
+    budget = context_size(model) - count_tokens(prompt, model) - reserve
+    if budget <= 0:
+        raise ValueError(f"the prompt is {-budget} tokens longer than the context of {model}")
+    return min(budget, limit) if limit is not None else budget
+
+
+def fits(prompt: str, model: str, output_ratio: float = TYPED_OUTPUT_RATIO, code: Optional[str] = None) -> bool:
+    """
+    whether a prompt fits in the context of the model together with its expected output
+    :param prompt: the prompt
+    :param model: name of the model
+    :param output_ratio: the expected size of the output relatively to `code`
+    :param code: the part of the prompt that the model echoes back, defaults to the whole prompt
+    :return: True if the prompt and the expected completion fit in the context
+    """
+    expected_output = math.ceil(count_tokens(code if code is not None else prompt, model) * output_ratio)
+    return count_tokens(prompt, model) + expected_output <= context_size(model)
+
+
+def chunk_budget(instructions: str, model: str, output_ratio: float = TYPED_OUTPUT_RATIO, reserve: int = 64) -> int:
+    """
+    the number of code tokens a single chunk can have so that the instructions, the chunk and its typed version fit in
+    the context of the model
+    :param instructions: the instructions that are sent with every chunk
+    :param model: name of the model
+    :param output_ratio: the expected size of the output relatively to the code
+    :param reserve: tokens to keep free for the header of the chunk and as a safety margin
+    :return: token budget of a chunk
+    """
+    available = context_size(model) - count_tokens(instructions, model) - reserve
+    return max(1, int(available / (1 + output_ratio)))
@@ -0,0 +1,163 @@
+"""
+Performance metrics of the pipeline.
+
+every stage of the pipeline (read, chunk, prompt, request, validate, write, ...) is timed with `timer` and every
+quantity (tokens in and out, retries, cache hits, ...) is counted with `increment`. the values are aggregated in memory
+for the summary of the run and every measurement is also sent to the sinks as an event, e.g. a json lines file that can
+be aggregated over thousands of files:
+
+    from autopy import metrics
+    metrics.add_sink(metrics.JsonLinesSink("autopy_metrics.jsonl"))
+    ...
+    print(metrics.format_summary())
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Union
+
+Event = Dict[str, Any]
+
+
+class JsonLinesSink:
+    def __init__(self, path: Union[str, Path]) -> None:
+        """
+        append every event as a json line
+        :param path: the file to append to
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        # line buffered, so the events of a crashed run are not lost
+        self._file = open(self.path, "a", buffering=1)
+
+    def __call__(self, event: Event) -> None:
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class CallbackSink:
+    def __init__(self, callback: Callable[[Event], None]) -> None:
+        """
+        pass every event to a function in the current process
+        :param callback: called with every event, from the thread that measured it
+        """
+        self.callback = callback
+
+    def __call__(self, event: Event) -> None:
+        self.callback(event)
+
+    def close(self) -> None:
+        pass
+
+
+class TimerStats:
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+
+
+class Metrics:
+    def __init__(self) -> None:
+        """thread safe registry of timers and counters"""
+        self.timers: Dict[str, TimerStats] = {}
+        self.counters: Dict[str, float] = {}
+        self.sinks: List[Callable[[Event], None]] = []
+        self._lock = threading.Lock()
+
+    def _emit(self, event: Event) -> None:
+        for sink in self.sinks:
+            sink(event)
+
+    def record(self, stage: str, seconds: float, **labels: Any) -> None:
+        """record the duration of a stage that was measured by the caller"""
+        with self._lock:
+            self.timers.setdefault(stage, TimerStats()).add(seconds)
+        self._emit({"type": "timer", "name": stage, "seconds": seconds, "time": time.time(), **labels})
+
+    @contextmanager
+    def timer(self, stage: str, **labels: Any) -> Iterator[None]:
+        """
+        time the block of a stage
+        :param stage: name of the stage, e.g. request
+        :param labels: extra fields of the event, e.g. the path of the file
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, **labels)
+
+    def increment(self, name: str, value: float = 1, **labels: Any) -> None:
+        """
+        add to a counter
+        :param name: name of the counter, e.g. tokens_in
+        :param value: the amount to add
+        :param labels: extra fields of the event
+        """
+        if not value:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        self._emit({"type": "counter", "name": name, "value": value, "time": time.time(), **labels})
+
+    def add_sink(self, sink: Callable[[Event], None]) -> None:
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink: Callable[[Event], None]) -> None:
+        self.sinks.remove(sink)
+
+    def reset(self) -> None:
+        """forget the aggregated values, the sinks are kept"""
+        with self._lock:
+            self.timers = {}
+            self.counters = {}
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "timers": {stage: stats.to_dict() for stage, stats in self.timers.items()},
+                "counters": dict(self.counters),
+            }
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        lines = [f"{'stage':<20}{'count':>8}{'total':>10}{'mean':>10}{'max':>10}"]
+        for stage, stats in sorted(summary["timers"].items(), key=lambda item: item[1]["total"], reverse=True):
+            lines.append(f"{stage:<20}{stats['count']:>8}{stats['total']:>9.3f}s{stats['mean']:>9.3f}s"
+                         f"{stats['max']:>9.3f}s")
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"{name:<20}{value:>8g}")
+        return "\n".join(lines)
+
+
+# the registry that the pipeline reports to
+default = Metrics()
+timer = default.timer
+record = default.record
+increment = default.increment
+add_sink = default.add_sink
+remove_sink = default.remove_sink
+reset = default.reset
+summary = default.summary
+format_summary = default.format_summary
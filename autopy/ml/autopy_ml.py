@@ -16,19 +16,19 @@ then you can run the output file and see the results.
 """
 import os
 from pathlib import Path
-from typing import Union, Dict
-import openai
+from typing import TYPE_CHECKING, Optional, Union, Dict
 import logging
-from openai.openai_object import OpenAIObject
-from openai.error import InvalidRequestError
 import threading
-import openai
+from autopy import metrics
 # from autopy.models.models import ModelType
-import pandas as pd
-from nbconvert import NotebookExporter
-import nbformat as nbf
+from autopy.completion.cache import CompletionCache, make_key
+from autopy.completion.client import Completion, CompletionClient, CompletionRequest, OpenAIBackend
+from autopy.completion.tokens import completion_budget, context_size
+from autopy.ml.schema import DEFAULT_SAMPLE_ROWS, infer_schema
+
+if TYPE_CHECKING:
+    from autopy.ml.profile import DataProfile
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
@@ -39,10 +39,27 @@ class AutoPyML:
             path_to_csv: Union[str, Path],
             target: str,
             task: str = "predict",
-            model: str = "text-davinci-003"
+            model: str = "text-davinci-003",
+            use_cache: bool = True,
+            cache_dir: Optional[Union[str, Path]] = None,
+            client: Optional[CompletionClient] = None,
+            sample_rows: Optional[int] = DEFAULT_SAMPLE_ROWS,
+            csv_engine: str = "c",
+            memory_map: bool = False,
+            profile: bool = True
     ) -> None:
-        openai.api_key = api_key
-        logger.info("api key is set")
+        """
+        :param sample_rows: number of rows the schema (and the profile) of the csv file is inferred from, None reads
+        all of them
+        :param csv_engine: the engine that reads the csv file - c, python or pyarrow
+        :param memory_map: map the csv file into memory instead of reading it
+        :param profile: add the statistics of the columns (nulls, distinct values, ranges and top values) to the prompt
+        """
+        if client is None:
+            cache = CompletionCache(Path(cache_dir) / "completions.sqlite3" if cache_dir else None) if use_cache else None
+            client = CompletionClient(backend=OpenAIBackend(api_key=api_key), cache=cache)
+        self.client = client
+        logger.info("completion client is set")
 
         if isinstance(path_to_csv, str):
             self.path = Path(path_to_csv)
@@ -51,20 +68,34 @@ class AutoPyML:
         assert os.path.exists(self.path), "the path to the csv file does not exist"
         assert Path(self.path).suffix == ".csv", "the path to the csv file is not a csv file"
 
-        self.df = pd.read_csv(self.path)
+        # the data itself is never loaded, only its schema and statistics are needed for the prompt
+        self.profile: Optional["DataProfile"] = None
+        with metrics.timer("read", path=str(self.path)):
+            if profile:
+                # numpy and pandas are imported here and not when the module is imported
+                from autopy.ml.profile import profile_csv
+                self.profile = profile_csv(
+                    self.path,
+                    max_rows=sample_rows,
+                    engine=csv_engine,
+                    memory_map=memory_map,
+                    cache_dir=Path(cache_dir) / "profiles" if cache_dir else None,
+                    use_cache=use_cache
+                )
+                self.schema = self.profile.schema
+            else:
+                self.schema = infer_schema(self.path, max_rows=sample_rows, engine=csv_engine, memory_map=memory_map)
+        logger.info(f"csv schema is ready - {self.schema}")
         self.target = target
-        assert self.target in self.df.columns, "the target column does not exist in the csv file"
-
-        self.base_tokens = 4096
+        assert self.target in self.schema, "the target column does not exist in the csv file"
 
         self.model = model
+        self.base_tokens = context_size(self.model)
         self.task = task
-        self.prompt = self.create_prompt(self.task)
+        with metrics.timer("prompt"):
+            self.prompt = self.create_prompt(self.task)
 
     def create_prompt(self, task: str) -> str:
-        col_to_type: Dict[str, str] = {
-            col: self.df[col].dtype for col in self.df.columns
-        }
         if task == "predict":
             prompt = f"create a python code that takes as input a csv file named {self.path.stem} and returns a model that can predict the target column - {self.target}." \
                      "\nInstructions:" \
@@ -78,78 +109,68 @@ class AutoPyML:
                      "\n6. add grid search to 5 models with 3 params each" \
                      "\n7. loop over all the models and grid search for every one" \
                      "\n8. save all scores, print them and print the best model, parameters and score" \
-                     "\nthe data structure is as following: \n\n" + " | ".join(
-                [f"{col}:{col_to_type[col]}" for col in self.df.columns])
+                     "\nthe data structure is as following: \n\n" + self.schema.to_prompt()
         elif task == "analysis":
             prompt = f"create a python code that takes as input a csv file named {self.path.stem} and perform deep data analysis" \
                      f"\nusing pandas, matplotlib, seaborn and more." \
                      f"\ncreate 10 different charts both with sns and pyplot" \
                      f"\ncheck number of nulls and add statistics of the table and for each column" \
-                     "\nthe data structure is as following: \n\n" + " | ".join(
-                    [f"{col}:{col_to_type[col]}" for col in self.df.columns])
+                     "\nthe data structure is as following: \n\n" + self.schema.to_prompt()
         else:
             raise ValueError("task must be either predict or analysis")
+        if self.profile is not None:
+            prompt += "\n\nstatistics of the columns (use them instead of computing them again):\n" + self.profile.summary()
         return prompt
 
-    def send_request_to_openai(self, prompt: str, max_tokens: int) -> OpenAIObject:
+    def send_request_to_openai(self, prompt: str, max_tokens: int) -> Completion:
         """
-        send request to openai by using the completion api
+        send request to openai by using the completion client, the completion cache is checked first
         :param prompt: the prompt to send to openai
         :param max_tokens: number of tokens to send to openai
-        :return: the response from openai
+        :return: the completion
         """
-        return openai.Completion.create(
-            model=self.model,
-            prompt=prompt,
-            max_tokens=max_tokens
-        )
+        return self.client.complete(CompletionRequest(prompt, max_tokens, self.model, make_key(self.model, prompt, "")))
 
-    def save_code_into_notebook(self, python_file: str) -> str:
-        notebook = nbf.v4.new_notebook()
-        i = 0
-        batch = []
-        for i, line in enumerate(python_file.splitlines()):
-            if line == "":
-                continue
-            if "#" in line:
-                if line.startswith("#"):
-                    if len(batch) > 0:
-                        notebook["cells"].append(nbf.v4.new_code_cell("\n".join(batch)))
-                        batch = []
-
-                    if line[1] == " ":
-                        notebook["cells"].append(nbf.v4.new_markdown_cell(line))
-                    else:
-                        line = line[0] + " " + line[1:]
-                        notebook["cells"].append(nbf.v4.new_markdown_cell(line))
-                else:
-                    line = line[:line.index("#")]
-                    batch.append(line)
-            else:
-                if i == len(python_file.splitlines()) - 1:
-                    batch.append(line)
-                    notebook["cells"].append(nbf.v4.new_code_cell("\n".join(batch)))
-                batch.append(line)
+    def complete(self, prompt: str, max_tokens: int) -> str:
+        """
+        complete the prompt
+        :param prompt: the prompt to send to openai
+        :param max_tokens: number of tokens to send to openai
+        :return: the completion text
+        """
+        completion = self.send_request_to_openai(prompt, max_tokens)
+        if completion.cached:
+            logger.info("code was found in the completion cache")
+        return completion.text
 
+    def save_code_into_notebook(self, python_file: str) -> str:
+        """
+        save the generated code as a notebook (comment blocks become markdown cells) and as a python file
+        :param python_file: the generated code
+        :return: path of the notebook
+        """
         if os.path.isfile(f"{self.path.stem}_{self.task}_notebook.ipynb"):
             import random
             out_dir = f"{self.path.stem}_notebook_{random.randint(0, 100)}.ipynb"
         else:
             out_dir = f"{self.path.stem}_{self.task}_notebook.ipynb"
-        with open(out_dir, "w") as f:
-            nbf.write(notebook, f)
+        from autopy.ml.notebook import save_notebook
+        save_notebook(python_file, out_dir)
         with open(f"{self.path.stem}_{self.task}.py", "w") as f:
             f.write(python_file)
+        return out_dir
 
     def run(self):
-        response = self.send_request_to_openai(self.prompt, self.base_tokens - int(len(self.prompt) // 3.14) - 100)
-        with open("prediction_code.py", "w") as f:
-            f.write(response.choices[0].text)
-        self.save_code_into_notebook(response.choices[0].text)
-        return response.choices[0].text
+        code = self.complete(self.prompt, completion_budget(self.prompt, self.model))
+        with metrics.timer("write"):
+            with open("prediction_code.py", "w") as f:
+                f.write(code)
+            self.save_code_into_notebook(code)
+        return code
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
     # path = Path("/Users/itayd/PycharmProjects/openai-python/openai/openai_object.py")
     # path = Path(__file__).parent.parent.parent / "examples/test.py"
     path = Path("/Users/itayd/PycharmProjects/openai-python/openai/util.py")
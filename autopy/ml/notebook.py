@@ -0,0 +1,152 @@
+"""
+Conversion of generated scripts into notebooks.
+
+the script is tokenized once, top-level comment lines (outside of blocks, brackets and decorated definitions) become
+markdown cells and everything between them becomes code cells. comments inside code and `#` characters inside strings
+stay part of the code. the blank lines around every cell are kept in the metadata of the cell, so notebook_to_code gives
+back exactly the original script. nbformat is imported when a notebook is built, not with the module.
+"""
+import io
+import logging
+import tokenize
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Set, Union
+
+if TYPE_CHECKING:
+    import nbformat as nbf
+
+logger = logging.getLogger(__name__)
+
+METADATA_KEY = "autopy"
+
+
+def markdown_lines(code: str) -> Set[int]:
+    """
+    find the comment lines that can become markdown cells without splitting a statement
+    :param code: the script
+    :return: zero based numbers of the lines
+    """
+    lines = set()
+    # the comments in column 0 since the last statement. the DEDENT tokens that close a block come after the comments
+    # that follow it, so whether the comments are inside the block is known only at the next statement
+    pending: List[int] = []
+    indent = 0
+    brackets = 0
+    decorated = False
+    for token in tokenize.generate_tokens(io.StringIO(code).readline):
+        if token.type == tokenize.COMMENT:
+            if token.start[1] == 0 and not (brackets or decorated):
+                pending.append(token.start[0] - 1)
+            continue
+        if token.type in (tokenize.NL, tokenize.NEWLINE):
+            continue
+        if token.type == tokenize.INDENT:
+            indent += 1
+        elif token.type == tokenize.DEDENT:
+            indent -= 1
+            continue
+        if pending:
+            if not indent:
+                lines.update(pending)
+            pending = []
+        if token.type == tokenize.OP:
+            if token.string in "([{":
+                brackets += 1
+            elif token.string in ")]}":
+                brackets -= 1
+            elif token.string == "@" and token.start[1] == 0 and not brackets:
+                # a comment between a decorator and its definition can't be taken out of the cell
+                decorated = True
+        elif token.type == tokenize.NAME and decorated and token.string in ("def", "class"):
+            decorated = False
+    return lines
+
+
+class Cell:
+    def __init__(self, kind: str, lines: List[str]) -> None:
+        """
+        a cell of the notebook
+        :param kind: code or markdown
+        :param lines: the lines of the script in the cell, the blank lines at the edges are moved to the metadata
+        """
+        self.kind = kind
+        self.blank_before = 0
+        self.blank_after = 0
+        while lines and not lines[0]:
+            lines.pop(0)
+            self.blank_before += 1
+        while lines and not lines[-1]:
+            lines.pop()
+            self.blank_after += 1
+        self.lines = lines
+
+    def to_notebook_cell(self) -> "nbf.NotebookNode":
+        import nbformat as nbf
+
+        source = "\n".join(self.lines)
+        cell = nbf.v4.new_markdown_cell(source) if self.kind == "markdown" else nbf.v4.new_code_cell(source)
+        cell.metadata[METADATA_KEY] = {"blank_before": self.blank_before, "blank_after": self.blank_after}
+        return cell
+
+
+def split_cells(code: str) -> List[Cell]:
+    """
+    split a script into cells in a single pass
+    :param code: the script
+    :return: the cells, blank lines are part of the cell before them (or the first cell)
+    """
+    lines = code.split("\n")
+    try:
+        markdown = markdown_lines(code)
+    except (tokenize.TokenError, IndentationError, SyntaxError) as e:
+        # the generated code is broken, keep it in a single cell so it can be fixed in the notebook
+        logger.warning(f"the code can't be tokenized ({e}), it is saved as a single cell")
+        markdown = set()
+
+    cells: List[Cell] = []
+    leading_blanks = 0
+    start = 0
+    for number in range(1, len(lines) + 1):
+        if number < len(lines) and (number in markdown) == (start in markdown):
+            continue
+        cell = Cell("markdown" if start in markdown else "code", lines[start:number])
+        start = number
+        if cell.lines:
+            cells.append(cell)
+        elif cells:
+            # only blank lines, they belong to the cell before them
+            cells[-1].blank_after += cell.blank_before
+        else:
+            leading_blanks += cell.blank_before
+    if not cells:
+        cells.append(Cell("code", []))
+    cells[0].blank_before += leading_blanks
+    return cells
+
+
+def build_notebook(code: str) -> "nbf.NotebookNode":
+    """convert a script into a notebook, comment blocks become markdown cells and the statements code cells"""
+    import nbformat as nbf
+
+    notebook = nbf.v4.new_notebook()
+    notebook["cells"] = [cell.to_notebook_cell() for cell in split_cells(code)]
+    return notebook
+
+
+def notebook_to_code(notebook: "nbf.NotebookNode") -> str:
+    """convert a notebook that was built by build_notebook back into the script"""
+    lines = []
+    for cell in notebook["cells"]:
+        blanks = cell.get("metadata", {}).get(METADATA_KEY, {})
+        lines.extend([""] * blanks.get("blank_before", 0))
+        if cell["source"]:
+            lines.extend(cell["source"].split("\n"))
+        lines.extend([""] * blanks.get("blank_after", 0))
+    return "\n".join(lines)
+
+
+def save_notebook(code: str, path: Union[str, Path]) -> None:
+    import nbformat as nbf
+
+    with open(path, "w") as f:
+        nbf.write(build_notebook(code), f)
@@ -0,0 +1,270 @@
+"""
+Column statistics of csv files.
+
+the profile is built in a single pass over the chunks of the file and every statistic is a mergeable sketch, so the
+profiles of chunks (or of files that were split) can be combined without reading the data again:
+- null counts and min / max are merged exactly
+- the number of distinct values is estimated with a k minimum values sketch over 64 bit hashes of the values
+- the most frequent values are kept with a weighted misra-gries summary
+the profile of a file is cached by its path, size and modification time, and its compact summary is part of the AutoPyML prompts so
+the generated code can handle the nulls, the categorical columns and the ranges of the actual data.
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from autopy.completion.cache import DEFAULT_CACHE_DIR
+from autopy.ml.schema import DEFAULT_CHUNKSIZE, Schema, merge_chunk_dtypes, merge_dtypes, read_chunks
+
+logger = logging.getLogger(__name__)
+
+# bump when the content of the profiles changes, cached profiles of older versions are ignored
+PROFILE_VERSION = 1
+# number of minimal hashes the distinct count is estimated from, the relative error is about 1 / sqrt(k)
+KMV_SIZE = 1024
+# number of counters of the frequent values summary, values that appear more than rows / (TOP_K_COUNTERS + 1) times
+# are guaranteed to be kept
+TOP_K_COUNTERS = 64
+HASH_SPACE = float(2 ** 64)
+
+
+class ColumnProfile:
+    def __init__(self, name: str, dtype: str = "float64") -> None:
+        """
+        mergeable statistics of a single column
+        :param name: the name of the column
+        :param dtype: the dtype of the column, kept up to date by DataProfile
+        """
+        self.name = name
+        self.dtype = dtype
+        self.count = 0
+        self.nulls = 0
+        self.minimum: Optional[float] = None
+        self.maximum: Optional[float] = None
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.counters: Dict[str, int] = {}
+
+    @property
+    def is_numeric(self) -> bool:
+        return self.dtype[:1] in ("i", "u", "f")
+
+    @property
+    def distinct(self) -> int:
+        """estimation of the number of distinct values (exact when there are less than KMV_SIZE of them)"""
+        if len(self.hashes) < KMV_SIZE:
+            return len(self.hashes)
+        return int((KMV_SIZE - 1) / (float(self.hashes[-1]) / HASH_SPACE))
+
+    def top(self, k: int = 5) -> List[Tuple[str, int]]:
+        """the k most frequent values and a lower bound of their count"""
+        return sorted(self.counters.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def _merge_hashes(self, hashes: np.ndarray) -> None:
+        self.hashes = np.union1d(self.hashes, hashes)[:KMV_SIZE]
+
+    def _merge_counters(self, counts: Dict[str, int]) -> None:
+        for value, count in counts.items():
+            self.counters[value] = self.counters.get(value, 0) + count
+        if len(self.counters) > TOP_K_COUNTERS:
+            # subtract the (k + 1)-th largest count from every counter, this keeps the summary mergeable
+            threshold = sorted(self.counters.values(), reverse=True)[TOP_K_COUNTERS]
+            self.counters = {value: count - threshold for value, count in self.counters.items() if count > threshold}
+
+    def _merge_range(self, minimum: Optional[float], maximum: Optional[float]) -> None:
+        if minimum is not None:
+            self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        if maximum is not None:
+            self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+
+    def update(self, series: pd.Series) -> None:
+        """add the values of a chunk of the column"""
+        values = series.dropna()
+        self.count += len(series)
+        self.nulls += len(series) - len(values)
+        if values.empty:
+            return
+        self._merge_hashes(np.unique(pd.util.hash_pandas_object(values, index=False).to_numpy()))
+        counts = values.value_counts(sort=True)
+        # only the head of the chunk can be frequent overall, the rest is removed by the summary anyway
+        self._merge_counters({str(value): int(count) for value, count in counts.head(TOP_K_COUNTERS * 4).items()})
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            self._merge_range(float(values.min()), float(values.max()))
+
+    def merge(self, other: "ColumnProfile") -> None:
+        """add the statistics of another part of the column"""
+        self.dtype = merge_dtypes(self.dtype, other.dtype)
+        self.count += other.count
+        self.nulls += other.nulls
+        self._merge_hashes(other.hashes)
+        self._merge_counters(other.counters)
+        self._merge_range(other.minimum, other.maximum)
+
+    def summary(self) -> str:
+        """one line description of the column for the prompt"""
+        parts = [f"{self.name}:{self.dtype}"]
+        if self.nulls:
+            parts.append(f"nulls={self.nulls} ({self.nulls / self.count:.1%})")
+        parts.append(f"distinct~{self.distinct}")
+        if self.minimum is not None:
+            parts.append(f"range=[{self.minimum:g}, {self.maximum:g}]")
+        if not self.is_numeric or self.distinct <= 10:
+            top = ", ".join(f"{value[:24]}({count})" for value, count in self.top())
+            if top:
+                parts.append(f"top={top}")
+        return " ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "dtype": self.dtype,
+            "count": self.count,
+            "nulls": self.nulls,
+            "minimum": self.minimum,
+            "maximum": self.maximum,
+            "hashes": [int(value) for value in self.hashes],
+            "counters": self.counters,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ColumnProfile":
+        profile = cls(data["name"], data["dtype"])
+        profile.count = data["count"]
+        profile.nulls = data["nulls"]
+        profile.minimum = data["minimum"]
+        profile.maximum = data["maximum"]
+        profile.hashes = np.array(data["hashes"], dtype=np.uint64)
+        profile.counters = data["counters"]
+        return profile
+
+
+class DataProfile:
+    def __init__(self) -> None:
+        """mergeable statistics of a table"""
+        self.rows = 0
+        self.complete = True
+        self.columns: Dict[str, ColumnProfile] = {}
+        self.dtypes: Dict[str, str] = {}
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        """add a chunk of the table"""
+        merge_chunk_dtypes(self.dtypes, chunk)
+        for column in chunk.columns:
+            if column not in self.columns:
+                self.columns[column] = ColumnProfile(column)
+            self.columns[column].update(chunk[column])
+            self.columns[column].dtype = self.dtypes[column]
+        self.rows += len(chunk)
+
+    def merge(self, other: "DataProfile") -> None:
+        """add the statistics of another part of the table"""
+        for column, profile in other.columns.items():
+            if column in self.columns:
+                self.columns[column].merge(profile)
+            else:
+                self.columns[column] = profile
+            self.dtypes[column] = self.columns[column].dtype
+        self.rows += other.rows
+        self.complete = self.complete and other.complete
+
+    @property
+    def schema(self) -> Schema:
+        return Schema(dict(self.dtypes), self.rows, self.complete)
+
+    def summary(self, max_columns: int = 50) -> str:
+        """
+        compact description of the data for the prompts, a line per column
+        :param max_columns: columns after this number are not described
+        :return: the summary
+        """
+        lines = [f"rows={self.rows}{'' if self.complete else ' (sampled)'}"]
+        lines.extend(profile.summary() for profile in list(self.columns.values())[:max_columns])
+        if len(self.columns) > max_columns:
+            lines.append(f"... and {len(self.columns) - max_columns} more columns")
+        return "\n".join(lines)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": PROFILE_VERSION,
+            "rows": self.rows,
+            "complete": self.complete,
+            "columns": [profile.to_dict() for profile in self.columns.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DataProfile":
+        profile = cls()
+        profile.rows = data["rows"]
+        profile.complete = data["complete"]
+        for column in data["columns"]:
+            profile.columns[column["name"]] = ColumnProfile.from_dict(column)
+            profile.dtypes[column["name"]] = column["dtype"]
+        return profile
+
+
+def file_key(path: Union[str, Path]) -> str:
+    """
+    the key of the cached profile of a file - its path, size and modification time, so a file of any size is never
+    read to find its profile
+    :param path: path to the file
+    :return: hex digest of the key
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    return hashlib.sha256(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+
+
+def profile_csv(
+        path: Union[str, Path],
+        max_rows: Optional[int] = None,
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        engine: str = "c",
+        memory_map: bool = False,
+        cache_dir: Union[str, Path, None] = None,
+        use_cache: bool = True
+) -> DataProfile:
+    """
+    profile a csv file in a single pass, the profile is cached by the path, size and mtime of the file
+    :param path: path to the csv file
+    :param max_rows: number of rows to profile, None profiles the whole file
+    :param chunksize: number of rows in memory at once
+    :param engine: the csv engine - c, python or pyarrow
+    :param memory_map: map the file into memory instead of reading it (c engine only)
+    :param cache_dir: directory of the cached profiles, defaults to profiles in DEFAULT_CACHE_DIR
+    :param use_cache: whether to read and write the cached profiles
+    :return: the profile of the file
+    """
+    cache_path = None
+    if use_cache:
+        cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR / "profiles"
+        cache_path = cache_dir / f"{file_key(path)}_{max_rows or 'all'}.json"
+        if cache_path.is_file():
+            try:
+                with open(cache_path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == PROFILE_VERSION:
+                    logger.info(f"profile of {path} was found in the cache")
+                    return DataProfile.from_dict(data)
+            except (OSError, ValueError) as e:
+                logger.warning(f"ignoring unreadable profile {cache_path}: {e}")
+
+    profile = DataProfile()
+    for chunk in read_chunks(path, max_rows, chunksize, engine, memory_map):
+        profile.update(chunk)
+    if not profile.columns:
+        # a file with a header only
+        for column in pd.read_csv(Path(path), nrows=0).columns:
+            profile.columns[column] = ColumnProfile(column, "object")
+            profile.dtypes[column] = "object"
+    profile.complete = max_rows is None or profile.rows < max_rows
+    logger.debug(f"profiled {profile.rows} rows of {path}")
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump(profile.to_dict(), f)
+    return profile
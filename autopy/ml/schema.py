@@ -0,0 +1,172 @@
+"""
+Schema inference for large csv files.
+
+the prompts of AutoPyML only need the columns of the csv file and their dtypes, so instead of loading the whole file
+the schema is inferred from a bounded number of rows that are read chunk by chunk. the dtype of every chunk is
+reconciled with the dtypes of the previous chunks the same way pandas would have typed the column if it read all of
+them at once (e.g. an int column with nulls in a later chunk becomes float64). the pyarrow engine streams record
+batches with the multithreaded arrow reader when pyarrow is installed.
+
+pandas and pyarrow are imported when a file is read, so the constants and the Schema class can be imported without them.
+"""
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Union
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# number of rows the schema is inferred from by default, None reads the whole file (still in chunks)
+DEFAULT_SAMPLE_ROWS = 100_000
+DEFAULT_CHUNKSIZE = 20_000
+ENGINES = ("c", "python", "pyarrow")
+
+
+@lru_cache(maxsize=None)
+def _arrow_csv():
+    """the csv module of pyarrow, or None if pyarrow is not installed"""
+    try:
+        from pyarrow import csv as arrow_csv
+    except ImportError:  # pragma: no cover - depends on the environment
+        return None
+    return arrow_csv
+
+
+def merge_dtypes(first: str, second: str) -> str:
+    """
+    the dtype of a column that has values of both dtypes
+    :param first: dtype of the column in some of the rows
+    :param second: dtype of the column in the other rows
+    :return: the dtype pandas gives the column when it reads all the rows together
+    """
+    if first == second:
+        return first
+    kinds = {first[:1], second[:1]}
+    if kinds <= {"i", "u"}:
+        return "int64"
+    if kinds <= {"i", "u", "f"}:
+        return "float64"
+    return "object"
+
+
+def merge_chunk_dtypes(columns: Dict[str, str], chunk: "pd.DataFrame") -> None:
+    """
+    reconcile the dtypes of a chunk with the dtypes of the previous chunks
+    :param columns: mapping from a column to its dtype so far, updated in place
+    :param chunk: the next chunk of the file
+    """
+    for column, dtype in chunk.dtypes.items():
+        # an empty column is float64 for pandas (all NaN), arrow reads it as null - treat both the same
+        dtype = str(dtype) if chunk[column].notna().any() or column not in columns else "float64"
+        columns[column] = merge_dtypes(columns[column], dtype) if column in columns else dtype
+
+
+class Schema:
+    def __init__(self, columns: Dict[str, str], rows: int, complete: bool) -> None:
+        """
+        :param columns: mapping from the name of a column to its dtype, in the order of the file
+        :param rows: number of rows the schema was inferred from
+        :param complete: whether all the rows of the file were read
+        """
+        self.columns = columns
+        self.rows = rows
+        self.complete = complete
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.columns
+
+    def __repr__(self) -> str:
+        return f"Schema({len(self.columns)} columns, {self.rows} rows{'' if self.complete else ', sampled'})"
+
+    def to_prompt(self) -> str:
+        """the structure of the data in the format of the prompts - `col:dtype | col:dtype`"""
+        return " | ".join(f"{column}:{dtype}" for column, dtype in self.columns.items())
+
+
+def _pandas_chunks(path: Path, max_rows: Optional[int], chunksize: int, engine: str,
+                   memory_map: bool) -> Iterator["pd.DataFrame"]:
+    import pandas as pd
+
+    # the options of the c engine, the python engine does not accept them
+    options = {"low_memory": False, "memory_map": memory_map} if engine == "c" else {}
+    with pd.read_csv(path, chunksize=chunksize, nrows=max_rows, engine=engine, **options) as reader:
+        yield from reader
+
+
+def _arrow_chunks(path: Path, max_rows: Optional[int], chunksize: int) -> Iterator["pd.DataFrame"]:
+    arrow_csv = _arrow_csv()
+    read_options = arrow_csv.ReadOptions(block_size=max(1 << 20, chunksize * 64))
+    rows = 0
+    for batch in arrow_csv.open_csv(str(path), read_options=read_options):
+        if max_rows is not None and rows + batch.num_rows > max_rows:
+            batch = batch.slice(0, max_rows - rows)
+        rows += batch.num_rows
+        yield batch.to_pandas()
+        if max_rows is not None and rows >= max_rows:
+            return
+
+
+def read_chunks(
+        path: Union[str, Path],
+        max_rows: Optional[int] = DEFAULT_SAMPLE_ROWS,
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        engine: str = "c",
+        memory_map: bool = False
+) -> Iterator["pd.DataFrame"]:
+    """
+    read a csv file chunk by chunk
+    :param path: path to the csv file
+    :param max_rows: number of rows to read, None reads the whole file
+    :param chunksize: number of rows in memory at once
+    :param engine: the csv engine - c, python or pyarrow (falls back to c if pyarrow is not installed)
+    :param memory_map: map the file into memory instead of reading it (c engine only)
+    :return: iterator of data frames
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of {', '.join(ENGINES)}")
+    path = Path(path)
+    if engine == "pyarrow" and _arrow_csv() is None:
+        logger.warning("pyarrow is not installed, using the c engine")
+        engine = "c"
+    if engine == "pyarrow":
+        return _arrow_chunks(path, max_rows, chunksize)
+    return _pandas_chunks(path, max_rows, chunksize, engine, memory_map)
+
+
+def infer_schema(
+        path: Union[str, Path],
+        max_rows: Optional[int] = DEFAULT_SAMPLE_ROWS,
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        engine: str = "c",
+        memory_map: bool = False
+) -> Schema:
+    """
+    infer the columns and dtypes of a csv file without loading all of it into memory
+    :param path: path to the csv file
+    :param max_rows: number of rows to infer the schema from, None reads the whole file
+    :param chunksize: number of rows in memory at once
+    :param engine: the csv engine - c, python or pyarrow (falls back to c if pyarrow is not installed)
+    :param memory_map: map the file into memory instead of reading it (c engine only)
+    :return: the schema of the file
+    """
+    chunks = read_chunks(path, max_rows, chunksize, engine, memory_map)
+    columns: Dict[str, str] = {}
+    order: List[str] = []
+    rows = 0
+    for chunk in chunks:
+        if not order:
+            order = list(chunk.columns)
+        merge_chunk_dtypes(columns, chunk)
+        rows += len(chunk)
+
+    if not order:
+        # a file with a header only
+        import pandas as pd
+        order = list(pd.read_csv(Path(path), nrows=0).columns)
+        columns = {column: "object" for column in order}
+    complete = max_rows is None or rows < max_rows
+    logger.debug(f"inferred the schema of {path} from {rows} rows")
+    return Schema({column: columns[column] for column in order}, rows, complete)
@@ -1,62 +1,282 @@
-import threading
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.preprocessing import StandardScaler
+"""
+Model search.
+
+every (model, parameters, cross validation fold) combination is an independent task, the tasks of all the models are
+scheduled together on a joblib process pool so the wall-clock time scales with the number of cores instead of the number
+of models. the scaled train arrays are passed to the workers as read-only memory maps, so they are written to disk once
+per search and not pickled for every task.
+"""
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import BaseEstimator, clone
+from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import ParameterGrid, check_cv, train_test_split
+from sklearn.preprocessing import StandardScaler
 from sklearn.svm import SVC
-from sklearn.ensemble import RandomForestClassifier
 
-class LazyClassifier:
-    def __init__(self, model, params, X_train, y_train, X_test, y_test):
-        self.model = model
-        self.params = params
-        self.X_train = X_train
-        self.y_train = y_train
-        self.X_test = X_test
-        self.y_test = y_test
-
-    def evaluate(self):
-        grid_search = GridSearchCV(self.model, self.params, cv=5)
-        grid_search.fit(self.X_train, self.y_train)
-        score = grid_search.score(self.X_test, self.y_test)
-        return grid_search.best_params_, score
-
-def find_best_model(X, y):
-    # Preprocess data
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
-    scaler = StandardScaler()
-    X_train = scaler.fit_transform(X_train)
-    X_test = scaler.transform(X_test)
-
-    # Define models and their respective hyperparameter grids
-    models = [
+logger = logging.getLogger(__name__)
+
+# arrays bigger than this are memory mapped to the workers instead of being pickled
+MAX_NBYTES = "1M"
+
+ModelSpec = Tuple[BaseEstimator, Dict[str, List[Any]]]
+
+
+def default_models() -> List[ModelSpec]:
+    """the models and hyperparameter grids that are searched by default"""
+    return [
         (LogisticRegression(), {'C': [0.1, 1, 10]}),
         (SVC(), {'C': [0.1, 1, 10], 'kernel': ['linear', 'rbf']}),
         (RandomForestClassifier(), {'n_estimators': [10, 100, 1000]})
     ]
 
-    # Run grid search in a separate thread for each model
-    threads = []
-    results = {}
-    classifiers = []
-    for model, params in models:
-        classifier = LazyClassifier(model, params, X_train, y_train, X_test, y_test)
-        classifiers.append(classifier)
-        thread = threading.Thread(target=classifier.evaluate)
-        threads.append(thread)
-        thread.start()
 
-    # Wait for all threads to complete
-    for thread in threads:
-        thread.join()
+class ModelResult:
+    def __init__(self, name: str, params: Dict[str, Any], cv_score: float, test_score: float, fit_time: float,
+                 estimator: Optional[BaseEstimator] = None) -> None:
+        """
+        the best parameters of a single model
+        :param name: name of the model
+        :param params: the parameters with the best cross validation score
+        :param cv_score: mean cross validation score of the parameters
+        :param test_score: score of the model that was refitted with the parameters on the test set
+        :param fit_time: total seconds spent fitting this model during the search
+        :param estimator: the refitted model
+        """
+        self.name = name
+        self.params = params
+        self.cv_score = cv_score
+        self.test_score = test_score
+        self.fit_time = fit_time
+        self.estimator = estimator
+
+    def __repr__(self) -> str:
+        return f"ModelResult({self.name}, test_score={self.test_score:.4f}, params={self.params})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "params": self.params,
+            "cv_score": self.cv_score,
+            "test_score": self.test_score,
+            "fit_time": self.fit_time,
+        }
+
+
+class Leaderboard:
+    def __init__(self, results: List[ModelResult], elapsed: float = 0.0) -> None:
+        """
+        the results of a model search, best model first
+        :param results: the result of every model
+        :param elapsed: wall-clock seconds of the search
+        """
+        self.results = sorted(results, key=lambda result: (result.test_score, result.cv_score), reverse=True)
+        self.elapsed = elapsed
+
+    @property
+    def best(self) -> ModelResult:
+        return self.results[0]
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"elapsed": self.elapsed, "results": [result.to_dict() for result in self.results]}
+
+    def summary(self) -> str:
+        lines = [f"{'rank':<5}{'model':<28}{'test':>8}{'cv':>8}{'fit time':>10}  params"]
+        for rank, result in enumerate(self.results, 1):
+            lines.append(f"{rank:<5}{result.name:<28}{result.test_score:>8.4f}{result.cv_score:>8.4f}"
+                         f"{result.fit_time:>9.1f}s  {result.params}")
+        return "\n".join(lines)
+
+
+def _fit_and_score(estimator: BaseEstimator, params: Dict[str, Any], X: np.ndarray, y: np.ndarray,
+                   train: np.ndarray, test: np.ndarray) -> Tuple[float, float]:
+    """fit a copy of the estimator on the train indices, runs inside the workers"""
+    model = clone(estimator).set_params(**params)
+    start = time.perf_counter()
+    model.fit(X[train], y[train])
+    return model.score(X[test], y[test]), time.perf_counter() - start
+
+
+def _refit(estimator: BaseEstimator, params: Dict[str, Any], X_train: np.ndarray, y_train: np.ndarray,
+           X_test: np.ndarray, y_test: np.ndarray) -> Tuple[BaseEstimator, float, float]:
+    """fit the estimator with the best parameters on all the train set and score it on the test set"""
+    model = clone(estimator).set_params(**params)
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    return model, model.score(X_test, y_test), time.perf_counter() - start
+
+
+def model_names(models: Sequence[ModelSpec]) -> List[str]:
+    """unique names of the models, the class name with a suffix when the same class is searched more than once"""
+    names = []
+    for model, _ in models:
+        name = type(model).__name__
+        names.append(name if name not in names else f"{name}_{len(names)}")
+    return names
+
+
+def prepare_data(X, y, test_size: float = 0.2, scale: bool = True,
+                 random_state: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """split the data into contiguous train and test arrays, and fit the scaler on the train set only"""
+    X_train, X_test, y_train, y_test = train_test_split(np.asarray(X), np.asarray(y), test_size=test_size,
+                                                        random_state=random_state)
+    if scale:
+        scaler = StandardScaler()
+        X_train = scaler.fit_transform(X_train)
+        X_test = scaler.transform(X_test)
+    return (np.ascontiguousarray(X_train), np.ascontiguousarray(X_test),
+            np.ascontiguousarray(y_train), np.ascontiguousarray(y_test))
+
+
+Candidate = Tuple[int, Dict[str, Any]]
+SEARCH_MODES = ("grid", "halving")
+
+
+def _cross_validate(parallel: Parallel, models: Sequence[ModelSpec], candidates: List[Candidate], X: np.ndarray,
+                    y: np.ndarray, cv: int) -> List[Tuple[float, float]]:
+    """
+    cross validate all the candidates together on the pool
+    :return: the mean score and the total fit time of every candidate
+    """
+    splits = list(check_cv(cv, y, classifier=True).split(X, y))
+    scores = parallel(
+        delayed(_fit_and_score)(models[index][0], params, X, y, train, test)
+        for index, params in candidates for train, test in splits
+    )
+    results = []
+    for position in range(len(candidates)):
+        folds = scores[position * len(splits):(position + 1) * len(splits)]
+        results.append((float(np.mean([score for score, _ in folds])), sum(fit_time for _, fit_time in folds)))
+    return results
+
+
+def _refit_best(parallel: Parallel, models: Sequence[ModelSpec], best: Dict[int, Tuple[float, Dict[str, Any]]],
+                fit_times: List[float], X_train: np.ndarray, y_train: np.ndarray, X_test: np.ndarray,
+                y_test: np.ndarray) -> List[ModelResult]:
+    """refit the best parameters of every model on all the train set and score them on the test set"""
+    indices = sorted(best)
+    refitted = parallel(
+        delayed(_refit)(models[index][0], best[index][1], X_train, y_train, X_test, y_test) for index in indices
+    )
+    names = model_names(models)
+    return [
+        ModelResult(names[index], best[index][1], best[index][0], test_score, fit_times[index] + fit_time, estimator)
+        for index, (estimator, test_score, fit_time) in zip(indices, refitted)
+    ]
+
+
+def grid_search(models: Sequence[ModelSpec], X_train: np.ndarray, y_train: np.ndarray, X_test: np.ndarray,
+                y_test: np.ndarray, cv: int = 5, n_jobs: int = -1) -> List[ModelResult]:
+    """
+    exhaustive cross validated search of every model and parameters, in a single pool
+    :return: the best parameters of every model
+    """
+    candidates = [(index, params) for index, (_, grid) in enumerate(models) for params in ParameterGrid(grid)]
+    with Parallel(n_jobs=n_jobs, max_nbytes=MAX_NBYTES, mmap_mode="r") as parallel:
+        fit_times = [0.0] * len(models)
+        best: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+        for (index, params), (cv_score, fit_time) in zip(
+                candidates, _cross_validate(parallel, models, candidates, X_train, y_train, cv)):
+            fit_times[index] += fit_time
+            if index not in best or cv_score > best[index][0]:
+                best[index] = (cv_score, params)
+        return _refit_best(parallel, models, best, fit_times, X_train, y_train, X_test, y_test)
+
+
+def halving_search(models: Sequence[ModelSpec], X_train: np.ndarray, y_train: np.ndarray, X_test: np.ndarray,
+                   y_test: np.ndarray, cv: int = 5, n_jobs: int = -1, factor: int = 3,
+                   min_samples: Optional[int] = None, budget: Optional[float] = None,
+                   random_state: Optional[int] = None) -> List[ModelResult]:
+    """
+    successive halving across all the models and parameters. the first round cross validates every candidate on a
+    small subsample of the train set, and every round keeps the best 1 / factor of the candidates and gives them factor
+    times more samples, until the last round runs on the whole train set.
+    :param factor: the elimination rate of the candidates and the growth rate of the samples
+    :param min_samples: number of samples of the first round, defaults to enough samples for every class in every fold
+    :param budget: seconds of search, the search stops before a round that is not expected to end within the budget
+    and the leaders so far are refitted
+    :param random_state: seed of the subsamples
+    :return: the best parameters of every model, at the last round the model reached
+    """
+    start = time.perf_counter()
+    candidates = [(index, params) for index, (_, grid) in enumerate(models) for params in ParameterGrid(grid)]
+    samples = len(X_train)
+    min_samples = min(samples, min_samples or max(20, 2 * cv * len(np.unique(y_train))))
+    rounds = max(1, math.ceil(math.log(len(candidates), factor))) if len(candidates) > 1 else 1
+    rounds = min(rounds, 1 + int(math.log(samples / min_samples, factor)))
+    order = np.random.RandomState(random_state).permutation(samples)
+
+    fit_times = [0.0] * len(models)
+    best: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+    with Parallel(n_jobs=n_jobs, max_nbytes=MAX_NBYTES, mmap_mode="r") as parallel:
+        last_round = 0.0
+        for round_ in range(rounds):
+            elapsed = time.perf_counter() - start
+            if budget is not None and round_ and elapsed + last_round > budget:
+                logger.info(f"stopping the search after {round_} rounds, the next one does not fit in the budget")
+                break
+            round_samples = max(min_samples, samples // factor ** (rounds - 1 - round_))
+            subset = np.sort(order[:round_samples])
+            results = _cross_validate(parallel, models, candidates, X_train[subset], y_train[subset], cv)
+
+            # the scores of a round replace the scores of the previous rounds, they are based on more samples
+            round_best: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+            for (index, params), (cv_score, fit_time) in zip(candidates, results):
+                fit_times[index] += fit_time
+                if index not in round_best or cv_score > round_best[index][0]:
+                    round_best[index] = (cv_score, params)
+            best.update(round_best)
+            logger.debug(f"round {round_ + 1}/{rounds}: {len(candidates)} candidates on {round_samples} samples")
 
-    # Collect results from each thread
-    for classifier in classifiers:
-        results[classifier.model] = classifier.evaluate()
+            ranked = sorted(range(len(candidates)), key=lambda position: results[position][0], reverse=True)
+            candidates = [candidates[position] for position in ranked[:max(1, math.ceil(len(candidates) / factor))]]
+            last_round = time.perf_counter() - start - elapsed
+        return _refit_best(parallel, models, best, fit_times, X_train, y_train, X_test, y_test)
 
-    # Choose the model with the highest score
-    best_model = max(results, key=lambda x: results[x]['score'])
-    return best_model, results[best_model]['params']
 
+def find_best_model(X, y, models: Optional[Sequence[ModelSpec]] = None, cv: int = 5, test_size: float = 0.2,
+                    n_jobs: int = -1, random_state: Optional[int] = None, search: str = "grid",
+                    budget: Optional[float] = None, factor: int = 3) -> Leaderboard:
+    """
+    find the best model and hyperparameters for a classification task
+    :param X: the features
+    :param y: the target
+    :param models: (model, parameter grid) pairs to search, defaults to default_models()
+    :param cv: number of cross validation folds
+    :param test_size: the part of the data the models are scored on after the search
+    :param n_jobs: number of worker processes, -1 uses all the cores
+    :param random_state: seed of the train / test split and of the subsamples
+    :param search: grid - cross validate every parameters on all the train set, halving - successive halving that
+    starts from small subsamples and promotes only the leaders (see halving_search)
+    :param budget: seconds of search, only used by the halving search
+    :param factor: elimination rate of the halving search
+    :return: leaderboard of the models, the best first
+    """
+    if search not in SEARCH_MODES:
+        raise ValueError(f"search must be one of {', '.join(SEARCH_MODES)}")
+    models = list(models) if models is not None else default_models()
+    start = time.perf_counter()
+    X_train, X_test, y_train, y_test = prepare_data(X, y, test_size, random_state=random_state)
+    if search == "halving":
+        results = halving_search(models, X_train, y_train, X_test, y_test, cv=cv, n_jobs=n_jobs, factor=factor,
+                                 budget=budget, random_state=random_state)
+    else:
+        results = grid_search(models, X_train, y_train, X_test, y_test, cv=cv, n_jobs=n_jobs)
+    leaderboard = Leaderboard(results, time.perf_counter() - start)
+    logger.info(f"searched {len(models)} models in {leaderboard.elapsed:.1f}s, the best is {leaderboard.best.name}")
+    return leaderboard
 
 
 if __name__ == "__main__":
@@ -65,8 +285,9 @@ if __name__ == "__main__":
     X, y = load_iris(return_X_y=True)
 
     # Find the best model
-    best_model, best_params = find_best_model(X, y)
+    leaderboard = find_best_model(X, y)
 
     # Print the best model and its hyperparameters
-    print(f"Best model: {best_model}")
-    print(f"Best parameters: {best_params}")
\ No newline at end of file
+    print(leaderboard.summary())
+    print(f"Best model: {leaderboard.best.name}")
+    print(f"Best parameters: {leaderboard.best.params}")
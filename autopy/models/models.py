@@ -12,6 +12,16 @@ class ModelType(Enum):
     TEXT_CURIE_001 = "text-curie-001"
 
 
+class OutputType(Enum):
+    # a typed copy of the file, `<name>_typed.py`
+    FILE = "file"
+    # only the hints are requested, and they are written into the file itself
+    INPLACE = "inplace"
+    # only the hints are requested, and they are written as a unified diff, `<name>_typed.diff`
+    DIFF = "diff"
+    # only the hints are requested, and they are written as a stub next to the file, `<name>.pyi`
+    PYI = "pyi"
+
 
 if __name__ == '__main__':
     print(ModelType.TEXT_DAVINCI_003.value)
@@ -14,72 +14,145 @@ when the input file is entered, we parse it and send it to ChatGPT that generate
 then you can run the output file and see the results.
 
 """
+import ast
+import json
 import os
+from functools import partial
 from pathlib import Path
-from typing import Union
-from utils.validator import Validator
+from typing import Dict, List, Optional, Tuple, Union
+from autopy.type.utils.validator import Validator, ValidatorParser
 import logging
-from openai.openai_object import OpenAIObject
-from openai.error import InvalidRequestError
-from autopy.models.models import ModelType
-import openai
+from autopy import metrics
+from autopy.completion.cache import CompletionCache, make_key
+from autopy.completion.client import Completion, CompletionClient, CompletionRequest, OpenAIBackend
+from autopy.completion.tokens import chunk_budget, completion_budget, context_size, count_tokens, fits
+from autopy.models.models import ModelType, OutputType
+from autopy.type.utils.annotations import Annotations, apply_annotations
+from autopy.type.utils.chunker import DEFINITION_NODES, Chunk, chunk_source
+from autopy.type.utils.incremental import IMPORT_NODES, Manifest, fingerprint, manifest_path_for, node_source
+from autopy.type.utils.inference import infer_annotations
+from autopy.type.utils.streaming import StreamMatcher, TopLevelSplitter
+from autopy.type.utils.coalesce import Unit
+from autopy.type.utils.hints import (HINTS_INSTRUCTIONS, HINTS_OUTPUT_RATIO, apply_hints, hint_template,
+                                     merge_templates, parse_hints, requested_count, unified_diff)
+from autopy.type.utils.symbols import DEFAULT_CONTEXT_TOKENS, ProjectContext, SymbolIndex, context_prompt
+from autopy.type.utils.stubs import MODEL, is_foreign, module_stub, read_header, stub_header, stub_path, write_stub
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
+class Plan:
+    # how the file is typed
+    INCREMENTAL = "incremental"  # only the statements that changed since the manifest of the previous run
+    RESOLVED = "resolved"  # only the statements that still miss hints after the local inference
+    CHUNKS = "chunks"  # chunk by chunk, the file is too long for a single request
+    STREAM = "stream"  # the whole file, written while it is generated
+    WHOLE = "whole"  # the whole file in a single request
+    ANNOTATIONS = "annotations"  # only the missing hints are requested, they are written into the source or a stub
+
+    def __init__(self, route: str, typed_python_path: Path, tree: Optional[ast.Module], context: str, prompt: str,
+                 manifest: Optional[Manifest], resolved: List[ast.stmt]) -> None:
+        """
+        the decisions about a file that are made before anything is sent to the model
+        :param route: how the file is typed
+        :param typed_python_path: the file to write
+        :param tree: the parsed python file, None if it can not be parsed
+        :param context: the project context of the whole file
+        :param prompt: the prompt of the whole file
+        :param manifest: the manifest of the previous run, for the incremental route
+        :param resolved: the statements that were typed locally
+        """
+        self.route = route
+        self.typed_python_path = typed_python_path
+        self.tree = tree
+        self.context = context
+        self.prompt = prompt
+        self.manifest = manifest
+        self.resolved = resolved
+
+
 class AutoPy:
-    def __init__(self, api_key: str, path: Union[str, Path], model: str = ModelType.TEXT_DAVINCI_003.value) -> None:
-        openai.api_key = api_key
-        logger.info("api key is set")
+    def __init__(
+            self,
+            api_key: str,
+            path: Union[str, Path],
+            model: str = ModelType.TEXT_DAVINCI_003.value,
+            use_cache: bool = True,
+            cache_dir: Optional[Union[str, Path]] = None,
+            client: Optional[CompletionClient] = None,
+            symbols: Optional[SymbolIndex] = None,
+            context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+            output: str = OutputType.FILE.value,
+            force: bool = False
+    ) -> None:
+        # an existing client (and its cache and rate limiter) can be shared between several instances,
+        # see autopy.type.batch
+        if client is None:
+            cache = CompletionCache(Path(cache_dir) / "completions.sqlite3" if cache_dir else None) if use_cache else None
+            client = CompletionClient(backend=OpenAIBackend(api_key=api_key), cache=cache)
+        self.client = client
+        logger.info("completion client is set")
 
         self.path = path
-        self.python_file = open(self.path, "r").read()
+        with metrics.timer("read"):
+            with open(self.path, "r") as f:
+                self.python_file = f.read()
+        # the hints are written into the original file (or diffed against it) when only they are requested
+        self.original_file = self.python_file
+        self.output = OutputType(output).value
+        # overwrite the .pyi stub even if it was not written by autopy
+        self.force = force
         self.model = model
         self.validator = Validator()
         self.base_prompt = "\n this is the code:\n" + self.python_file
-        self.base_tokens = 4096
         self.instructions = [
             "add type hints to each and every variable in each class, follow the PEP8 guidelines",
             # "add logs to the code using logging library add documentation to each and every class or function"
         ]
-        self.imports = "\n".join([line for line in self.python_file.split("\n") if
-                                  line.strip(" ").startswith("import") or line.strip(" ").startswith("from")])
+        self.base_tokens = context_size(self.model)
+        # the signatures of the names that the file imports from other modules of the project, see
+        # autopy.type.utils.symbols
+        self.symbols = symbols
+        self.context_tokens = context_tokens if symbols is not None else 0
+        self.project: Optional[ProjectContext] = None
+        self.chunk_tokens = chunk_budget("\n".join(self.instructions), self.model, reserve=64 + self.context_tokens)
+        self.hint_chunk_tokens = chunk_budget(HINTS_INSTRUCTIONS, self.model, output_ratio=HINTS_OUTPUT_RATIO,
+                                              reserve=64 + self.context_tokens)
+        self.tokens_used = 0
 
-    def send_request_to_openai(self, prompt: str, max_tokens: int) -> OpenAIObject:
+    def send_request_to_openai(self, prompt: str, max_tokens: int, cache_key: Optional[str] = None) -> Completion:
         """
-        send request to openai by using the completion api
+        send request to openai by using the completion client, retries and backoff are handled by the client
         :param prompt: the prompt to send to openai
         :param max_tokens: number of tokens to send to openai
-        :return: the response from openai
+        :param cache_key: key of the completion in the completion cache
+        :return: the completion
         """
-        return openai.Completion.create(
-            model=self.model,
-            prompt=prompt,
-            max_tokens=max_tokens
-        )
+        completion = self.client.complete(CompletionRequest(prompt, max_tokens, self.model, cache_key))
+        self.tokens_used += completion.total_tokens
+        return completion
 
-    def create_typed_python_file(self, prompt: str, window: int = 20, max_len: int = 100, max_tokens=42) -> str:
+    def create_typed_python_file(
+            self,
+            prompt: str,
+            window: int = 20,
+            max_len: int = 100,
+            max_tokens=42,
+            cache_key: Optional[str] = None
+    ) -> str:
         """
         create typed python file by using openai api, and especially the chatgpt model that help us to add type hints, logs and comments, and more.
         :param prompt: the prompt to send to openai (the python file + instructions what to do)
         :param window: the window size - which part of the prompt to send to openai (the last window size words
         :param max_len: the maximum length of the output
         :param max_tokens: the maximum number of tokens to send to openai in each batch
+        :param cache_key: key of the completion in the completion cache
         :return: the function return a python file in a string format.
         """
-        for _ in range(3):
-            try:
-                response = self.send_request_to_openai(prompt, max_tokens)
-                return response.choices[0].text
-            except InvalidRequestError as e:
-                logger.error(f"error: {e}")
-                # if the error is because of the max_tokens, we will reduce the max_tokens by 10% and try again
-                if "max_tokens" in str(e):
-                    max_tokens = int(max_tokens * 0.9)
-                    logger.info(f"max_tokens was too high, reducing it to {max_tokens}")
-                    continue
-        return Exception("error in creating typed python file")
+        completion = self.send_request_to_openai(prompt, max_tokens, cache_key)
+        if completion.cached:
+            logger.info("typed code was found in the completion cache")
+        return completion.text
         # logger.info(f"response is ready")
         # old_code = code
         # if i == 0:
@@ -96,47 +169,497 @@ class AutoPy:
 
         # return code[location_end_prompt:]
 
+    def stream_typed_python_file(
+            self,
+            prompt: str,
+            max_tokens: int,
+            tree: ast.Module,
+            manifest: Manifest,
+            typed_python_path: Path,
+            cache_key: Optional[str] = None,
+            max_invalid: int = 3
+    ) -> None:
+        """
+        stream the typed file from openai and write every top-level statement as soon as it is complete and valid.
+        statements that are not valid are written as they are in the original file, and when more than `max_invalid`
+        of them arrive the generation is cancelled. at the end whatever is missing is typed again chunk by chunk, and the
+        file is written again in the order of the original file.
+        :param prompt: the prompt to send to openai (the python file + instructions what to do)
+        :param max_tokens: the maximum number of tokens of the completion
+        :param tree: the parsed python file
+        :param manifest: manifest of the run, the valid statements are recorded in it
+        :param typed_python_path: the file to write
+        :param cache_key: key of the completion in the completion cache
+        :param max_invalid: number of invalid statements after which the generation is cancelled
+        :return: None
+        """
+        lines = self.python_file.splitlines(keepends=True)
+        matcher = StreamMatcher(tree.body)
+        splitter = TopLevelSplitter()
+        invalid = 0
+        self.tokens_used += count_tokens(prompt, self.model)
+
+        def write(block: str) -> int:
+            self.tokens_used += count_tokens(block, self.model)
+            failed = 0
+            for typed_node, original, typed in matcher.match(block):
+                if original is None and isinstance(typed_node, (ast.Import, ast.ImportFrom)):
+                    manifest.add_import(typed)
+                elif original is not None and self.validate_statement(original, typed):
+                    manifest.record(original, typed)
+                else:
+                    failed += 1
+                    if original is None:
+                        continue
+                    typed = node_source(lines, original)
+                f.write(typed + "\n\n")
+            f.flush()
+            return failed
+
+        stream = self.client.stream(CompletionRequest(prompt, max_tokens, self.model, cache_key, self.validate_file))
+        with open(typed_python_path, "w") as f:
+            try:
+                for delta in stream:
+                    for block in splitter.feed(delta):
+                        invalid += write(block)
+                    if invalid > max_invalid:
+                        logger.warning(f"{invalid} invalid statements so far, cancelling the generation")
+                        break
+                else:
+                    for block in splitter.close():
+                        invalid += write(block)
+            finally:
+                # cancels the request if the stream was not consumed to the end
+                stream.close()
+
+        # write the whole file again, this time in the order of the original file and with the missing statements
+        typed_code = self.retype_changed(tree, manifest)
+        with open(typed_python_path, "w") as f:
+            f.write(typed_code)
+
     def validate_file(self, python_file: str) -> bool:
         """
-        this function takes as input the new generated python file and make sure that each and every var has type hint as well as function signatures.
+        this function takes as input the new generated python file and make sure that it compiles, that it is the
+        original code apart from the type hints and that every function signature has type hints.
         :param python_file: the generated python file that gpt model output
-        :return: python
+        :return: True if the generated file is valid
+        """
+        with metrics.timer("validate"):
+            result = self.validator.validate(self.python_file, python_file)
+        for error in result.errors:
+            logger.info(f"typed file is not valid: {error}")
+        return result.valid
+
+    def validate_statement(self, node: ast.stmt, typed: str) -> bool:
+        """
+        validate the typed version of a single top-level statement
+        :param node: the original statement
+        :param typed: the typed version that gpt model output
+        :return: True if the typed statement is valid
+        """
+        with metrics.timer("validate"):
+            result = self.validator.validate_node(node, typed)
+        for error in result.errors:
+            logger.debug(f"typed statement in line {node.lineno} is not valid: {error}")
+        return result.valid
+
+    def validate_chunk(self, chunk: Chunk, typed_chunk: str) -> bool:
         """
-        parsed_python_file = python_file.split("\n")
-        for i, line in enumerate(parsed_python_file):
-            if line.strip(" ").startswith("def"):
-                if self.validator.validate_function_signature(line):
+        validate a typed chunk, chunks that fail are requested again without touching the rest of the file
+        :param chunk: the original chunk
+        :param typed_chunk: the chunk that gpt model output
+        :return: True if the typed chunk is valid
+        """
+        original = ast.Module(body=chunk.nodes, type_ignores=[])
+        with metrics.timer("validate"):
+            result = self.validator.validate(original, chunk.strip_header(typed_chunk))
+        for error in result.errors:
+            logger.info(f"typed {chunk} is not valid: {error}")
+        return result.valid
+
+    def project_context(self, nodes: List[ast.stmt]) -> str:
+        """
+        the signatures of the names that the nodes import from other modules of the project
+        :param nodes: the statements that are sent to the model
+        :return: the stubs, empty when there is no symbol index or the nodes use nothing from the project
+        """
+        if self.project is None:
+            return ""
+        with metrics.timer("context"):
+            return self.project.for_nodes(nodes, self.context_tokens, partial(count_tokens, model=self.model))
+
+    def chunk_request(self, chunk: Chunk) -> Optional[CompletionRequest]:
+        """
+        the request of a chunk. a single top-level statement can be longer than the chunk budget, then the project
+        context and the header of the chunk are left out of the prompt until it fits in the context of the model
+        :param chunk: the chunk to type
+        :return: the request, None if even the statements of the chunk alone do not fit
+        """
+        instructions = "\n".join(self.instructions)
+        context = context_prompt(self.project_context(chunk.nodes))
+        for context, code in ((context, chunk.prompt_source), ("", chunk.prompt_source), ("", chunk.source)):
+            prompt = instructions + context + "\n this is the code:\n" + code
+            try:
+                max_tokens = completion_budget(prompt, self.model)
+            except ValueError as e:
+                logger.debug(f"{chunk} does not fit in a single request: {e}")
+                continue
+            return CompletionRequest(
+                prompt=prompt,
+                max_tokens=max_tokens,
+                model=self.model,
+                cache_key=make_key(self.model, instructions + context, code),
+                validate=partial(self.validate_chunk, chunk),
+            )
+        logger.warning(f"lines {chunk.start_line}-{chunk.end_line} of {self.path} are too long for {self.model}, "
+                       f"they are left without type hints")
+        metrics.increment("oversized_chunks")
+        return None
+
+    def complete_chunks(self, chunks: List[Chunk]) -> List[Optional[str]]:
+        """
+        type chunks of the file concurrently, every chunk is validated on its own
+        :param chunks: the chunks to type
+        :return: the typed code of every chunk, without the context header of the chunk. None for the chunks that are
+        too long to be sent to the model or whose request failed, they stay untyped until the next run
+        """
+        with metrics.timer("prompt"):
+            requests = [self.chunk_request(chunk) for chunk in chunks]
+        sent = [(chunk, request) for chunk, request in zip(chunks, requests) if request is not None]
+        typed_chunks: Dict[int, str] = {}
+        for (chunk, _), completion in zip(sent, self.client.complete_many([request for _, request in sent])):
+            self.tokens_used += completion.total_tokens
+            if completion.error is None:
+                typed_chunks[chunk.index] = chunk.strip_header(completion.text)
+        return [typed_chunks.get(chunk.index) for chunk in chunks]
+
+    def complete_hints(self, tree: ast.Module) -> Annotations:
+        """
+        ask the model only for the hints that the file misses, the definitions that miss hints are sent chunk by chunk
+        together with a json template of their missing hints
+        :param tree: the parsed python file
+        :return: the hints that the model returned
+        """
+        templates = {}
+        for node in tree.body:
+            if not isinstance(node, IMPORT_NODES):
+                template = hint_template(ValidatorParser.analyze(ast.Module(body=[node], type_ignores=[])))
+                if template:
+                    templates[node.lineno] = template
+        annotations = Annotations()
+        if not templates:
+            return annotations
+        with metrics.timer("chunk"):
+            chunks = chunk_source(
+                self.python_file,
+                max_tokens=self.hint_chunk_tokens,
+                count_tokens=partial(count_tokens, model=self.model),
+                include=lambda node: node.lineno in templates
+            )
+        metrics.increment("chunks", len(chunks))
+        requests = []
+        with metrics.timer("prompt"):
+            for chunk in chunks:
+                template = merge_templates([templates[node.lineno] for node in chunk.nodes])
+                template_json = json.dumps(template)
+                instructions = HINTS_INSTRUCTIONS + context_prompt(self.project_context(chunk.nodes))
+                prompt = f"{instructions}\n the template:\n{template_json}\n this is the code:\n{chunk.prompt_source}"
+                # the completion is the template with the hints, a few tokens per hint
+                limit = count_tokens(template_json, self.model) + 16 * (requested_count(template) + 4)
+                try:
+                    max_tokens = completion_budget(prompt, self.model, limit=limit)
+                except ValueError as e:
+                    logger.warning(f"lines {chunk.start_line}-{chunk.end_line} of {self.path} are too long for "
+                                   f"{self.model} ({e}), they are left without type hints")
+                    metrics.increment("oversized_chunks")
                     continue
-                else:
-                    logger.info(f"line {i} is not valid")
-                    return False
-            if "=" in line and not line.startswith("def") and not line.startswith("class"):
-                parsed_python_file[i] = self.validator.validate_var(line)
+                requests.append(CompletionRequest(
+                    prompt=prompt,
+                    max_tokens=max_tokens,
+                    model=self.model,
+                    cache_key=make_key(self.model, instructions + template_json, chunk.prompt_source),
+                    validate=lambda text: parse_hints(text) is not None,
+                ))
+        for completion in self.client.complete_many(requests):
+            self.tokens_used += completion.total_tokens
+            hints = parse_hints(completion.text)
+            if hints is not None:
+                annotations.merge(hints)
+        metrics.increment("requested_hints", len(annotations))
+        return annotations
+
+    def write_hints(self, python_file: str) -> Path:
+        """
+        write the file with the hints, in place or as a diff against the original file
+        :param python_file: the file with the hints
+        :return: the path that was written
+        """
+        if self.output == OutputType.INPLACE.value:
+            path = Path(self.path)
+            if python_file != self.original_file:
+                with open(path, "w") as f:
+                    f.write(python_file)
+            return path
+        path = Path(self.path).parent / f"{Path(self.path).stem}_typed.diff"
+        with open(path, "w") as f:
+            f.write(unified_diff(self.original_file, python_file, Path(self.path).name))
+        return path
 
-    def run(self) -> None:
+    def pretype(self, tree: ast.Module) -> Optional[Tuple[str, ast.Module]]:
+        """
+        add the type hints that can be inferred locally (literals, constructor calls, functions without a return value
+        ...) to the file, nothing is sent to the model
+        :param tree: the parsed python file
+        :return: the file with the inferred hints and its tree, None if nothing was inferred
+        """
+        with metrics.timer("infer"):
+            annotations = infer_annotations(tree)
+            if not annotations:
+                return None
+            python_file = apply_annotations(self.python_file, annotations, tree)
+            try:
+                typed_tree = ast.parse(python_file)
+            except SyntaxError as e:
+                logger.warning(f"the inferred type hints can't be applied ({e})")
+                return None
+        metrics.increment("inferred_hints", len(annotations))
+        logger.info(f"{len(annotations)} type hints were inferred locally")
+        return python_file, typed_tree
+
+    def set_python_file(self, python_file: str) -> None:
+        """replace the code that is typed, e.g. with the code after the local inference"""
+        self.python_file = python_file
+        self.base_prompt = "\n this is the code:\n" + self.python_file
+
+    def resolved_statements(self, tree: ast.Module) -> List[ast.stmt]:
+        """
+        the top-level statements that don't need the model - the signatures of their functions have all the required
+        hints and their module level variables and class attributes are annotated
+        :param tree: the parsed python file
+        :return: the resolved statements, imports are not included
+        """
+        resolved = []
+        for node in tree.body:
+            if isinstance(node, IMPORT_NODES):
+                continue
+            report = ValidatorParser.analyze(ast.Module(body=[node], type_ignores=[]))
+            variables = [variable for variable in report.variables if not variable.scope]
+            variables += [attribute for cls in report.classes for attribute in cls.attributes]
+            if not self.validator.hint_errors(report) and all(variable.annotated for variable in variables):
+                resolved.append(node)
+        return resolved
+
+    def record_resolved(self, resolved: List[ast.stmt], manifest: Manifest) -> None:
+        """record the statements that were resolved locally, unless the manifest already has a typed version of them"""
+        lines = self.python_file.splitlines(keepends=True)
+        for node in resolved:
+            if fingerprint(node) not in manifest.units:
+                manifest.record(node, node_source(lines, node))
+        metrics.increment("resolved_statements", len(resolved))
+
+    def retype_changed(self, tree: ast.Module, manifest: Manifest) -> str:
+        """
+        type only the statements that changed since the manifest was written, and splice the typed version of all the
+        other statements back from the manifest
+        :param tree: the parsed python file
+        :param manifest: the manifest of the previous run, updated in place
+        :return: the typed python file
+        """
+        missing = manifest.missing(tree)
+        logger.info(f"{len(missing)} of {len(tree.body)} top-level statements changed since the last run")
+        if missing:
+            missing_lines = {node.lineno for node in missing}
+            with metrics.timer("chunk"):
+                chunks = chunk_source(
+                    self.python_file,
+                    max_tokens=self.chunk_tokens,
+                    count_tokens=partial(count_tokens, model=self.model),
+                    include=lambda node: node.lineno in missing_lines
+                )
+            metrics.increment("chunks", len(chunks))
+            for chunk, typed_chunk in zip(chunks, self.complete_chunks(chunks)):
+                if typed_chunk is not None:
+                    manifest.update(chunk.nodes, typed_chunk, validate=self.validate_statement)
+        return manifest.splice(self.python_file, tree)
+
+    def run(self, incremental: bool = True, stream: bool = False, infer: bool = True,
+            plan: Optional[Plan] = None, typed_code: Optional[str] = None) -> None:
         """
         run the autopy library
+        :param incremental: when a manifest of a previous run exists, type only the statements that changed since
+        :param stream: write the typed statements while the completion is generated instead of waiting for all of it
+        :param infer: add the obvious type hints locally first, and send only the statements that still miss hints
+        :param plan: the plan of the file if it was already made, see plan
+        :param typed_code: the completion of the whole file if it was already requested (e.g. together with other
+        files, see autopy.type.utils.coalesce), used only when the whole file is sent to the model
         :return: None
         """
-        prompt = "\n".join(self.instructions) + self.base_prompt
-        typed_code = self.create_typed_python_file(
-            prompt=prompt,
-            window=len(self.base_prompt.split(" ")) - 1,
-            max_len=len(self.base_prompt.split(" ")) + 100,
-            max_tokens=int(self.base_tokens - (len(prompt)//3.14) - 100)
-        )
+        with metrics.timer("file", path=str(self.path)):
+            self._run(plan or self.plan(incremental, stream, infer), typed_code)
+        metrics.increment("files")
+
+    def plan(self, incremental: bool = True, stream: bool = False, infer: bool = True) -> Plan:
+        """
+        decide how the file is typed, nothing is sent to the model yet
+        :param incremental: when a manifest of a previous run exists, type only the statements that changed since
+        :param stream: write the typed statements while the completion is generated
+        :param infer: add the obvious type hints locally first
+        :return: the plan of the file
+        """
         typed_python_path = Path(self.path).parent / f"{Path(self.path).stem}_typed.py"
-        # self.validate_file(typed_code)
-        typed_code = "\n".join([line for line in typed_code.split("\n") if line not in self.imports.split("\n")])
-        typed_code = self.imports + "\n" + typed_code
+        instructions = "\n".join(self.instructions)
+        try:
+            tree = ast.parse(self.python_file)
+        except SyntaxError:
+            # the model may still be able to handle it, but it can not be typed incrementally
+            tree = None
+        if tree is not None and self.symbols is not None:
+            self.project = self.symbols.context(self.path, tree)
+        resolved = []
+        pretyped = self.pretype(tree) if tree is not None and infer else None
+        if self.output != OutputType.FILE.value:
+            if pretyped is not None:
+                # the inferred hints are part of the output, the model is asked only for the rest
+                self.set_python_file(pretyped[0])
+                tree = pretyped[1]
+            return Plan(Plan.ANNOTATIONS, typed_python_path, tree, "", "", None, [])
+        if pretyped is not None:
+            resolved = self.resolved_statements(pretyped[1])
+            if any(isinstance(node, DEFINITION_NODES) for node in resolved):
+                self.set_python_file(pretyped[0])
+                tree = pretyped[1]
+            else:
+                # the whole file is sent to the model anyway, the inferred hints would only make the prompt longer
+                resolved = []
 
-        with open(typed_python_path, "w") as f:
-            f.write(typed_code)
-        logger.info(f"typed python file is ready in {typed_python_path}")
+        # the context of the whole file, the chunks get the context of their own statements
+        context = self.project_context(tree.body) if tree is not None else ""
+        prompt = instructions + context_prompt(context) + self.base_prompt
+        manifest = Manifest.load(manifest_path_for(typed_python_path)) if incremental and tree is not None else None
+        if manifest is not None and manifest.matches(self.model, instructions):
+            route = Plan.INCREMENTAL
+        elif resolved:
+            route = Plan.RESOLVED
+        elif tree is not None and not fits(prompt, self.model, code=self.python_file):
+            route = Plan.CHUNKS
+        elif tree is not None and stream:
+            route = Plan.STREAM
+        else:
+            route = Plan.WHOLE
+        if route != Plan.INCREMENTAL:
+            manifest = None
+        return Plan(route, typed_python_path, tree, context, prompt, manifest, resolved)
+
+    def unit(self, plan: Plan) -> Optional[Unit]:
+        """
+        the file as a unit that can be typed together with other files, see autopy.type.utils.coalesce
+        :param plan: the plan of the file
+        :return: the unit, None if the file is not sent to the model as a whole
+        """
+        if plan.route != Plan.WHOLE or plan.tree is None:
+            return None
+        instructions = "\n".join(self.instructions)
+        return Unit(
+            code=self.python_file,
+            cache_key=make_key(self.model, instructions + context_prompt(plan.context), self.python_file),
+            context=plan.context,
+            validate=self.validate_file,
+        )
+
+    def _run(self, plan: Plan, typed_code: Optional[str]) -> None:
+        if plan.route == Plan.ANNOTATIONS:
+            self._run_annotations(plan)
+            return
+        manifest_path = manifest_path_for(plan.typed_python_path)
+        instructions = "\n".join(self.instructions)
+        tree = plan.tree
+        manifest = plan.manifest
+        route = plan.route
+        max_tokens = 0
+        if route in (Plan.STREAM, Plan.WHOLE) and typed_code is None:
+            try:
+                max_tokens = completion_budget(plan.prompt, self.model)
+            except ValueError as e:
+                # the header and the context of the prompt can push a file that fits on its own over the context
+                if tree is None:
+                    logger.warning(f"{self.path} can't be parsed and does not fit in a single request ({e}), it is not "
+                                   f"typed")
+                    return
+                route = Plan.CHUNKS
+        if route == Plan.INCREMENTAL:
+            self.record_resolved(plan.resolved, manifest)
+            typed_code = self.retype_changed(tree, manifest)
+        elif route == Plan.RESOLVED:
+            # only the statements that still miss hints are sent to the model
+            logger.info(f"{len(plan.resolved)} top-level statements were typed locally")
+            manifest = Manifest(self.model, instructions)
+            self.record_resolved(plan.resolved, manifest)
+            typed_code = self.retype_changed(tree, manifest)
+        elif route == Plan.CHUNKS:
+            # the file and its typed version do not fit in the context of the model, type it chunk by chunk
+            logger.info("the file is too long for a single request, typing it in chunks")
+            manifest = Manifest(self.model, instructions)
+            typed_code = self.retype_changed(tree, manifest)
+        elif route == Plan.STREAM:
+            manifest = Manifest(self.model, instructions)
+            self.stream_typed_python_file(
+                prompt=plan.prompt,
+                max_tokens=max_tokens,
+                tree=tree,
+                manifest=manifest,
+                typed_python_path=plan.typed_python_path,
+                cache_key=make_key(self.model, instructions + context_prompt(plan.context), self.python_file)
+            )
+            # the file is already written
+            typed_code = None
+        else:
+            if typed_code is None:
+                typed_code = self.create_typed_python_file(
+                    prompt=plan.prompt,
+                    window=len(self.base_prompt.split(" ")) - 1,
+                    max_len=len(self.base_prompt.split(" ")) + 100,
+                    max_tokens=max_tokens,
+                    cache_key=make_key(self.model, instructions + context_prompt(plan.context), self.python_file)
+                )
+            if tree is not None:
+                # the valid statements are put in the place of the original ones, the invalid ones are requested again
+                manifest = Manifest(self.model, instructions)
+                manifest.update(tree.body, typed_code, validate=self.validate_statement)
+                typed_code = self.retype_changed(tree, manifest)
+
+        with metrics.timer("write"):
+            if typed_code is not None:
+                with open(plan.typed_python_path, "w") as f:
+                    f.write(typed_code)
+            if tree is not None:
+                manifest.prune(tree)
+                manifest.save(manifest_path)
+        logger.info(f"typed python file is ready in {plan.typed_python_path}")
 
+    def _run_annotations(self, plan: Plan) -> None:
+        if plan.tree is None:
+            logger.warning(f"{self.path} can't be parsed, the hints can't be written into it")
+            return
+        if self.output == OutputType.PYI.value:
+            # the stub is built from the tree and the hints, the source itself is not rewritten
+            path = stub_path(self.path)
+            if is_foreign(read_header(path)) and not self.force:
+                logger.warning(f"{path} was not written by autopy, it is left as it is (use --force to overwrite it)")
+                return
+            annotations = self.complete_hints(plan.tree)
+            with metrics.timer("write"):
+                write_stub(path, f"{stub_header(self.python_file, MODEL)}\n{module_stub(plan.tree, annotations)}")
+            logger.info(f"{len(annotations)} type hints from the model were written to {path}")
+            return
+        annotations = self.complete_hints(plan.tree)
+        python_file = apply_hints(self.python_file, plan.tree, annotations) if annotations else None
+        with metrics.timer("write"):
+            path = self.write_hints(python_file if python_file is not None else self.python_file)
+        logger.info(f"{len(annotations)} type hints from the model were written to {path}")
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
     # path = Path("/Users/itayd/PycharmProjects/openai-python/openai/openai_object.py")
     # path = Path(__file__).parent.parent.parent / "examples/test.py"
     path = Path("/Users/itayd/PycharmProjects/openai-python/openai/util.py")
@@ -0,0 +1,200 @@
+"""
+Repository wide typing.
+
+the batch runner walks a package (or a glob pattern), and types every python file on a bounded pool of workers.
+the completion client (with its cache and rate limiter) is created once and shared by all the files, so the per-file
+setup is only reading the file itself.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from autopy import metrics
+from autopy.completion.cache import CompletionCache
+from autopy.completion.client import CompletionClient, CompletionError, OpenAIBackend
+from autopy.completion.rate_limit import RateLimiter
+from autopy.completion.tokens import count_tokens
+from autopy.models.models import ModelType, OutputType
+from autopy.type.autopy_type import AutoPy, Plan
+from autopy.type.utils.coalesce import Coalescer
+from autopy.type.utils.files import collect_python_files
+from autopy.type.utils.symbols import SymbolIndex, build_index
+
+logger = logging.getLogger(__name__)
+
+
+class BatchReport:
+    def __init__(self) -> None:
+        """summary of a batch run"""
+        self.files: List[Path] = []
+        self.failures: Dict[Path, str] = {}
+        self.tokens = 0
+        self.elapsed = 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return len(self.files) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"typed {len(self.files) - len(self.failures)}/{len(self.files)} files in {self.elapsed:.2f}s "
+            f"({self.files_per_second:.2f} files/sec, {self.tokens} tokens, {self.tokens_per_second:.2f} tokens/sec)"
+        )
+
+
+class BatchRunner:
+    def __init__(
+            self,
+            api_key: str,
+            model: str = ModelType.TEXT_DAVINCI_003.value,
+            workers: int = 4,
+            requests_per_minute: Optional[int] = None,
+            tokens_per_minute: Optional[int] = None,
+            use_cache: bool = True,
+            cache_dir: Optional[Union[str, Path]] = None,
+            client: Optional[CompletionClient] = None,
+            project_context: bool = True,
+            coalesce: bool = True,
+            output: str = OutputType.FILE.value,
+            force: bool = False
+    ) -> None:
+        """
+        types many files on a pool of worker threads.
+        :param api_key: openai api key
+        :param model: the model to use
+        :param workers: maximal number of files that are typed at the same time
+        :param requests_per_minute: request limit shared by all the workers
+        :param tokens_per_minute: token limit shared by all the workers
+        :param use_cache: whether to use the completion cache
+        :param cache_dir: directory of the completion cache
+        :param client: completion client to use instead of the default openai client
+        :param project_context: add the signatures of the names that every file imports from other modules of the
+        project to its prompts, the symbol index of the project is built once per run
+        :param coalesce: pack small files that are sent to the model as a whole into shared requests
+        :param output: how the hints are written, see autopy.models.models.OutputType
+        :param force: overwrite the .pyi stubs that were not written by autopy
+        """
+        self.api_key = api_key
+        self.model = model
+        self.workers = workers
+        if client is None:
+            cache = CompletionCache(Path(cache_dir) / "completions.sqlite3" if cache_dir else None) if use_cache else None
+            client = CompletionClient(
+                backend=OpenAIBackend(api_key=api_key),
+                max_concurrency=workers,
+                cache=cache,
+                rate_limiter=RateLimiter(requests_per_minute, tokens_per_minute),
+            )
+        self.client = client
+        self.project_context = project_context
+        self.coalesce = coalesce
+        self.output = output
+        self.force = force
+        self.symbols: Optional[SymbolIndex] = None
+
+    def autopy(self, path: Path) -> AutoPy:
+        return AutoPy(
+            api_key=self.api_key,
+            path=path,
+            model=self.model,
+            client=self.client,
+            symbols=self.symbols,
+            output=self.output,
+            force=self.force,
+        )
+
+    def type_file(self, path: Path, prepared: Optional[Tuple[AutoPy, Plan, Optional[str]]] = None) -> int:
+        """
+        type a single file
+        :param path: the python file
+        :param prepared: the instance and the plan of a file that was already planned, and its typed code if it was
+        typed together with other files
+        :return: the number of tokens that were used
+        """
+        if prepared is not None:
+            autopy, plan, typed_code = prepared
+            autopy.run(plan=plan, typed_code=typed_code)
+        else:
+            autopy = self.autopy(path)
+            autopy.run()
+        return autopy.tokens_used
+
+    def coalesce_files(self, files: List[Path]) -> Tuple[Dict[Path, Tuple[AutoPy, Plan, Optional[str]]], int]:
+        """
+        plan every file, and type the small files that are sent to the model as a whole together, in as few requests as
+        possible
+        :param files: the python files
+        :return: the instance, the plan and the typed code (None if the file is typed on its own) of every file that was
+        planned, and the number of tokens that were used. the files that are missing are planned again when they are
+        typed
+        """
+        prepared: Dict[Path, Tuple[AutoPy, Plan, Optional[str]]] = {}
+        units = []
+        with metrics.timer("plan"):
+            for file in files:
+                try:
+                    autopy = self.autopy(file)
+                    plan = autopy.plan()
+                except (OSError, UnicodeDecodeError) as e:
+                    # the error is reported when the file is typed on its own
+                    logger.debug(f"{file} can't be planned: {e}")
+                    continue
+                prepared[file] = (autopy, plan, None)
+                unit = autopy.unit(plan)
+                if unit is not None:
+                    units.append((file, unit))
+        if len(units) < 2:
+            return prepared, 0
+
+        coalescer = Coalescer(self.client, self.model, "\n".join(prepared[units[0][0]][0].instructions))
+        max_unit_tokens = coalescer.max_unit_tokens()
+        units = [(file, unit) for file, unit in units if count_tokens(unit.code, self.model) <= max_unit_tokens]
+        try:
+            results = coalescer.complete([unit for _, unit in units])
+        except CompletionError as e:
+            logger.warning(f"typing every file on its own, the shared requests failed: {e}")
+            return prepared, coalescer.tokens_used
+        coalesced = 0
+        for (file, _), text in zip(units, results):
+            if text is not None:
+                autopy, plan, _ = prepared[file]
+                prepared[file] = (autopy, plan, text)
+                coalesced += 1
+        logger.info(f"{coalesced} of {len(files)} files were typed in {coalescer.requests} shared requests")
+        return prepared, coalescer.tokens_used
+
+    def run(self, files: List[Path]) -> BatchReport:
+        """
+        type all the files
+        :param files: the python files to type
+        :return: report with the throughput of the run
+        """
+        report = BatchReport()
+        report.files = list(files)
+        start = time.perf_counter()
+        if self.project_context and files:
+            try:
+                self.symbols = build_index(list(files))
+            except OSError as e:
+                logger.warning(f"typing without the project context, the symbol index can't be built: {e}")
+        prepared: Dict[Path, Tuple[AutoPy, Plan, Optional[str]]] = {}
+        if self.coalesce and len(files) > 1:
+            prepared, report.tokens = self.coalesce_files(list(files))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.type_file, file, prepared.pop(file, None)): file for file in files}
+            for future in as_completed(futures):
+                file = futures[future]
+                try:
+                    report.tokens += future.result()
+                except Exception as e:
+                    logger.error(f"failed to type {file}: {e}")
+                    report.failures[file] = str(e)
+        report.elapsed = time.perf_counter() - start
+        logger.info(report.summary())
+        return report
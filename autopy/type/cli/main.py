@@ -1,12 +1,28 @@
 import click
-from typing import List, Union
-from autopy.type.autopy_type import AutoPy
-from autopy.models import ModelType
+import json
+import logging
+from collections import Counter
+from typing import Any, Callable, Dict, Optional, Tuple
+from autopy import metrics
+from autopy.models.models import ModelType, OutputType
+from autopy.type.utils.files import collect_python_files
+from autopy.type.utils.scanner import ScanResult, compare, missing_annotations, relative_path, scan
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE = ".autopy_coverage.json"
 
 
 @click.group()
-def autopy_cli() -> None:
-    pass
+@click.option(
+    "-v",
+    "--verbose",
+    is_flag=True,
+    default=False,
+    help="Show debug logs.",
+)
+def autopy_cli(verbose: bool) -> None:
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
 
 
 @autopy_cli.command(
@@ -17,7 +33,7 @@ def autopy_cli() -> None:
     "--path",
     required=True,
     type=str,
-    help="Path to a python file.",
+    help="Path to a python file, a directory or a glob pattern (e.g. 'src/**/*.py').",
 )
 @click.option(
     "--api_key",
@@ -28,10 +44,351 @@ def autopy_cli() -> None:
 @click.option(
     "--m",
     "--model",
-    optional=True,
+    required=False,
+    default=ModelType.TEXT_DAVINCI_003.value,
     type=str,
     help="choose model to use",
 )
-def run(path: Union[str, List[str]], api_key: str, model: str = ModelType.TEXT_DAVINCI_003) -> None:
-    autopy = AutoPy(path=path, api_key=api_key, model=model)
-    autopy.run()
+@click.option(
+    "-w",
+    "--workers",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of files that are typed concurrently.",
+)
+@click.option(
+    "--rpm",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Maximal number of requests per minute.",
+)
+@click.option(
+    "--tpm",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Maximal number of tokens per minute.",
+)
+@click.option(
+    "--no_cache",
+    is_flag=True,
+    default=False,
+    help="Do not use the completion cache.",
+)
+@click.option(
+    "--no_project_context",
+    is_flag=True,
+    default=False,
+    help="Do not add the signatures of names imported from other modules of the project to the prompts.",
+)
+@click.option(
+    "--no_coalesce",
+    is_flag=True,
+    default=False,
+    help="Send every file in its own request instead of packing small files into shared requests.",
+)
+@click.option(
+    "--output",
+    default=OutputType.FILE.value,
+    show_default=True,
+    type=click.Choice([output.value for output in OutputType]),
+    help="Write a typed copy of every file, or request only the hints and write them into the files, as diffs or as "
+         ".pyi stubs.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="With --output pyi, overwrite the .pyi stubs that were not written by autopy.",
+)
+@click.option(
+    "--metrics",
+    "metrics_path",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Append the timings and counters of the run to this json lines file.",
+)
+def run(
+        path: str,
+        api_key: str,
+        model: str,
+        workers: int,
+        rpm: Optional[int],
+        tpm: Optional[int],
+        no_cache: bool,
+        no_project_context: bool,
+        no_coalesce: bool,
+        output: str,
+        force: bool,
+        metrics_path: Optional[str]
+) -> None:
+    if metrics_path:
+        metrics.add_sink(metrics.JsonLinesSink(metrics_path))
+    files = collect_python_files(path)
+    if not files:
+        raise click.BadParameter(f"no python files were found in {path}", param_hint="--path")
+    # the completion client (asyncio, the backends) is imported only by the commands that send requests, so the
+    # startup of the other commands stays within the budgets of benchmarks/startup.py
+    from autopy.type.batch import BatchRunner
+
+    runner = BatchRunner(
+        api_key=api_key,
+        model=model,
+        workers=workers,
+        requests_per_minute=rpm,
+        tokens_per_minute=tpm,
+        use_cache=not no_cache,
+        project_context=not no_project_context,
+        coalesce=not no_coalesce,
+        output=output,
+        force=force,
+    )
+    report = runner.run(files)
+    click.echo(report.summary())
+    click.echo(metrics.format_summary())
+    for file, error in report.failures.items():
+        click.echo(f"failed: {file}: {error}", err=True)
+    if report.failures:
+        raise SystemExit(1)
+
+
+def scan_options(command: Callable) -> Callable:
+    """the options of the offline commands that scan files"""
+    options = [
+        click.option(
+            "-p",
+            "--path",
+            "paths",
+            required=True,
+            multiple=True,
+            type=str,
+            help="Path to a python file, a directory or a glob pattern, can be repeated.",
+        ),
+        click.option(
+            "-w",
+            "--workers",
+            default=None,
+            type=click.IntRange(min=1),
+            help="Number of processes that analyze the files. Default: the number of cores.",
+        ),
+        click.option(
+            "--no_index",
+            is_flag=True,
+            default=False,
+            help="Analyze every file again instead of reusing the reports of unchanged files.",
+        ),
+        click.option(
+            "--min_score",
+            default=None,
+            type=click.FloatRange(0, 1),
+            help="Exit with 1 if the total coverage is lower.",
+        ),
+        click.option(
+            "--json",
+            "as_json",
+            is_flag=True,
+            default=False,
+            help="Print the report as json.",
+        ),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def scan_paths(paths: Tuple[str, ...], workers: Optional[int], no_index: bool) -> ScanResult:
+    for path in paths:
+        if not collect_python_files(path, skip_typed=False):
+            raise click.BadParameter(f"no python files were found in {path}", param_hint="--path")
+    return scan(list(paths), use_index=not no_index, workers=workers)
+
+
+def echo_errors(result: ScanResult) -> None:
+    for path, error in result.errors.items():
+        click.echo(f"can't be analyzed: {relative_path(path)}: {error}", err=True)
+
+
+@autopy_cli.command(
+    help="report the type hints coverage of python files, offline (no completion requests are sent)",
+)
+@scan_options
+@click.option(
+    "--min_file_score",
+    default=None,
+    type=click.FloatRange(0, 1),
+    help="Exit with 1 if the coverage of any file is lower.",
+)
+@click.option(
+    "--show_missing",
+    is_flag=True,
+    default=False,
+    help="List the arguments, return types and variables without type hints.",
+)
+@click.option(
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Write the summary as json, it can be used as the baseline of the check command.",
+)
+def coverage(
+        paths: Tuple[str, ...],
+        workers: Optional[int],
+        no_index: bool,
+        min_score: Optional[float],
+        as_json: bool,
+        min_file_score: Optional[float],
+        show_missing: bool,
+        output: Optional[str]
+) -> None:
+    result = scan_paths(paths, workers, no_index)
+    summary = result.to_dict()
+    if output:
+        with open(output, "w") as f:
+            json.dump(summary, f, indent=1)
+
+    if as_json:
+        click.echo(json.dumps(summary, indent=1))
+    else:
+        for path, report in result.reports.items():
+            if "error" in report:
+                continue
+            click.echo(f"{relative_path(path):<60}{report['annotated']:>6}/{report['total']:<6}{report['score']:>7.1%}")
+            if show_missing:
+                for line in missing_annotations(report):
+                    click.echo(f"    {line}")
+        click.echo(f"{'total':<60}{result.annotated:>6}/{result.total:<6}{result.score:>7.1%}")
+    echo_errors(result)
+
+    failed = bool(result.errors)
+    if min_score is not None and result.score < min_score:
+        click.echo(f"total coverage {result.score:.1%} is lower than {min_score:.1%}", err=True)
+        failed = True
+    if min_file_score is not None:
+        for path, report in summary["files"].items():
+            if "error" not in report and report["score"] < min_file_score:
+                click.echo(f"{path}: coverage {report['score']:.1%} is lower than {min_file_score:.1%}", err=True)
+                failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+@autopy_cli.command(
+    help="fail if the type hints coverage regressed relatively to a baseline, offline (e.g. as a pre-commit hook)",
+)
+@scan_options
+@click.option(
+    "--baseline",
+    default=DEFAULT_BASELINE,
+    show_default=True,
+    type=click.Path(dir_okay=False),
+    help="Summary of the accepted coverage, written by --update or by coverage --output.",
+)
+@click.option(
+    "--tolerance",
+    default=0.0,
+    show_default=True,
+    type=click.FloatRange(0, 1),
+    help="Allowed drop of the coverage of a file or of the total.",
+)
+@click.option(
+    "--update",
+    is_flag=True,
+    default=False,
+    help="Write the current coverage as the baseline when there are no regressions.",
+)
+def check(
+        paths: Tuple[str, ...],
+        workers: Optional[int],
+        no_index: bool,
+        min_score: Optional[float],
+        as_json: bool,
+        baseline: str,
+        tolerance: float,
+        update: bool
+) -> None:
+    result = scan_paths(paths, workers, no_index)
+    summary = result.to_dict()
+    try:
+        with open(baseline, "r") as f:
+            accepted: Optional[Dict[str, Any]] = json.load(f)
+    except FileNotFoundError:
+        if not update:
+            raise click.BadParameter(f"{baseline} does not exist, create it with --update", param_hint="--baseline")
+        accepted = None
+
+    regressions = compare(summary, accepted, tolerance) if accepted else []
+    regressions += [f"{relative_path(path)}: can't be analyzed ({error})" for path, error in result.errors.items()]
+    if min_score is not None and result.score < min_score:
+        regressions.append(f"total coverage {result.score:.1%} is lower than {min_score:.1%}")
+
+    if as_json:
+        click.echo(json.dumps({"score": result.score, "regressions": regressions}, indent=1))
+    else:
+        change = f" ({result.score - accepted['score']:+.1%})" if accepted else ""
+        click.echo(f"coverage {result.score:.1%}{change} of {len(result.reports)} files")
+        for regression in regressions:
+            click.echo(f"regression: {regression}", err=True)
+    if regressions:
+        raise SystemExit(1)
+    if update:
+        with open(baseline, "w") as f:
+            json.dump(summary, f, indent=1)
+        logger.info(f"the baseline {baseline} was updated")
+
+
+@autopy_cli.command(
+    help="write a .pyi stub next to every python file with its locally inferred type hints, offline (no completion "
+         "requests are sent)",
+)
+@click.option(
+    "-p",
+    "--path",
+    "paths",
+    required=True,
+    multiple=True,
+    type=str,
+    help="Path to a python file, a directory or a glob pattern, can be repeated.",
+)
+@click.option(
+    "-w",
+    "--workers",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of processes that write the stubs. Default: the number of cores.",
+)
+@click.option(
+    "--no_infer",
+    is_flag=True,
+    default=False,
+    help="Write only the existing type hints, without the ones that can be inferred locally.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Overwrite the .pyi stubs that were not written by autopy.",
+)
+def stubs(paths: Tuple[str, ...], workers: Optional[int], no_infer: bool, force: bool) -> None:
+    from autopy.type.utils.stubs import FAILED, FOREIGN, UNCHANGED, WRITTEN, generate_stubs
+
+    files = []
+    for path in paths:
+        found = collect_python_files(path)
+        if not found:
+            raise click.BadParameter(f"no python files were found in {path}", param_hint="--path")
+        files += found
+    results = generate_stubs(dict.fromkeys(files), infer=not no_infer, workers=workers, force=force)
+    outcomes = Counter(outcome for _, outcome, _ in results)
+    errors = [(path, error) for path, outcome, error in results if outcome == FAILED]
+    summary = f"wrote {outcomes[WRITTEN]} stubs, {outcomes[UNCHANGED]} were unchanged"
+    if outcomes[FOREIGN]:
+        summary += f", {outcomes[FOREIGN]} were not written by autopy and were left as they are (use --force)"
+    click.echo(summary)
+    for path, error in errors:
+        click.echo(f"can't be stubbed: {relative_path(path)}: {error}", err=True)
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    autopy_cli()
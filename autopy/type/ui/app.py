@@ -1,9 +1,8 @@
-import dash
-import dash_core_components as dcc
-import dash_html_components as html
-
-
 def create_layout(file1, file2, highlights1, highlights2):
+    # dash is imported when the ui is created, importing the package does not need it
+    import dash_core_components as dcc
+    import dash_html_components as html
+
     def highlight_lines(code, highlights):
         lines = code.split('\n')
         highlighted_lines = []
@@ -53,10 +52,16 @@ def create_layout(file1, file2, highlights1, highlights2):
     ])
 
 
-app = dash.Dash()
-exmple = "/Users/itayd/PycharmProjects/AutoPyType/examples/example.py"
-example_typed = "/Users/itayd/PycharmProjects/AutoPyType/examples/example_typed.py"
-app.layout = create_layout(open(exmple).read(), open(exmple).read(), [(10,29)], [(5,10)])
+def create_app(file1, file2, highlights1, highlights2):
+    import dash
+
+    app = dash.Dash()
+    app.layout = create_layout(file1, file2, highlights1, highlights2)
+    return app
+
 
 if __name__ == '__main__':
+    exmple = "/Users/itayd/PycharmProjects/AutoPyType/examples/example.py"
+    example_typed = "/Users/itayd/PycharmProjects/AutoPyType/examples/example_typed.py"
+    app = create_app(open(exmple).read(), open(exmple).read(), [(10,29)], [(5,10)])
     app.run_server()
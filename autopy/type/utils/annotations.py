@@ -0,0 +1,279 @@
+"""
+Type hints as data, and an applier that writes them into the source.
+
+the hints are keyed the same way the coverage reports name things - functions by their qualified name (e.g.
+`MyClass.method`) and variables by the qualified name of their scope and the assigned name (e.g. `MyClass.__init__`
+and `self.size`). the applier edits only the positions of the missing hints, so the formatting and the comments of the
+source are kept as they are, and it never replaces a hint that already exists.
+"""
+import ast
+import io
+import logging
+import tokenize
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# names that the hints may use from the typing module
+TYPING_NAMES = {"Any", "Callable", "Dict", "FrozenSet", "Iterable", "Iterator", "List", "Optional", "Set", "Tuple",
+                "Type", "Union"}
+
+# (line, column, end line, end column, text), lines are 1-based and columns are in characters
+Edit = Tuple[int, int, int, int, str]
+
+
+class FunctionAnnotations:
+    def __init__(self, arguments: Optional[Dict[str, str]] = None, returns: Optional[str] = None) -> None:
+        """
+        the hints of a single function
+        :param arguments: mapping from the name of an argument to its hint
+        :param returns: the return type hint
+        """
+        self.arguments = arguments or {}
+        self.returns = returns
+
+    def __len__(self) -> int:
+        return len(self.arguments) + (self.returns is not None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"arguments": self.arguments, "returns": self.returns}
+
+
+class Annotations:
+    def __init__(self) -> None:
+        """type hints of a module, for the applier"""
+        self.functions: Dict[str, FunctionAnnotations] = {}
+        # (qualified name of the scope, assigned name) -> hint
+        self.variables: Dict[Tuple[str, str], str] = {}
+        # names that have to be imported from typing
+        self.typing: Set[str] = set()
+
+    def __len__(self) -> int:
+        return sum(len(function) for function in self.functions.values()) + len(self.variables)
+
+    def function(self, name: str) -> FunctionAnnotations:
+        return self.functions.setdefault(name, FunctionAnnotations())
+
+    def add_argument(self, function: str, argument: str, hint: str) -> None:
+        self.function(function).arguments[argument] = hint
+        self._add_typing(hint)
+
+    def add_return(self, function: str, hint: str) -> None:
+        self.function(function).returns = hint
+        self._add_typing(hint)
+
+    def add_variable(self, scope: str, name: str, hint: str) -> None:
+        self.variables[(scope, name)] = hint
+        self._add_typing(hint)
+
+    def _add_typing(self, hint: str) -> None:
+        try:
+            tree = ast.parse(hint.strip("'\""), mode="eval")
+        except SyntaxError:
+            return
+        self.typing.update(node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and node.id in TYPING_NAMES)
+
+    def merge(self, other: "Annotations") -> None:
+        """add the hints of another instance, hints that already exist here are kept"""
+        for name, function in other.functions.items():
+            for argument, hint in function.arguments.items():
+                self.function(name).arguments.setdefault(argument, hint)
+            if function.returns is not None and self.function(name).returns is None:
+                self.function(name).returns = function.returns
+        for key, hint in other.variables.items():
+            self.variables.setdefault(key, hint)
+        self.typing |= other.typing
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "functions": {name: function.to_dict() for name, function in self.functions.items()},
+            "variables": [[scope, name, hint] for (scope, name), hint in self.variables.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Annotations":
+        annotations = cls()
+        for name, function in data.get("functions", {}).items():
+            for argument, hint in function.get("arguments", {}).items():
+                annotations.add_argument(name, argument, hint)
+            if function.get("returns"):
+                annotations.add_return(name, function["returns"])
+        for scope, name, hint in data.get("variables", []):
+            annotations.add_variable(scope, name, hint)
+        return annotations
+
+
+def target_name(target: ast.expr) -> Optional[str]:
+    """the name of an assignment target the way the coverage reports name it - `x` or `self.x`"""
+    if isinstance(target, ast.Name):
+        return target.id
+    if isinstance(target, ast.Attribute) and isinstance(target.value, ast.Name):
+        return f"{target.value.id}.{target.attr}"
+    return None
+
+
+def declared_names(node: Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> Set[str]:
+    """the global and nonlocal names of a function, they can't be annotated inside it"""
+    names = set()
+    for sub_node in scope_walk(node.body):
+        if isinstance(sub_node, (ast.Global, ast.Nonlocal)):
+            names.update(sub_node.names)
+    return names
+
+
+def scope_walk(body: List[ast.stmt]) -> Iterator[ast.AST]:
+    """every node of a body, without descending into nested functions, classes and lambdas"""
+    stack = list(reversed(body))
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            continue
+        stack.extend(reversed(list(ast.iter_child_nodes(node))))
+
+
+class _EditCollector(ast.NodeVisitor):
+    """walks the tree once and turns the hints into edits of the source"""
+
+    def __init__(self, lines: List[str], annotations: Annotations) -> None:
+        self.lines = lines
+        self.annotations = annotations
+        self.scopes: List[str] = []
+        # the function of every scope (None for classes), for its global and nonlocal names
+        self.functions: List[Optional[Union[ast.FunctionDef, ast.AsyncFunctionDef]]] = []
+        self.applied: Set[Tuple[str, str]] = set()
+        self.edits: List[Edit] = []
+
+    def _column(self, lineno: int, offset: int) -> int:
+        """the ast columns are utf-8 byte offsets"""
+        return len(self.lines[lineno - 1].encode("utf-8")[:offset].decode("utf-8", errors="ignore"))
+
+    def _qualname(self, name: str) -> str:
+        return ".".join(self.scopes + [name])
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        self.scopes.append(node.name)
+        self.functions.append(None)
+        self.generic_visit(node)
+        self.functions.pop()
+        self.scopes.pop()
+
+    def _visit_function(self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> None:
+        function = self.annotations.functions.get(self._qualname(node.name))
+        if function is not None:
+            self._annotate_signature(node, function)
+        self.scopes.append(node.name)
+        self.functions.append(node)
+        self.generic_visit(node)
+        self.functions.pop()
+        self.scopes.pop()
+
+    visit_FunctionDef = _visit_function
+    visit_AsyncFunctionDef = _visit_function
+
+    def _annotate_signature(self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef],
+                            function: FunctionAnnotations) -> None:
+        args = node.args
+        positional = args.posonlyargs + args.args
+        defaults: Dict[str, ast.expr] = dict(zip([arg.arg for arg in positional[len(positional) - len(args.defaults):]],
+                                                 args.defaults))
+        defaults.update((arg.arg, default) for arg, default in zip(args.kwonlyargs, args.kw_defaults) if default)
+        arguments = positional + [arg for arg in (args.vararg, args.kwarg) if arg] + args.kwonlyargs
+        for arg in arguments:
+            hint = function.arguments.get(arg.arg)
+            if hint is None or arg.annotation is not None:
+                continue
+            line, column = arg.end_lineno, self._column(arg.end_lineno, arg.end_col_offset)
+            default = defaults.get(arg.arg)
+            if default is not None and default.lineno == line:
+                default_column = self._column(default.lineno, default.col_offset)
+                if self.lines[line - 1][column:default_column].strip() == "=":
+                    # `x=1` becomes `x: int = 1`
+                    self.edits.append((line, column, line, default_column, f": {hint} = "))
+                    continue
+            self.edits.append((line, column, line, column, f": {hint}"))
+        if node.returns is None and function.returns is not None:
+            position = self._signature_end(node)
+            if position is not None:
+                self.edits.append((*position, *position, f" -> {function.returns}"))
+
+    def _signature_end(self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> Optional[Tuple[int, int]]:
+        """the position right after the closing bracket of the arguments"""
+        source = "".join(self.lines[node.lineno - 1:node.body[0].lineno])
+        depth = 0
+        try:
+            for token in tokenize.generate_tokens(io.StringIO(source).readline):
+                if token.type != tokenize.OP:
+                    continue
+                if token.string in "([{":
+                    depth += 1
+                elif token.string in ")]}":
+                    depth -= 1
+                    if depth == 0:
+                        return node.lineno + token.end[0] - 1, token.end[1]
+        except (tokenize.TokenError, IndentationError):
+            pass
+        logger.debug(f"the signature of {node.name} (line {node.lineno}) was not found")
+        return None
+
+    def visit_Assign(self, node: ast.Assign) -> None:
+        name = target_name(node.targets[0]) if len(node.targets) == 1 else None
+        key = (".".join(self.scopes), name)
+        hint = self.annotations.variables.get(key)
+        if hint is not None and key not in self.applied and node.type_comment is None and \
+                not (self.functions and self.functions[-1] and name in declared_names(self.functions[-1])):
+            target = node.targets[0]
+            line, column = target.end_lineno, self._column(target.end_lineno, target.end_col_offset)
+            self.edits.append((line, column, line, column, f": {hint}"))
+            # only the first assignment of a name is annotated
+            self.applied.add(key)
+        self.generic_visit(node)
+
+    def visit_AnnAssign(self, node: ast.AnnAssign) -> None:
+        self.applied.add((".".join(self.scopes), target_name(node.target)))
+        self.generic_visit(node)
+
+
+def _typing_import(tree: ast.Module, lines: List[str], names: Set[str]) -> Optional[Edit]:
+    """the edit that imports the missing typing names, after the imports at the top of the module"""
+    imported = {alias.asname or alias.name for node in tree.body if isinstance(node, ast.ImportFrom) and
+                node.module == "typing" for alias in node.names}
+    missing = sorted(names - imported)
+    if not missing:
+        return None
+    anchor = None
+    for position, node in enumerate(tree.body):
+        if isinstance(node, (ast.Import, ast.ImportFrom)) or (position == 0 and ast.get_docstring(tree) is not None):
+            anchor = node
+        else:
+            break
+    line = anchor.end_lineno + 1 if anchor is not None else 1
+    if line > len(lines) and lines and not lines[-1].endswith("\n"):
+        return len(lines), len(lines[-1]), len(lines), len(lines[-1]), f"\nfrom typing import {', '.join(missing)}\n"
+    return line, 0, line, 0, f"from typing import {', '.join(missing)}\n"
+
+
+def apply_annotations(source: str, annotations: Annotations, tree: Optional[ast.Module] = None) -> str:
+    """
+    write type hints into the source
+    :param source: the source of the module
+    :param annotations: the hints to write, hints of things that are already annotated are ignored
+    :param tree: the parsed source, if it was already parsed
+    :return: the source with the hints and with an import of the typing names they use
+    """
+    tree = tree or ast.parse(source)
+    lines = source.splitlines(keepends=True)
+    collector = _EditCollector(lines, annotations)
+    collector.visit(tree)
+    edits = collector.edits
+    typing_import = _typing_import(tree, lines, annotations.typing) if edits else None
+    if typing_import is not None:
+        edits.append(typing_import)
+    if not edits:
+        return source
+
+    # apply from the end, so the positions of the edits that are left stay valid
+    lines.append("")
+    for line, column, end_line, end_column, text in sorted(edits, key=lambda edit: edit[:2], reverse=True):
+        lines[line - 1:end_line] = [lines[line - 1][:column] + text + lines[end_line - 1][end_column:]]
+    return "".join(lines)
@@ -0,0 +1,244 @@
+"""
+AST aware chunking of python source files.
+
+The source file is split on top-level statement boundaries (functions, classes, assignments...) so that the model
+never receives half of a function. nodes are packed greedily into chunks that fit a token budget, and every chunk
+carries a small header with only the imports and module level names that it actually references.
+"""
+import ast
+import copy
+import math
+from typing import Callable, List, Optional, Set
+
+DEFINITION_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+def approximate_tokens(text: str) -> int:
+    """
+    rough estimation of the number of tokens in a text
+    :param text: the text to estimate
+    :return: estimated number of tokens
+    """
+    return int(len(text) // 3.14) + 1
+
+
+class Chunk:
+    def __init__(
+            self,
+            index: int,
+            source: str,
+            header: str,
+            start_line: int,
+            end_line: int,
+            names: Set[str],
+            nodes: Optional[List[ast.stmt]] = None
+    ) -> None:
+        """
+        a slice of a python file that starts and ends on top-level statement boundaries.
+        :param index: the position of the chunk in the file
+        :param source: the source code of the chunk
+        :param header: the imports and definitions stubs the chunk needs in order to be understood by itself
+        :param start_line: first line of the chunk in the original file (1-based)
+        :param end_line: last line of the chunk in the original file (1-based, inclusive)
+        :param names: the module level names defined by the chunk
+        :param nodes: the top-level statements of the chunk
+        """
+        self.index = index
+        self.source = source
+        self.header = header
+        self.start_line = start_line
+        self.end_line = end_line
+        self.names = names
+        self.nodes = nodes or []
+
+    @property
+    def prompt_source(self) -> str:
+        """the code that should be sent to the model - the header followed by the chunk itself"""
+        if not self.header:
+            return self.source
+        return self.header + "\n\n" + self.source
+
+    def strip_header(self, typed: str) -> str:
+        """
+        remove the header from the typed chunk, it is context only and already part of the chunks that define it. only
+        the leading lines that repeat the header are removed, the lines of the chunk itself are never touched even if
+        they look like lines of the header (blank lines, `...` bodies)
+        :param typed: the typed chunk as the model returned it, the header followed by the chunk
+        :return: the typed chunk without the header
+        """
+        lines = typed.split("\n")
+        position = 0
+        for header_line in self.header.splitlines():
+            if not header_line.strip():
+                continue
+            while position < len(lines) and not lines[position].strip():
+                position += 1
+            if position == len(lines) or lines[position].rstrip() != header_line.rstrip():
+                break
+            position += 1
+        else:
+            if position and position < len(lines) and not lines[position].strip():
+                # the blank line between the header and the chunk, see prompt_source
+                position += 1
+        return "\n".join(lines[position:])
+
+    def __repr__(self) -> str:
+        return f"Chunk(index={self.index}, lines={self.start_line}-{self.end_line})"
+
+
+def _bound_names(node: ast.stmt) -> Set[str]:
+    """module level names that a top-level statement binds"""
+    if isinstance(node, DEFINITION_NODES):
+        return {node.name}
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return {(alias.asname or alias.name).split(".")[0] for alias in node.names}
+    names = set()
+    targets = []
+    if isinstance(node, ast.Assign):
+        targets = node.targets
+    elif isinstance(node, (ast.AnnAssign, ast.AugAssign)):
+        targets = [node.target]
+    for target in targets:
+        for sub_node in ast.walk(target):
+            if isinstance(sub_node, ast.Name):
+                names.add(sub_node.id)
+    return names
+
+
+def _used_names(node: ast.AST) -> Set[str]:
+    """every name that is loaded inside a node, including the root of attribute chains like `os.path`"""
+    return {sub_node.id for sub_node in ast.walk(node) if isinstance(sub_node, ast.Name)}
+
+
+def _trim_import(node: ast.stmt, used: Set[str]) -> Optional[str]:
+    """rebuild an import statement with only the aliases in `used`"""
+    aliases = [alias for alias in node.names if (alias.asname or alias.name).split(".")[0] in used]
+    if not aliases:
+        return None
+    if isinstance(node, ast.Import):
+        trimmed = ast.Import(names=aliases)
+    else:
+        trimmed = ast.ImportFrom(module=node.module, names=aliases, level=node.level)
+    return ast.unparse(trimmed)
+
+
+def _stub_node(node: ast.stmt) -> ast.stmt:
+    """copy of a definition where bodies are replaced by `...`, classes keep their annotated attributes and methods"""
+    stub = copy.copy(node)
+    body = []
+    if isinstance(node, ast.ClassDef):
+        body = [_stub_node(member) if isinstance(member, DEFINITION_NODES) else member
+                for member in node.body if isinstance(member, DEFINITION_NODES + (ast.AnnAssign,))]
+    stub.body = body or [ast.Expr(value=ast.Constant(value=Ellipsis))]
+    return stub
+
+
+def _definition_stub(node: ast.stmt) -> str:
+    """a compact summary of a top-level statement that other chunks can refer to"""
+    if isinstance(node, DEFINITION_NODES):
+        return ast.unparse(_stub_node(node))
+    source = ast.unparse(node)
+    if len(source.splitlines()) > 1 or len(source) > 120:
+        return f"{', '.join(sorted(_bound_names(node)))} = ..."
+    return source
+
+
+class _Segment:
+    def __init__(self, node: ast.stmt, start_line: int, end_line: int, source: str, tokens: int) -> None:
+        self.node = node
+        self.start_line = start_line
+        self.end_line = end_line
+        self.source = source
+        self.tokens = tokens
+        self.defines = _bound_names(node)
+        self.uses = _used_names(node)
+
+
+def _segments(source: str, tree: ast.Module, count_tokens: Callable[[str], int]) -> List[_Segment]:
+    """
+    split the file into segments, one per top-level statement.
+    comments and blank lines between two statements are attached to the statement that follows them, so joining all
+    the segments gives back the original file.
+    """
+    lines = source.splitlines(keepends=True)
+    segments = []
+    previous_end = 0
+    for position, node in enumerate(tree.body):
+        start = previous_end + 1
+        end = node.end_lineno if position < len(tree.body) - 1 else len(lines)
+        text = "".join(lines[start - 1:end])
+        segments.append(_Segment(node, start, end, text, count_tokens(text)))
+        previous_end = end
+    return segments
+
+
+def _header_for(segments: List[_Segment], members: List[_Segment]) -> str:
+    """imports and module level definitions that the chunk uses but does not define"""
+    defined = set().union(*(segment.defines for segment in members))
+    used = set().union(*(segment.uses for segment in members)) - defined
+    imports = []
+    stubs = []
+    for segment in segments:
+        if segment in members or not (segment.defines & used):
+            continue
+        if isinstance(segment.node, (ast.Import, ast.ImportFrom)):
+            trimmed = _trim_import(segment.node, used)
+            if trimmed:
+                imports.append(trimmed)
+        else:
+            stubs.append(_definition_stub(segment.node))
+    return "\n".join(imports + stubs)
+
+
+def chunk_source(
+        source: str,
+        max_tokens: int,
+        count_tokens: Callable[[str], int] = approximate_tokens,
+        min_chunks: int = 1,
+        include: Optional[Callable[[ast.stmt], bool]] = None
+) -> List[Chunk]:
+    """
+    split python source code into chunks on top-level statement boundaries.
+    :param source: the python code to split
+    :param max_tokens: the token budget of a single chunk (without its header). a single statement which is larger than
+    the budget gets a chunk of its own.
+    :param count_tokens: function that counts the tokens of a text
+    :param min_chunks: the minimal number of chunks to produce when the file is large enough, used to spread a file
+    across several workers
+    :param include: optional predicate on top-level statements, only the statements it accepts are packed into chunks
+    (the headers are still computed against the whole file)
+    :return: list of chunks ordered by their position in the file
+    """
+    tree = ast.parse(source)
+    segments = _segments(source, tree, count_tokens)
+    if not segments:
+        return [Chunk(0, source, "", 1, max(len(source.splitlines()), 1), set())] if source.strip() else []
+    selected = [segment for segment in segments if include is None or include(segment.node)]
+    if not selected:
+        return []
+
+    total_tokens = sum(segment.tokens for segment in selected)
+    budget = max(1, min(max_tokens, math.ceil(total_tokens / max(min_chunks, 1))))
+
+    groups: List[List[_Segment]] = [[]]
+    group_tokens = 0
+    for segment in selected:
+        if groups[-1] and group_tokens + segment.tokens > budget:
+            groups.append([])
+            group_tokens = 0
+        groups[-1].append(segment)
+        group_tokens += segment.tokens
+
+    chunks = []
+    for index, members in enumerate(groups):
+        chunks.append(Chunk(
+            index=index,
+            source="".join(segment.source for segment in members),
+            header=_header_for(segments, members),
+            start_line=members[0].start_line,
+            end_line=members[-1].end_line,
+            names=set().union(*(segment.defines for segment in members)),
+            nodes=[segment.node for segment in members],
+        ))
+    return chunks
+
@@ -0,0 +1,162 @@
+"""
+Request coalescing.
+
+most files of a repository are small, and a request per file pays the instructions and the latency of a round trip
+for a few lines of code. the coalescer packs many small units (files) into one prompt, every unit after a marker line,
+up to the token budget of the model. the completion is split back at the markers and every unit is validated on its
+own - the valid units are cached under the key of a standalone request of the unit, the others are left to the caller
+to request on their own.
+"""
+import logging
+import re
+from typing import Callable, Dict, List, Optional
+
+from autopy import metrics
+from autopy.completion.client import CompletionClient, CompletionRequest
+from autopy.completion.tokens import TYPED_OUTPUT_RATIO, completion_budget, context_size, count_tokens
+from autopy.type.utils.symbols import context_prompt, merge_contexts
+
+logger = logging.getLogger(__name__)
+
+UNIT_MARKER = "# ---- unit {} ----"
+UNIT_PATTERN = re.compile(r"^# ---- unit (\d+) ----[ \t]*$", re.MULTILINE)
+COALESCE_PROMPT = ("\n the code is made of {} independent files, every file starts with a line like `{}`. type every "
+                   "file on its own, and output every file after its line, keep the lines as they are")
+
+
+class Unit:
+    def __init__(self, code: str, cache_key: str, context: str = "",
+                 validate: Optional[Callable[[str], bool]] = None) -> None:
+        """
+        a piece of code that is typed on its own
+        :param code: the code to type
+        :param cache_key: the cache key of a standalone request of the code
+        :param context: the project context of the code, see autopy.type.utils.symbols
+        :param validate: check of the typed code, invalid units are not returned
+        """
+        self.code = code
+        self.cache_key = cache_key
+        self.context = context
+        self.validate = validate
+
+
+def split_units(text: str) -> Dict[int, str]:
+    """
+    split a coalesced completion at the unit markers
+    :param text: the completion
+    :return: mapping from the number of a unit to its typed code, units without a marker are missing
+    """
+    markers = list(UNIT_PATTERN.finditer(text))
+    units = {}
+    for marker, following in zip(markers, markers[1:] + [None]):
+        end = following.start() if following is not None else len(text)
+        units.setdefault(int(marker.group(1)), text[marker.end():end].strip("\n") + "\n")
+    return units
+
+
+class Coalescer:
+    def __init__(self, client: CompletionClient, model: str, instructions: str, max_units: int = 32,
+                 reserve: int = 64) -> None:
+        """
+        packs small units into shared requests
+        :param client: the completion client
+        :param model: the model to use
+        :param instructions: the instructions of every unit
+        :param max_units: maximal number of units in a single request
+        :param reserve: tokens to keep free as a safety margin
+        """
+        self.client = client
+        self.model = model
+        self.instructions = instructions
+        self.max_units = max_units
+        self.reserve = reserve
+        self.tokens_used = 0
+        self.requests = 0
+
+    def cost(self, unit: Unit, number: int) -> float:
+        """the tokens that a unit adds to a request, with the expected size of its typed version"""
+        code_tokens = count_tokens(UNIT_MARKER.format(number) + "\n" + unit.code, self.model)
+        return code_tokens * (1 + TYPED_OUTPUT_RATIO) + count_tokens(unit.context, self.model)
+
+    @property
+    def budget(self) -> int:
+        """the tokens of a request that are left for the units"""
+        prompt = self.instructions + COALESCE_PROMPT.format(self.max_units, UNIT_MARKER.format(1)) + context_prompt(" ")
+        return context_size(self.model) - count_tokens(prompt, self.model) - self.reserve
+
+    def max_unit_tokens(self) -> int:
+        """units larger than this share a request with one other unit at most, they are not worth coalescing"""
+        return int(self.budget / (1 + TYPED_OUTPUT_RATIO) / 2)
+
+    def pack(self, units: List[Unit]) -> List[List[int]]:
+        """
+        group the units in their order, every group fits in a single request
+        :param units: the units to pack
+        :return: the indices of the units of every group
+        """
+        budget = self.budget
+        groups: List[List[int]] = []
+        group: List[int] = []
+        used = 0.0
+        for index, unit in enumerate(units):
+            cost = self.cost(unit, len(group) + 1)
+            if group and (used + cost > budget or len(group) == self.max_units):
+                groups.append(group)
+                group, used = [], 0.0
+                cost = self.cost(unit, 1)
+            group.append(index)
+            used += cost
+        if group:
+            groups.append(group)
+        return groups
+
+    def prompt(self, units: List[Unit]) -> str:
+        code = "\n".join(f"{UNIT_MARKER.format(number)}\n{unit.code.rstrip()}" for number, unit in
+                         enumerate(units, start=1))
+        return (self.instructions + context_prompt(merge_contexts(unit.context for unit in units)) +
+                COALESCE_PROMPT.format(len(units), UNIT_MARKER.format(1)) + "\n this is the code:\n" + code + "\n")
+
+    def complete(self, units: List[Unit]) -> List[Optional[str]]:
+        """
+        type the units in as few requests as possible
+        :param units: the units to type
+        :return: the typed code of every unit, None for the units that were not typed (missing from the completion,
+        not valid or alone in their group) and have to be requested on their own
+        """
+        results: List[Optional[str]] = [None] * len(units)
+        cache = self.client.cache
+        pending = []
+        for index, unit in enumerate(units):
+            text = cache.get(unit.cache_key) if cache is not None else None
+            if text is not None and (unit.validate is None or unit.validate(text)):
+                metrics.increment("cache_hits")
+                results[index] = text
+            else:
+                pending.append(index)
+
+        groups = [[pending[position] for position in group] for group in self.pack([units[i] for i in pending])]
+        # a unit alone in its group gains nothing from coalescing
+        groups = [group for group in groups if len(group) > 1]
+        requests = []
+        for group in groups:
+            prompt = self.prompt([units[index] for index in group])
+            requests.append(CompletionRequest(prompt, completion_budget(prompt, self.model), self.model))
+        completions = self.client.complete_many(requests) if requests else []
+        self.requests += len(requests)
+
+        for group, completion in zip(groups, completions):
+            self.tokens_used += completion.total_tokens
+            typed_units = split_units(completion.text)
+            for number, index in enumerate(group, start=1):
+                unit = units[index]
+                text = typed_units.get(number)
+                if text is None or (unit.validate is not None and not unit.validate(text)):
+                    metrics.increment("coalesced_fallbacks")
+                    continue
+                results[index] = text
+                if cache is not None:
+                    cache.put(unit.cache_key, text)
+        metrics.increment("coalesced_requests", len(requests))
+        metrics.increment("coalesced_units", sum(len(group) for group in groups))
+        logger.info(f"{sum(len(group) for group in groups)} units were sent in {len(requests)} requests")
+        return results
@@ -0,0 +1,28 @@
+import glob
+from pathlib import Path
+from typing import Iterable, List, Union
+
+IGNORED_DIRECTORIES = {".git", ".hg", ".tox", ".nox", ".venv", "venv", "__pycache__", "build", "dist", "node_modules"}
+
+
+def collect_python_files(path: Union[str, Path], skip_typed: bool = True) -> List[Path]:
+    """
+    collect python files
+    :param path: a python file, a directory (searched recursively) or a glob pattern
+    :param skip_typed: skip the files that are an output of autopy (`*_typed.py`)
+    :return: sorted list of python files
+    """
+    path = str(path)
+    if Path(path).is_file():
+        candidates: Iterable[Path] = [Path(path)]
+    elif Path(path).is_dir():
+        candidates = (
+            file for file in Path(path).rglob("*.py")
+            if not IGNORED_DIRECTORIES.intersection(file.relative_to(path).parts[:-1])
+        )
+    else:
+        candidates = (Path(file) for file in glob.glob(path, recursive=True))
+    return sorted(
+        file for file in candidates
+        if file.suffix == ".py" and file.is_file() and not (skip_typed and file.stem.endswith("_typed"))
+    )
@@ -0,0 +1,160 @@
+"""
+Annotations-only completions.
+
+instead of echoing the whole typed file back, the model gets a json template with a null in the place of every missing
+hint of the code it sees, and returns the template with the hints. the hints are written into the original source by
+the applier of autopy.type.utils.annotations, so everything besides the hints (formatting, comments, the bodies of the
+functions) is never touched, and the output tokens are only the hints themselves.
+
+the hints the model returns are checked before they are applied - only expressions that look like type hints (names,
+attributes, subscripts, string forward references and unions) are accepted, so a hint can't run code or change the
+signature it is written into.
+"""
+import ast
+import difflib
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from autopy.type.utils.annotations import Annotations, apply_annotations
+from autopy.type.utils.validator import CoverageReport, strip_annotations
+
+logger = logging.getLogger(__name__)
+
+# the size of the template and of the returned hints relatively to the code
+HINTS_OUTPUT_RATIO = 0.5
+HINTS_INSTRUCTIONS = ("add type hints to the code below. do not output the code - output only the json template below, "
+                      "with a type hint (as a string) in the place of every null")
+# the nodes a hint may consist of
+HINT_NODES = (ast.Name, ast.Attribute, ast.Subscript, ast.Constant, ast.Tuple, ast.List, ast.BinOp, ast.BitOr,
+              ast.Load)
+
+
+def hint_template(report: CoverageReport) -> Dict[str, Any]:
+    """
+    the hints that the code misses, with a None in the place of every hint
+    :param report: coverage report of the code
+    :return: a template in the format of Annotations.to_dict - the arguments and return values of the functions, the
+    module variables and the class attributes (each one once, the local variables of functions are left out)
+    """
+    functions: Dict[str, Dict[str, Any]] = {}
+    for function in report.functions:
+        missing = function.missing
+        if missing:
+            functions[function.name] = {"arguments": {name: None for name in missing if name != "return"}}
+            if "return" in missing:
+                functions[function.name]["returns"] = None
+    variables = [variable for variable in report.variables if not variable.scope]
+    variables += [attribute for cls in report.classes for attribute in cls.attributes]
+    annotated = {(variable.scope, variable.name) for variable in variables if variable.annotated}
+    requested: Dict[Tuple[str, str], None] = {}
+    for variable in sorted(variables, key=lambda variable: variable.lineno):
+        if (variable.scope, variable.name) not in annotated:
+            requested[(variable.scope, variable.name)] = None
+    template: Dict[str, Any] = {}
+    if functions:
+        template["functions"] = functions
+    if requested:
+        template["variables"] = [[scope, name, None] for scope, name in requested]
+    return template
+
+
+def merge_templates(templates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    merged: Dict[str, Any] = {}
+    for template in templates:
+        if "functions" in template:
+            merged.setdefault("functions", {}).update(template["functions"])
+        if "variables" in template:
+            merged.setdefault("variables", []).extend(template["variables"])
+    return merged
+
+
+def normalize_hint(hint: Any) -> Optional[str]:
+    """
+    :param hint: a hint that the model returned
+    :return: the hint in its canonical form, None if it is not a valid type hint
+    """
+    if not isinstance(hint, str) or not hint.strip():
+        return None
+    try:
+        tree = ast.parse(hint.strip(), mode="eval")
+    except SyntaxError:
+        return None
+    if isinstance(tree.body, ast.Tuple) or not all(isinstance(node, HINT_NODES) for node in ast.walk(tree.body)):
+        return None
+    if isinstance(tree.body, ast.Constant) and not isinstance(tree.body.value, str) and tree.body.value is not None:
+        return None
+    return ast.unparse(tree.body)
+
+
+def parse_hints(text: str) -> Optional[Annotations]:
+    """
+    parse the json that the model returned, invalid hints are left out
+    :param text: the completion
+    :return: the hints, None if the completion has no json object
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    annotations = Annotations()
+    functions = data.get("functions")
+    for name, function in (functions.items() if isinstance(functions, dict) else ()):
+        if not isinstance(function, dict):
+            continue
+        arguments = function.get("arguments")
+        for argument, hint in (arguments.items() if isinstance(arguments, dict) else ()):
+            hint = normalize_hint(hint)
+            if hint is not None:
+                annotations.add_argument(name, argument, hint)
+        returns = normalize_hint(function.get("returns"))
+        if returns is not None:
+            annotations.add_return(name, returns)
+    variables = data.get("variables")
+    for variable in (variables if isinstance(variables, list) else ()):
+        if isinstance(variable, list) and len(variable) == 3 and all(isinstance(part, str) for part in variable[:2]):
+            hint = normalize_hint(variable[2])
+            if hint is not None:
+                annotations.add_variable(variable[0], variable[1], hint)
+    return annotations
+
+
+def apply_hints(source: str, tree: ast.Module, annotations: Annotations) -> Optional[str]:
+    """
+    write hints into the source and make sure that nothing but the hints changed
+    :param source: the source
+    :param tree: the parsed source
+    :param annotations: the hints
+    :return: the source with the hints, None if they could not be applied
+    """
+    typed = apply_annotations(source, annotations, tree)
+    try:
+        typed_tree = ast.parse(typed)
+        compile(typed_tree, "<typed>", "exec")
+    except (SyntaxError, ValueError) as e:
+        logger.warning(f"the hints can't be applied: {e}")
+        return None
+    if ast.dump(strip_annotations(typed_tree)) != ast.dump(strip_annotations(tree)):
+        logger.warning("the hints changed the code, they are not applied")
+        return None
+    return typed
+
+
+def unified_diff(original: str, typed: str, path: str) -> str:
+    """the change from the original file to the typed file as a unified diff, empty if nothing changed"""
+    return "".join(difflib.unified_diff(original.splitlines(keepends=True), typed.splitlines(keepends=True),
+                                        fromfile=f"a/{path}", tofile=f"b/{path}"))
+
+
+def requested_count(template: Dict[str, Any]) -> int:
+    """the number of hints that a template requests"""
+    count = len(template.get("variables", []))
+    for function in template.get("functions", {}).values():
+        count += len(function["arguments"]) + ("returns" in function)
+    return count
+
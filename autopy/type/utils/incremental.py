@@ -0,0 +1,176 @@
+"""
+Incremental re-typing.
+
+every top-level statement of the source file is fingerprinted with a hash of its normalized ast (so formatting and
+comments do not matter). the manifest, stored next to the typed output, maps the fingerprints to the typed version of
+the statement. on the next run only the statements whose fingerprint is not in the manifest are sent to the model, and
+the typed version of everything else is spliced back from the manifest.
+"""
+import ast
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from autopy.type.utils.chunker import DEFINITION_NODES
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+IMPORT_NODES = (ast.Import, ast.ImportFrom)
+
+
+def fingerprint(node: ast.AST) -> str:
+    """
+    hash of the normalized ast of a node, line numbers, formatting and comments are ignored
+    :param node: the node to fingerprint
+    :return: hex digest of the node
+    """
+    return hashlib.sha256(ast.dump(node, include_attributes=False).encode("utf-8")).hexdigest()
+
+
+def node_source(lines: List[str], node: ast.stmt) -> str:
+    """the source of a top-level statement, including its decorators"""
+    start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])])
+    return "".join(lines[start - 1:node.end_lineno]).rstrip("\n")
+
+
+def manifest_path_for(typed_path: Path) -> Path:
+    """the manifest of `x_typed.py` is `x_typed.manifest.json`"""
+    return typed_path.with_suffix(".manifest.json")
+
+
+def match_typed(nodes: List[ast.stmt], typed_source: str) -> Dict[int, str]:
+    """
+    find the typed version of every original statement in the code the model returned.
+    definitions are matched by name, the other statements (besides imports) by their order.
+    :param nodes: the original top-level statements
+    :param typed_source: the code the model returned for these statements
+    :return: mapping from the index of a statement in `nodes` to its typed source
+    """
+    try:
+        typed_tree = ast.parse(typed_source)
+    except SyntaxError:
+        logger.warning("the typed code is not valid python, it can not be matched to the original statements")
+        return {}
+    typed_lines = typed_source.splitlines(keepends=True)
+    definitions: Dict[str, List[str]] = {}
+    statements = []
+    for node in typed_tree.body:
+        if isinstance(node, DEFINITION_NODES):
+            definitions.setdefault(node.name, []).append(node_source(typed_lines, node))
+        elif not isinstance(node, IMPORT_NODES):
+            statements.append(node_source(typed_lines, node))
+
+    matched = {}
+    original_statements = []
+    for index, node in enumerate(nodes):
+        if isinstance(node, DEFINITION_NODES):
+            if definitions.get(node.name):
+                matched[index] = definitions[node.name].pop(0)
+        elif not isinstance(node, IMPORT_NODES):
+            original_statements.append(index)
+    if len(original_statements) == len(statements):
+        matched.update(zip(original_statements, statements))
+    return matched
+
+
+def typed_imports(typed_source: str) -> List[str]:
+    """the top-level import statements of the code the model returned"""
+    try:
+        typed_tree = ast.parse(typed_source)
+    except SyntaxError:
+        return []
+    typed_lines = typed_source.splitlines(keepends=True)
+    return [node_source(typed_lines, node) for node in typed_tree.body if isinstance(node, IMPORT_NODES)]
+
+
+class Manifest:
+    def __init__(self, model: str, instructions: str, units: Optional[Dict[str, str]] = None,
+                 imports: Optional[List[str]] = None) -> None:
+        """
+        record of a typing run
+        :param model: the model that typed the file
+        :param instructions: the instructions that were sent to the model
+        :param units: mapping from the fingerprint of an original statement to its typed source
+        :param imports: import statements that the typed code needs (e.g. `from typing import List`)
+        """
+        self.model = model
+        self.instructions = instructions
+        self.units = units or {}
+        self.imports = imports or []
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["Manifest"]:
+        if not path.is_file():
+            return None
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"ignoring unreadable manifest {path}: {e}")
+            return None
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(data["model"], data["instructions"], data["units"], data["imports"])
+
+    def save(self, path: Path) -> None:
+        with open(path, "w") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "model": self.model,
+                "instructions": self.instructions,
+                "imports": self.imports,
+                "units": self.units,
+            }, f, indent=1)
+
+    def matches(self, model: str, instructions: str) -> bool:
+        """a manifest can only be reused when the file is typed by the same model with the same instructions"""
+        return self.model == model and self.instructions == instructions
+
+    def update(self, nodes: List[ast.stmt], typed_source: str,
+               validate: Optional[Callable[[ast.stmt, str], bool]] = None) -> None:
+        """
+        record the typed version of statements
+        :param nodes: the original statements that were sent to the model
+        :param typed_source: the code that the model returned
+        :param validate: optional check of the typed version of a statement, statements that fail it are not recorded
+        and will be typed again
+        """
+        for index, typed in match_typed(nodes, typed_source).items():
+            if validate is None or validate(nodes[index], typed):
+                self.record(nodes[index], typed)
+        for typed_import in typed_imports(typed_source):
+            self.add_import(typed_import)
+
+    def record(self, node: ast.stmt, typed: str) -> None:
+        """record the typed version of a single statement"""
+        self.units[fingerprint(node)] = typed
+
+    def add_import(self, typed_import: str) -> None:
+        if typed_import not in self.imports:
+            self.imports.append(typed_import)
+
+    def missing(self, tree: ast.Module) -> List[ast.stmt]:
+        """the top-level statements (besides imports) that do not have a typed version yet"""
+        return [node for node in tree.body
+                if not isinstance(node, IMPORT_NODES) and fingerprint(node) not in self.units]
+
+    def prune(self, tree: ast.Module) -> None:
+        """forget the statements that are not part of the source anymore"""
+        current = {fingerprint(node) for node in tree.body}
+        self.units = {key: typed for key, typed in self.units.items() if key in current}
+
+    def splice(self, source: str, tree: ast.Module) -> str:
+        """
+        build the typed file - the source where every statement is replaced by its typed version, see
+        autopy.type.utils.reassemble
+        :param source: the current source file
+        :param tree: the parsed source
+        :return: the typed file
+        """
+        # imported here, the reassembly depends on the fingerprints of this module
+        from autopy.type.utils.reassemble import reassemble
+
+        return reassemble(source, tree, self.units, self.imports)
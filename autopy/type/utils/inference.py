@@ -0,0 +1,476 @@
+"""
+Local type inference.
+
+a deterministic pass over the ast that finds the hints that are obvious from the code itself - literals, constructor
+calls of known classes, builtins with a fixed return type, the hints of the arguments a value comes from, functions
+that never return a value and defaults of arguments. only names that are bound once in their scope with an inferable
+value are annotated, so the pass never has to choose between two types. whatever it can't infer is left for the model.
+"""
+import ast
+import logging
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from autopy.type.utils.annotations import Annotations, scope_walk, target_name
+
+logger = logging.getLogger(__name__)
+
+FunctionNode = Union[ast.FunctionDef, ast.AsyncFunctionDef]
+
+CONSTANT_TYPES = (bool, int, float, complex, str, bytes)
+# builtins whose return type does not depend on their arguments
+BUILTIN_RETURNS = {
+    "ascii": "str", "bin": "str", "bool": "bool", "callable": "bool", "chr": "str", "float": "float",
+    "format": "str", "hash": "int", "hasattr": "bool", "hex": "str", "id": "int", "input": "str", "int": "int",
+    "isinstance": "bool", "issubclass": "bool", "len": "int", "oct": "str", "ord": "int", "repr": "str", "str": "str",
+    "bytes": "bytes", "complex": "complex",
+}
+# methods of str that return a str
+STR_METHODS = {
+    "capitalize", "casefold", "center", "expandtabs", "format", "format_map", "join", "ljust", "lower", "lstrip",
+    "removeprefix", "removesuffix", "replace", "rjust", "rstrip", "strip", "swapcase", "title", "translate", "upper",
+    "zfill",
+}
+NUMBERS = ("int", "float")
+# base classes and decorators of classes whose class level annotations change their behaviour (fields, members)
+SPECIAL_CLASS_NAMES = {"dataclass", "NamedTuple", "TypedDict", "Enum", "IntEnum", "Flag", "IntFlag", "BaseModel",
+                       "attrs", "define", "frozen", "Protocol"}
+
+
+def _decorator_names(node: Union[FunctionNode, ast.ClassDef]) -> Set[str]:
+    names = set()
+    for decorator in node.decorator_list:
+        decorator = decorator.func if isinstance(decorator, ast.Call) else decorator
+        if isinstance(decorator, ast.Attribute):
+            names.add(decorator.attr)
+        elif isinstance(decorator, ast.Name):
+            names.add(decorator.id)
+    return names
+
+
+class ModuleContext:
+    def __init__(self, tree: ast.Module) -> None:
+        """
+        the module level names that the inference can refer to
+        :param tree: the parsed module
+        """
+        # top-level classes and the line where each one is defined
+        self.classes: Dict[str, int] = {}
+        # names that were imported into the module
+        self.imported: Set[str] = set()
+        # every other module level name, a builtin with the same name is shadowed
+        self.defined: Set[str] = set()
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef):
+                self.classes.setdefault(node.name, node.lineno)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                self.imported.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                self.defined.add(node.name)
+            elif isinstance(node, ast.Assign):
+                self.defined.update(sub_node.id for target in node.targets for sub_node in ast.walk(target)
+                                    if isinstance(sub_node, ast.Name))
+
+    def constructor(self, func: ast.expr) -> Optional[str]:
+        """the type that a call creates, if the callee is a known class"""
+        if isinstance(func, ast.Name):
+            if func.id in self.classes:
+                return func.id
+            if func.id in self.imported and func.id[:1].isupper():
+                return func.id
+            if func.id in BUILTIN_RETURNS and func.id not in self.imported | self.defined:
+                return BUILTIN_RETURNS[func.id]
+            return None
+        # `module.ClassName(...)`, e.g. `storage.Client()`
+        parts = []
+        while isinstance(func, ast.Attribute):
+            parts.append(func.attr)
+            func = func.value
+        if isinstance(func, ast.Name) and func.id in self.imported and parts and parts[0][:1].isupper() and \
+                all(part[:1].islower() or part[:1] == "_" for part in parts[1:]):
+            return ".".join([func.id] + list(reversed(parts)))
+        return None
+
+    def forward_reference(self, hint: str, line: int) -> str:
+        """quote a hint that refers to a class of the module that is not defined yet at `line`"""
+        names = {node.id for node in ast.walk(ast.parse(hint, mode="eval")) if isinstance(node, ast.Name)}
+        if any(self.classes.get(name, 0) >= line for name in names if name in self.classes):
+            return f'"{hint}"'
+        return hint
+
+
+class ExpressionTyper:
+    def __init__(self, context: ModuleContext, names: Optional[Dict[str, str]] = None) -> None:
+        """
+        :param context: the module level names
+        :param names: the hints of the names in the current scope, e.g. the annotated arguments
+        """
+        self.context = context
+        self.names = names or {}
+
+    def __call__(self, node: ast.expr) -> Optional[str]:
+        """
+        :param node: an expression
+        :return: its type, or None if it is not obvious
+        """
+        method = getattr(self, f"_{type(node).__name__.lower()}", None)
+        return method(node) if method is not None else None
+
+    def _constant(self, node: ast.Constant) -> Optional[str]:
+        if isinstance(node.value, CONSTANT_TYPES):
+            return type(node.value).__name__
+        return None
+
+    def _joinedstr(self, node: ast.JoinedStr) -> str:
+        return "str"
+
+    def same(self, nodes: List[ast.expr]) -> Optional[str]:
+        """the type of all the expressions, if it is the same for all of them"""
+        hints = {self(node) for node in nodes}
+        if len(hints) != 1 or None in hints:
+            if hints <= {"int", "float"} and "float" in hints:
+                return "float"
+            return None
+        return hints.pop()
+
+    def _container(self, name: str, elements: List[ast.expr]) -> Optional[str]:
+        if not elements or any(isinstance(element, ast.Starred) for element in elements):
+            return None
+        element = self.same(elements)
+        return f"{name}[{element}]" if element else None
+
+    def _list(self, node: ast.List) -> Optional[str]:
+        return self._container("List", node.elts)
+
+    def _set(self, node: ast.Set) -> Optional[str]:
+        return self._container("Set", node.elts)
+
+    def _tuple(self, node: ast.Tuple) -> Optional[str]:
+        if not node.elts or any(isinstance(element, ast.Starred) for element in node.elts):
+            return None
+        elements = [self(element) for element in node.elts]
+        return f"Tuple[{', '.join(elements)}]" if None not in elements else None
+
+    def _dict(self, node: ast.Dict) -> Optional[str]:
+        if not node.keys or None in node.keys:
+            # empty, or `**other` unpacking
+            return None
+        key, value = self.same(node.keys), self.same(node.values)
+        return f"Dict[{key}, {value}]" if key and value else None
+
+    def _name(self, node: ast.Name) -> Optional[str]:
+        return self.names.get(node.id)
+
+    def _call(self, node: ast.Call) -> Optional[str]:
+        func = node.func
+        if isinstance(func, ast.Attribute) and func.attr in STR_METHODS and self(func.value) == "str":
+            return "str"
+        if isinstance(func, ast.Name) and func.id in self.names:
+            # a local callable shadows the module level names
+            return None
+        return self.context.constructor(func)
+
+    def _unaryop(self, node: ast.UnaryOp) -> Optional[str]:
+        if isinstance(node.op, ast.Not):
+            return "bool"
+        operand = self(node.operand)
+        return operand if operand in NUMBERS else None
+
+    def _compare(self, node: ast.Compare) -> Optional[str]:
+        if all(isinstance(op, (ast.Is, ast.IsNot, ast.In, ast.NotIn)) for op in node.ops):
+            return "bool"
+        # rich comparisons of other types (e.g. arrays) do not return a bool
+        operands = [self(operand) for operand in [node.left] + node.comparators]
+        return "bool" if all(operand in NUMBERS + ("str", "bytes", "bool") for operand in operands) else None
+
+    def _binop(self, node: ast.BinOp) -> Optional[str]:
+        left, right = self(node.left), self(node.right)
+        if left == "str" and isinstance(node.op, ast.Mod):
+            return "str"
+        if left in ("str", "bytes") and (right == left and isinstance(node.op, ast.Add) or
+                                         right == "int" and isinstance(node.op, ast.Mult)):
+            return left
+        if left not in NUMBERS or right not in NUMBERS:
+            return None
+        if isinstance(node.op, ast.Div):
+            return "float"
+        if isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.FloorDiv, ast.Mod)):
+            return "float" if "float" in (left, right) else "int"
+        return None
+
+    def _ifexp(self, node: ast.IfExp) -> Optional[str]:
+        return self.same([node.body, node.orelse])
+
+
+class Scope:
+    def __init__(self, body: List[ast.stmt]) -> None:
+        """
+        everything the inference needs to know about a scope, collected in a single walk
+        :param body: the body of the module, class or function
+        """
+        # every binding of a name and of a `self.x` style attribute
+        self.names: Dict[str, List[ast.AST]] = {}
+        self.attributes: Dict[str, List[ast.AST]] = {}
+        # the assignments with a single target, by the id of the target
+        self.assignments: Dict[int, ast.Assign] = {}
+        self.definitions: List[Union[FunctionNode, ast.ClassDef]] = []
+        self.returns: List[ast.Return] = []
+        self.generator = False
+        # global and nonlocal names
+        self.declared: Set[str] = set()
+        self.globals: Set[str] = set()
+        self.nonlocals: Set[str] = set()
+        for node in scope_walk(body):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                self.names.setdefault(node.name, []).append(node)
+                self.definitions.append(node)
+            elif isinstance(node, ast.Assign):
+                if len(node.targets) == 1 and node.type_comment is None:
+                    self.assignments[id(node.targets[0])] = node
+            elif isinstance(node, ast.Return):
+                self.returns.append(node)
+            elif isinstance(node, (ast.Yield, ast.YieldFrom)):
+                self.generator = True
+            elif isinstance(node, (ast.Global, ast.Nonlocal)):
+                self.declared.update(node.names)
+                (self.globals if isinstance(node, ast.Global) else self.nonlocals).update(node.names)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    self.names.setdefault((alias.asname or alias.name).split(".")[0], []).append(node)
+            elif isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)) and node.name:
+                self.names.setdefault(node.name, []).append(node)
+            elif isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+                self.names.setdefault(node.id, []).append(node)
+            elif isinstance(node, ast.Attribute) and isinstance(node.ctx, (ast.Store, ast.Del)):
+                name = target_name(node)
+                if name is not None:
+                    self.attributes.setdefault(name, []).append(node)
+
+
+def _start_line(node: ast.stmt) -> int:
+    return min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])])
+
+
+class Inference:
+    def __init__(self, tree: ast.Module) -> None:
+        """
+        infer the obvious type hints of a module
+        :param tree: the parsed module, it is not modified
+        """
+        self.tree = tree
+        self.context = ModuleContext(tree)
+        self.annotations = Annotations()
+        self._scopes: Dict[int, Scope] = {}
+        self._defined: Dict[str, int] = {}
+
+    def scope(self, node: Union[ast.Module, FunctionNode, ast.ClassDef]) -> Scope:
+        if id(node) not in self._scopes:
+            self._scopes[id(node)] = Scope(node.body)
+        return self._scopes[id(node)]
+
+    def nested(self, scope: Scope) -> Iterator[Scope]:
+        """the scopes of the definitions inside a scope, at any depth"""
+        for definition in scope.definitions:
+            nested = self.scope(definition)
+            yield nested
+            yield from self.nested(nested)
+
+    def run(self) -> Annotations:
+        module = self.scope(self.tree)
+        self._count(module.definitions, [])
+        for definition in module.definitions:
+            # the hints of a definition are evaluated when its top-level statement runs
+            self._infer_definition(definition, [], _start_line(definition))
+        # a function can rebind a module variable with `global x`, its single assignment does not tell its type
+        rebound = {name for scope in self.nested(module) for name in scope.globals}
+        self._annotate_variables(module, "", ExpressionTyper(self.context), evaluated_at=0, rebound=rebound)
+        return self.annotations
+
+    def _count(self, definitions: List[Union[FunctionNode, ast.ClassDef]], scopes: List[str]) -> None:
+        """count the definitions of every qualified name, redefined functions (e.g. property setters) are skipped"""
+        for node in definitions:
+            name = ".".join(scopes + [node.name])
+            self._defined[name] = self._defined.get(name, 0) + 1
+            self._count(self.scope(node).definitions, scopes + [node.name])
+
+    def _infer_definition(self, node: Union[FunctionNode, ast.ClassDef], scopes: List[str], line: int,
+                          method: bool = False) -> None:
+        if isinstance(node, ast.ClassDef):
+            self._infer_class(node, scopes, line)
+        else:
+            self._infer_function(node, scopes, line, method)
+
+    def _infer_class(self, node: ast.ClassDef, scopes: List[str], line: int) -> None:
+        qualname = ".".join(scopes + [node.name])
+        scope = self.scope(node)
+        bases = {base.attr if isinstance(base, ast.Attribute) else getattr(base, "id", None) for base in node.bases}
+        special = bool((bases | _decorator_names(node)) & SPECIAL_CLASS_NAMES) or bool(node.keywords)
+        if not special:
+            self._annotate_variables(scope, qualname, ExpressionTyper(self.context), evaluated_at=line)
+        for child in scope.definitions:
+            self._infer_definition(child, scopes + [node.name], line, method=True)
+        methods = [child for child in scope.definitions if not isinstance(child, ast.ClassDef)]
+        self._annotate_attributes(scope, methods, scopes + [node.name])
+
+    def _argument_hints(self, node: FunctionNode, qualname: str) -> Dict[str, str]:
+        """the hints of the arguments, the ones in the source and the ones that were inferred"""
+        args = node.args
+        arguments = args.posonlyargs + args.args + args.kwonlyargs
+        hints = {arg.arg: ast.unparse(arg.annotation) for arg in arguments if arg.annotation is not None}
+        if qualname in self.annotations.functions:
+            hints.update(self.annotations.functions[qualname].arguments)
+        return hints
+
+    def _infer_function(self, node: FunctionNode, scopes: List[str], line: int, method: bool) -> None:
+        qualname = ".".join(scopes + [node.name])
+        scope = self.scope(node)
+        for child in scope.definitions:
+            self._infer_definition(child, scopes + [node.name], line)
+        if self._defined.get(qualname, 0) != 1:
+            return
+
+        typer = ExpressionTyper(self.context, self._argument_hints(node, qualname))
+        decorators = _decorator_names(node)
+        args = node.args
+        positional = args.posonlyargs + args.args
+        if method and "staticmethod" not in decorators:
+            positional = positional[1:]
+        defaults = list(zip(positional[len(positional) - len(args.defaults):], args.defaults)) if args.defaults else []
+        defaults += [(arg, default) for arg, default in zip(args.kwonlyargs, args.kw_defaults) if default is not None]
+        for arg, default in defaults:
+            hint = typer(default) if arg.annotation is None else None
+            # only scalars, a container default does not tell the type of the elements callers pass
+            if hint in NUMBERS + ("str", "bytes", "bool", "complex"):
+                self.annotations.add_argument(qualname, arg.arg, hint)
+                typer.names[arg.arg] = hint
+
+        rebound = {name for nested in self.nested(scope) for name in nested.nonlocals}
+        self._annotate_variables(scope, qualname, typer, evaluated_at=None, rebound=rebound)
+        if node.returns is None and "abstractmethod" not in decorators:
+            hint = self._return_hint(node, scope, typer)
+            if hint is not None:
+                self.annotations.add_return(qualname, self.context.forward_reference(hint, line))
+
+    def _return_hint(self, node: FunctionNode, scope: Scope, typer: ExpressionTyper) -> Optional[str]:
+        if scope.generator:
+            # generators are left for the model
+            return None
+        values = [child.value for child in scope.returns if child.value is not None]
+        if not values:
+            if isinstance(node.body[-1], ast.Raise) or (node.name != "__init__" and _is_stub(node)):
+                # abstract methods and stubs are implemented elsewhere
+                return None
+            return "None"
+        optional = [value for value in values if not (isinstance(value, ast.Constant) and value.value is None)]
+        if not optional:
+            return "None"
+        hint = typer.same(optional)
+        if hint is None:
+            return None
+        if len(optional) < len(values) or _falls_through(node.body):
+            # the function returns None in some of its paths
+            return f"Optional[{hint}]"
+        return hint
+
+    def _annotate_variables(self, scope: Scope, name: str, typer: ExpressionTyper,
+                            evaluated_at: Optional[int], rebound: Set[str] = frozenset()) -> None:
+        """
+        annotate the names that are bound once in a scope, by an assignment with an inferable value
+        :param scope: the scope
+        :param name: qualified name of the scope
+        :param typer: types the values, the hints of the new variables are added to it
+        :param evaluated_at: the line where the hints of the scope are evaluated at runtime (a class statement), 0 when
+        every hint is evaluated where it is assigned (the module) and None when they are never evaluated (functions)
+        :param rebound: the names that nested functions declare global or nonlocal, they are bound there too
+        """
+        for variable, bindings in scope.names.items():
+            if len(bindings) != 1 or variable in scope.declared or variable in rebound or variable in typer.names:
+                continue
+            assignment = scope.assignments.get(id(bindings[0]))
+            hint = typer(assignment.value) if assignment is not None else None
+            if hint is None:
+                continue
+            if evaluated_at is not None:
+                hint = self.context.forward_reference(hint, evaluated_at or assignment.lineno)
+            self.annotations.add_variable(name, variable, hint)
+            typer.names[variable] = hint
+
+    def _annotate_attributes(self, class_scope: Scope, methods: List[FunctionNode], scopes: List[str]) -> None:
+        """
+        annotate the `self.x` attributes that are assigned values of a single inferable type in all the methods, an
+        attribute that is also assigned None is Optional. the first assignment of the attribute is annotated.
+        """
+        hints: Dict[str, Set[Optional[str]]] = {}
+        first: Dict[str, Tuple[str, str]] = {}
+        for method in methods:
+            positional = method.args.posonlyargs + method.args.args
+            if not positional or {"staticmethod", "classmethod"} & _decorator_names(method):
+                continue
+            instance = positional[0].arg
+            qualname = ".".join(scopes + [method.name])
+            typer = ExpressionTyper(self.context, self._argument_hints(method, qualname))
+            scope = self.scope(method)
+            for name, targets in scope.attributes.items():
+                owner, attribute = name.split(".", 1)
+                if owner != instance:
+                    continue
+                first.setdefault(attribute, (qualname, name))
+                for target in targets:
+                    assignment = scope.assignments.get(id(target))
+                    if assignment is None:
+                        # augmented, annotated or unpacked assignments
+                        hint = None
+                    elif isinstance(assignment.value, ast.Constant) and assignment.value.value is None:
+                        hint = "None"
+                    else:
+                        hint = typer(assignment.value)
+                    hints.setdefault(attribute, set()).add(hint)
+
+        for attribute, types in hints.items():
+            types = types - {"None"} if types != {"None"} else types
+            if len(types) != 1 or None in types or "None" in types or attribute in class_scope.names:
+                continue
+            scope, name = first[attribute]
+            hint = types.pop()
+            self.annotations.add_variable(scope, name, f"Optional[{hint}]" if "None" in hints[attribute] else hint)
+
+
+def _falls_through(body: List[ast.stmt]) -> bool:
+    """whether the execution of a body may reach its end (and the function returns None implicitly)"""
+    if not body:
+        return True
+    last = body[-1]
+    if isinstance(last, (ast.Return, ast.Raise)):
+        return False
+    if isinstance(last, ast.If):
+        return _falls_through(last.body) or _falls_through(last.orelse)
+    if isinstance(last, (ast.With, ast.AsyncWith)):
+        return _falls_through(last.body)
+    if isinstance(last, ast.Try):
+        if last.finalbody and not _falls_through(last.finalbody):
+            return False
+        return _falls_through(last.orelse or last.body) or any(_falls_through(handler.body)
+                                                               for handler in last.handlers)
+    if isinstance(last, ast.While) and isinstance(last.test, ast.Constant) and last.test.value is True:
+        return any(isinstance(node, ast.Break) for node in scope_walk(last.body))
+    return True
+
+
+def _is_stub(node: FunctionNode) -> bool:
+    """a body of only a docstring, `pass` and `...`"""
+    for statement in node.body:
+        if isinstance(statement, ast.Pass):
+            continue
+        if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant) and \
+                (isinstance(statement.value.value, str) or statement.value.value is Ellipsis):
+            continue
+        return False
+    return True
+
+
+def infer_annotations(tree: ast.Module) -> Annotations:
+    """
+    infer the type hints that are obvious from the code
+    :param tree: the parsed module
+    :return: the hints, ready for autopy.type.utils.annotations.apply_annotations
+    """
+    return Inference(tree).run()
@@ -0,0 +1,258 @@
+"""
+Reassembly of typed statements into a module.
+
+the typed file is built from the original source in a single pass: every top-level statement is replaced by its typed
+version (looked up by the fingerprint of the original statement), and the comments and blank lines between the
+statements are kept from the source. the imports that the typed statements need are merged into one sorted block
+after the imports at the top of the module - names that the module already binds are dropped, and the typing names
+the hints use are added when they are missing. the result always compiles: a typed statement that breaks the module is
+replaced by its original version.
+"""
+import ast
+import logging
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from autopy.type.utils.annotations import TYPING_NAMES
+from autopy.type.utils.incremental import IMPORT_NODES, fingerprint, node_source
+
+logger = logging.getLogger(__name__)
+
+# only the statements that mention a typing name are parsed for the names of their hints
+TYPING_PATTERN = re.compile(r"\b(?:" + "|".join(sorted(TYPING_NAMES)) + r")\b")
+
+
+class ImportBlock:
+    def __init__(self) -> None:
+        """import statements, deduplicated by the names they bind"""
+        # `import module [as name]`
+        self.modules: Dict[Tuple[str, Optional[str]], None] = {}
+        # `from module import name [as alias]`, the module is prefixed with the dots of relative imports
+        self.names: Dict[str, Dict[Tuple[str, Optional[str]], None]] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.modules) or any(self.names.values())
+
+    def add(self, node: ast.stmt) -> None:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                self.modules[(alias.name, alias.asname)] = None
+        elif isinstance(node, ast.ImportFrom):
+            names = self.names.setdefault("." * node.level + (node.module or ""), {})
+            for alias in node.names:
+                names[(alias.name, alias.asname)] = None
+
+    def add_source(self, source: str) -> None:
+        """add the imports of a piece of code, code that does not parse is ignored"""
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            logger.debug(f"ignoring an import that does not parse: {source!r}")
+            return
+        for node in tree.body:
+            self.add(node)
+
+    def bound(self) -> Set[str]:
+        """the names that the imports bind"""
+        names = {asname or module.split(".")[0] for module, asname in self.modules}
+        names.update(asname or name for module_names in self.names.values() for name, asname in module_names)
+        return names
+
+    def difference(self, other: "ImportBlock", bound: Iterable[str] = ()) -> "ImportBlock":
+        """
+        the imports that are not in the other block and don't rebind one of its names
+        :param other: the other block
+        :param bound: more names that must not be rebound
+        """
+        bound = other.bound() | set(bound)
+        block = ImportBlock()
+        for module, asname in self.modules:
+            if (module, asname) not in other.modules and (asname or module.split(".")[0]) not in bound:
+                block.modules[(module, asname)] = None
+        for module, names in self.names.items():
+            other_names = other.names.get(module, {})
+            for name, asname in names:
+                if (name, asname) not in other_names and (asname or name) not in bound:
+                    block.names.setdefault(module, {})[(name, asname)] = None
+        return block
+
+    @staticmethod
+    def _alias(name: str, asname: Optional[str]) -> str:
+        return f"{name} as {asname}" if asname else name
+
+    def render(self, future: bool) -> List[str]:
+        """
+        the sorted import statements, one statement per module
+        :param future: render only the `from __future__` imports, or only all the others
+        """
+        def key(alias: Tuple[str, Optional[str]]) -> Tuple[str, str]:
+            return alias[0], alias[1] or ""
+
+        lines = [] if future else [f"import {self._alias(*alias)}" for alias in sorted(self.modules, key=key)]
+        for module in sorted(self.names):
+            if (module == "__future__") != future or not self.names[module]:
+                continue
+            names = sorted(self.names[module], key=key)
+            lines.append(f"from {module} import {', '.join(self._alias(*alias) for alias in names)}")
+        return lines
+
+
+def module_bindings(tree: ast.Module) -> Set[str]:
+    """the names that the top-level statements of a module bind (besides imports)"""
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            names.update(sub_node.id for target in targets for sub_node in ast.walk(target)
+                         if isinstance(sub_node, ast.Name))
+    return names
+
+
+def annotation_names(tree: ast.AST) -> Set[str]:
+    """the names that the type hints of a piece of code use, including the names in string hints"""
+    annotations: List[ast.expr] = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.arg) and node.annotation is not None:
+            annotations.append(node.annotation)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.returns is not None:
+            annotations.append(node.returns)
+        elif isinstance(node, ast.AnnAssign):
+            annotations.append(node.annotation)
+    names = set()
+    for annotation in annotations:
+        for sub_node in ast.walk(annotation):
+            if isinstance(sub_node, ast.Name):
+                names.add(sub_node.id)
+            elif isinstance(sub_node, ast.Constant) and isinstance(sub_node.value, str):
+                try:
+                    names.update(name.id for name in ast.walk(ast.parse(sub_node.value, mode="eval"))
+                                 if isinstance(name, ast.Name))
+                except SyntaxError:
+                    continue
+    return names
+
+
+def _leading_anchors(tree: ast.Module) -> Tuple[Optional[ast.stmt], Optional[ast.stmt]]:
+    """
+    :return: the statement that the `from __future__` imports go after (the docstring or the last future import) and
+    the statement that the other imports go after (the last statement of the docstring and imports at the top)
+    """
+    future_anchor = None
+    anchor = None
+    for position, node in enumerate(tree.body):
+        docstring = position == 0 and ast.get_docstring(tree, clean=False) is not None
+        if docstring or (isinstance(node, ast.ImportFrom) and node.module == "__future__"):
+            future_anchor = node
+            anchor = node
+        elif isinstance(node, IMPORT_NODES):
+            anchor = node
+        else:
+            break
+    return future_anchor, anchor
+
+
+def reassemble(source: str, tree: ast.Module, units: Dict[str, str], imports: Iterable[str] = (),
+               filename: str = "<typed>") -> str:
+    """
+    build the typed module
+    :param source: the original source
+    :param tree: the parsed source
+    :param units: mapping from the fingerprint of an original statement to its typed source, statements without a typed
+    version are kept as they are
+    :param imports: import statements that the typed statements need
+    :param filename: the name of the module in the compile errors
+    :return: the typed module, it compiles whenever the original source compiles
+    """
+    lines = source.splitlines(keepends=True)
+    original_imports = ImportBlock()
+    for node in tree.body:
+        if isinstance(node, IMPORT_NODES):
+            original_imports.add(node)
+
+    # the typed version of every statement, the fingerprints are computed once
+    typed: List[Optional[str]] = []
+    for node in tree.body:
+        typed.append(None if isinstance(node, IMPORT_NODES) else units.get(fingerprint(node)))
+
+    needed = ImportBlock()
+    for typed_import in imports:
+        needed.add_source(typed_import)
+    bindings = module_bindings(tree)
+    bound = original_imports.bound() | bindings | needed.bound()
+    used: Set[str] = set()
+    for typed_source in typed:
+        if typed_source is not None and TYPING_PATTERN.search(typed_source):
+            try:
+                used |= annotation_names(ast.parse(typed_source))
+            except SyntaxError:
+                continue
+    missing_typing = sorted((used & TYPING_NAMES) - bound)
+    if missing_typing:
+        needed.add_source(f"from typing import {', '.join(missing_typing)}")
+    extra = needed.difference(original_imports, bindings)
+
+    reverted: Set[int] = set()
+    while True:
+        output, spans = _build(lines, tree, typed, reverted, extra)
+        module = "".join(output)
+        try:
+            compile(module, filename, "exec", dont_inherit=True)
+            return module
+        except SyntaxError as e:
+            broken = next((index for index, (start, end) in spans.items() if start <= (e.lineno or 0) <= end), None)
+            if broken is not None:
+                logger.info(f"the typed statement in line {tree.body[broken].lineno} breaks the module ({e.msg}), "
+                            f"keeping the original statement")
+                reverted.add(broken)
+            elif extra:
+                logger.info(f"the imports of the typed statements break the module ({e.msg}), leaving them out")
+                extra = ImportBlock()
+            else:
+                logger.warning(f"the reassembled module does not compile: {e}")
+                return module
+
+
+def _build(lines: List[str], tree: ast.Module, typed: List[Optional[str]], reverted: Set[int],
+           extra: ImportBlock) -> Tuple[List[str], Dict[int, Tuple[int, int]]]:
+    """
+    :return: the parts of the module, and the first and last line of every typed statement in it
+    """
+    future_anchor, anchor = _leading_anchors(tree)
+    future_imports = extra.render(future=True)
+    other_imports = extra.render(future=False)
+    output: List[str] = []
+    spans: Dict[int, Tuple[int, int]] = {}
+    line_count = 0
+
+    def add(text: str) -> None:
+        nonlocal line_count
+        output.append(text)
+        line_count += text.count("\n")
+
+    if future_imports and future_anchor is None:
+        add("\n".join(future_imports) + "\n")
+    if other_imports and anchor is None:
+        add("\n".join(other_imports) + "\n")
+    previous_end = 0
+    for index, node in enumerate(tree.body):
+        start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])])
+        if start <= previous_end:
+            # statements on one line (`a = 1; b = 2`), the line was already written with the first of them
+            continue
+        for line in lines[previous_end:start - 1]:
+            add(line)
+        if typed[index] is not None and index not in reverted:
+            spans[index] = (line_count + 1, line_count + typed[index].count("\n") + 1)
+            add(typed[index] + "\n")
+        else:
+            add(node_source(lines, node) + "\n")
+        if node is future_anchor and future_imports:
+            add("\n".join(future_imports) + "\n")
+        if node is anchor and other_imports:
+            add("\n".join(other_imports) + "\n")
+        previous_end = node.end_lineno
+    for line in lines[previous_end:]:
+        add(line)
+    return output, spans
@@ -0,0 +1,268 @@
+"""
+Repository wide type hints coverage.
+
+the scanner shards the files of a repository across a pool of processes and keeps the reports in a sqlite index keyed
+by the path of the file. a file is analyzed again only when its mtime or size changed, and even then the content hash
+is compared first, so touching a file without changing it does not cost a parse.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from autopy.completion.cache import DEFAULT_CACHE_DIR
+from autopy.type.utils.files import collect_python_files
+from autopy.type.utils.validator import ValidatorParser
+
+logger = logging.getLogger(__name__)
+
+# bump when the content of the reports changes, older indexes are dropped
+INDEX_VERSION = 1
+# below this number of files the scan runs in the current process, starting a pool costs more than it saves
+MIN_FILES_FOR_POOL = 64
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def analyze_path(path: str) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    analyze a single file, runs inside the worker processes
+    :param path: path to a python file
+    :return: the path, the content hash and the coverage report as a dict (with an `error` key if it can't be parsed)
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    try:
+        report = ValidatorParser.analyze(content.decode("utf-8"), path).to_dict()
+    except (SyntaxError, UnicodeDecodeError, ValueError) as e:
+        report = {"path": path, "error": f"{type(e).__name__}: {e}"}
+    return path, content_hash(content), report
+
+
+class CoverageIndex:
+    def __init__(self, path: Union[str, Path, None] = None) -> None:
+        """
+        sqlite index of coverage reports
+        :param path: path to the sqlite file, defaults to coverage.sqlite3 in DEFAULT_CACHE_DIR
+        """
+        if path is None:
+            path = DEFAULT_CACHE_DIR / "coverage.sqlite3"
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        if self._connection.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            self._connection.execute("DROP TABLE IF EXISTS reports")
+            self._connection.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            "path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, "
+            "hash TEXT NOT NULL, report TEXT NOT NULL)"
+        )
+        self._connection.commit()
+
+    def lookup(self, path: str, stat: os.stat_result) -> Optional[Dict[str, Any]]:
+        """
+        get the report of a file if the file did not change since it was indexed
+        :param path: absolute path of the file
+        :param stat: the current stat of the file
+        :return: the report or None if the file has to be analyzed
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT mtime_ns, size, hash, report FROM reports WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        mtime_ns, size, stored_hash, report = row
+        if size != stat.st_size:
+            return None
+        if mtime_ns != stat.st_mtime_ns:
+            with open(path, "rb") as f:
+                if content_hash(f.read()) != stored_hash:
+                    return None
+            with self._lock:
+                self._connection.execute("UPDATE reports SET mtime_ns = ? WHERE path = ?", (stat.st_mtime_ns, path))
+        return json.loads(report)
+
+    def store(self, path: str, stat: os.stat_result, hash_: str, report: Dict[str, Any]) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO reports (path, mtime_ns, size, hash, report) VALUES (?, ?, ?, ?, ?)",
+                (path, stat.st_mtime_ns, stat.st_size, hash_, json.dumps(report))
+            )
+
+    def commit(self) -> None:
+        with self._lock:
+            self._connection.commit()
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class ScanResult:
+    def __init__(self) -> None:
+        self.reports: Dict[str, Dict[str, Any]] = {}
+        self.analyzed = 0
+        self.skipped = 0
+
+    @property
+    def errors(self) -> Dict[str, str]:
+        return {path: report["error"] for path, report in self.reports.items() if "error" in report}
+
+    @property
+    def annotated(self) -> int:
+        return sum(report.get("annotated", 0) for report in self.reports.values())
+
+    @property
+    def total(self) -> int:
+        return sum(report.get("total", 0) for report in self.reports.values())
+
+    @property
+    def score(self) -> float:
+        """coverage of all the files together, weighted by the number of things each file can annotate"""
+        return self.annotated / self.total if self.total else 1.0
+
+    def to_dict(self, root: Union[str, Path, None] = None) -> Dict[str, Any]:
+        """
+        the totals and the score of every file, without the details of the reports
+        :param root: the paths are relative to root (when they are inside it), so the summary can be committed
+        """
+        return {
+            "score": self.score,
+            "annotated": self.annotated,
+            "total": self.total,
+            "files": {
+                relative_path(path, root): {"error": report["error"]} if "error" in report else
+                {"score": report["score"], "annotated": report["annotated"], "total": report["total"]}
+                for path, report in self.reports.items()
+            },
+        }
+
+
+def relative_path(path: str, root: Union[str, Path, None] = None) -> str:
+    root = Path(root or os.getcwd()).resolve()
+    try:
+        return Path(path).relative_to(root).as_posix()
+    except ValueError:
+        return path
+
+
+def missing_annotations(report: Dict[str, Any]) -> List[str]:
+    """
+    the things a file can annotate and does not, from the dict of its report
+    :return: one line per function or variable, e.g. `12: MyClass.method (x, return)`
+    """
+    missing = []
+    for function in report.get("functions", []):
+        names = [argument["name"] for argument in function["arguments"] if not argument["annotated"]]
+        if not function["returns_annotated"]:
+            names.append("return")
+        if names:
+            missing.append((function["lineno"], f"{function['lineno']}: {function['name']} ({', '.join(names)})"))
+    for variable in report.get("variables", []):
+        if not variable["annotated"]:
+            name = f"{variable['scope']}.{variable['name']}" if variable["scope"] else variable["name"]
+            missing.append((variable["lineno"], f"{variable['lineno']}: {name}"))
+    return [line for _, line in sorted(missing, key=lambda item: item[0])]
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.0) -> List[str]:
+    """
+    find the regressions of a summary relatively to an earlier summary (both created by ScanResult.to_dict)
+    :param current: the summary of the current scan
+    :param baseline: the summary that was accepted before
+    :param tolerance: allowed drop of a score
+    :return: a description of every regression - the total score or the score of a file dropped, or a file that
+    could be parsed can't be parsed anymore. new files and removed files are not regressions
+    """
+    regressions = []
+    if current["score"] < baseline["score"] - tolerance:
+        regressions.append(f"total coverage dropped from {baseline['score']:.1%} to {current['score']:.1%}")
+    for path, report in current["files"].items():
+        before = baseline["files"].get(path)
+        if before is None or "error" in before:
+            continue
+        if "error" in report:
+            regressions.append(f"{path}: can't be parsed anymore ({report['error']})")
+        elif report["score"] < before["score"] - tolerance:
+            regressions.append(f"{path}: coverage dropped from {before['score']:.1%} to {report['score']:.1%}")
+    return regressions
+
+
+class CoverageScanner:
+    def __init__(self, index: Optional[CoverageIndex] = None, workers: Optional[int] = None,
+                 chunksize: int = 32) -> None:
+        """
+        :param index: the index of the reports, None disables the index
+        :param workers: number of worker processes, defaults to the number of cores
+        :param chunksize: number of files sent to a worker at once
+        """
+        self.index = index
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+
+    def scan(self, files: Iterable[Union[str, Path]]) -> ScanResult:
+        """
+        create the coverage report of every file, files that did not change since they were indexed are not analyzed
+        :param files: python files to scan
+        :return: the reports of all the files
+        """
+        result = ScanResult()
+        stats = {}
+        for file in files:
+            path = str(Path(file).resolve())
+            stats[path] = os.stat(path)
+            report = self.index.lookup(path, stats[path]) if self.index else None
+            if report is not None:
+                result.reports[path] = report
+                result.skipped += 1
+
+        pending = [path for path in stats if path not in result.reports]
+        if len(pending) < MIN_FILES_FOR_POOL or self.workers == 1:
+            analyzed = map(analyze_path, pending)
+            self._collect(analyzed, stats, result)
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                chunksize = max(1, min(self.chunksize, len(pending) // self.workers))
+                self._collect(executor.map(analyze_path, pending, chunksize=chunksize), stats, result)
+        if self.index:
+            self.index.commit()
+        # keep the order of the input files
+        result.reports = {path: result.reports[path] for path in stats}
+        logger.info(f"analyzed {result.analyzed} files, {result.skipped} unchanged files were skipped")
+        return result
+
+    def _collect(self, analyzed: Iterable[Tuple[str, str, Dict[str, Any]]], stats: Dict[str, os.stat_result],
+                 result: ScanResult) -> None:
+        for path, hash_, report in analyzed:
+            result.reports[path] = report
+            result.analyzed += 1
+            if self.index:
+                self.index.store(path, stats[path], hash_, report)
+
+
+def scan(paths: List[Union[str, Path]], index_path: Union[str, Path, None] = None, use_index: bool = True,
+         workers: Optional[int] = None) -> ScanResult:
+    """
+    scan files and directories
+    :param paths: python files, directories or glob patterns
+    :param index_path: path of the sqlite index
+    :param use_index: whether to read and update the index
+    :param workers: number of worker processes
+    :return: the reports of all the files
+    """
+    files = sorted({file for path in paths for file in collect_python_files(path, skip_typed=False)})
+    index = CoverageIndex(index_path) if use_index else None
+    try:
+        return CoverageScanner(index, workers).scan(files)
+    finally:
+        if index:
+            index.close()
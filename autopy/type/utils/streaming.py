@@ -0,0 +1,96 @@
+"""
+Streaming of typed code.
+
+the completion arrives a few tokens at a time. the splitter collects the text into top-level blocks - a block is
+finished when a new line starts at column 0 and everything before it parses - so every statement can be validated and
+written out as soon as the model moves on to the next one, instead of waiting for the whole file.
+"""
+import ast
+from typing import Dict, List, Optional, Tuple
+
+from autopy.type.utils.chunker import DEFINITION_NODES
+from autopy.type.utils.incremental import IMPORT_NODES, node_source
+
+# lines at column 0 that continue the previous statement instead of starting a new one
+CONTINUATION_PREFIXES = ("#", ")", "]", "}", "else", "elif", "except", "finally")
+
+
+class TopLevelSplitter:
+    def __init__(self) -> None:
+        """split a stream of python code into top-level statements"""
+        self._partial = ""
+        self._lines: List[str] = []
+
+    @staticmethod
+    def _starts_statement(line: str) -> bool:
+        return bool(line) and not line[0].isspace() and not line.startswith(CONTINUATION_PREFIXES)
+
+    def _pending_parses(self) -> bool:
+        try:
+            return bool(ast.parse("".join(self._lines)).body)
+        except SyntaxError:
+            # an unfinished multi-line string or bracket, or a decorator without its definition yet
+            return False
+
+    def feed(self, text: str) -> List[str]:
+        """
+        :param text: the next piece of the stream
+        :return: the blocks that were finished by this piece, every block ends with a new line
+        """
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        blocks = []
+        for line in lines:
+            if self._lines and self._starts_statement(line) and self._pending_parses():
+                blocks.append("".join(self._lines))
+                self._lines = []
+            self._lines.append(line + "\n")
+        return blocks
+
+    def close(self) -> List[str]:
+        """:return: the rest of the stream as a last block (if there is anything left)"""
+        if self._partial:
+            self._lines.append(self._partial + "\n")
+            self._partial = ""
+        rest = "".join(self._lines)
+        self._lines = []
+        return [rest] if rest.strip() else []
+
+
+class StreamMatcher:
+    def __init__(self, nodes: List[ast.stmt]) -> None:
+        """
+        match the statements of the typed stream to the original statements, the same way as
+        autopy.type.utils.incremental.match_typed - definitions by name and the other statements by their order
+        :param nodes: the original top-level statements
+        """
+        self._definitions: Dict[str, List[ast.stmt]] = {}
+        self._statements: List[ast.stmt] = []
+        for node in nodes:
+            if isinstance(node, DEFINITION_NODES):
+                self._definitions.setdefault(node.name, []).append(node)
+            elif not isinstance(node, IMPORT_NODES):
+                self._statements.append(node)
+        self._statements.reverse()
+
+    def match(self, block: str) -> List[Tuple[ast.stmt, Optional[ast.stmt], str]]:
+        """
+        :param block: a block of typed code
+        :return: (typed node, original node, typed source) for every statement of the block. the original node is
+        None for imports and for statements that do not match anything in the original code.
+        """
+        try:
+            tree = ast.parse(block)
+        except SyntaxError:
+            return []
+        lines = block.splitlines(keepends=True)
+        matched = []
+        for node in tree.body:
+            original = None
+            if isinstance(node, DEFINITION_NODES):
+                if self._definitions.get(node.name):
+                    original = self._definitions[node.name].pop(0)
+            elif not isinstance(node, IMPORT_NODES) and self._statements:
+                original = self._statements.pop()
+            matched.append((node, original, node_source(lines, node)))
+        return matched
@@ -0,0 +1,385 @@
+"""
+Stub files.
+
+instead of a typed copy of a module, its hints can be written as a `.pyi` stub next to it - the module itself is not
+touched, and type checkers read the stub in its place. the stub is built from the ast of the module with its hints:
+the imports, the signatures of the functions and methods (their bodies are `...`), the classes with the attributes of
+the class and of its instances, and the module variables. nothing but the hints is ever requested from the model, the
+bodies are never sent back.
+
+building a stub is a single walk over the module level statements and the class bodies, so the offline generation of
+a whole package (with the locally inferred hints only) runs on a pool of processes. the stubs start with the digest of
+the module they were built from, so the modules that did not change since are not even parsed again. a stub without
+this header was not written by autopy (e.g. by hand), it is never overwritten unless forced.
+"""
+import ast
+import copy
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from autopy.type.utils.annotations import TYPING_NAMES, Annotations, scope_walk
+from autopy.type.utils.chunker import DEFINITION_NODES
+from autopy.type.utils.inference import infer_annotations
+from autopy.type.utils.scanner import MIN_FILES_FOR_POOL
+from autopy.type.utils.symbols import STUB_BODY
+
+logger = logging.getLogger(__name__)
+
+# bump when the content of the stubs changes, the offline stubs of older versions are written again
+STUBS_VERSION = 1
+STUB_SUFFIX = ".pyi"
+# the first line of the stubs written by autopy, with the digest of the module they were built from and the origin of
+# their hints
+STUB_HEADER = "# autopy stub {} {}"
+STUB_HEADER_PREFIX = "# autopy stub "
+# the origins of the hints of a stub
+EXISTING = "existing"  # only the hints that are written in the module
+INFERRED = "inferred"  # and the hints that can be inferred locally
+MODEL = "model"  # and the hints of the model, see AutoPy(output="pyi")
+# what became of the stub of every module
+WRITTEN = "written"
+UNCHANGED = "unchanged"
+FOREIGN = "foreign"  # the existing stub was not written by autopy, it is left as it is
+FAILED = "failed"
+# the hint of the names whose type is not known, the way stubgen writes them
+INCOMPLETE = "Incomplete"
+INCOMPLETE_IMPORT = f"from _typeshed import {INCOMPLETE}"
+# generic builtins that an assignment can alias, e.g. `Items = list[str]`
+ALIAS_NAMES = TYPING_NAMES | {"dict", "frozenset", "list", "set", "tuple", "type"}
+
+FunctionNode = Union[ast.FunctionDef, ast.AsyncFunctionDef]
+
+
+def stub_path(path: Union[str, Path]) -> Path:
+    """the stub of a module, next to it"""
+    return Path(path).with_suffix(STUB_SUFFIX)
+
+
+def stub_header(source: str, hints: str) -> str:
+    """
+    :param source: the source of the module
+    :param hints: the origin of the hints of the stub, EXISTING, INFERRED or MODEL
+    :return: the first line of the stub of the module
+    """
+    digest = hashlib.sha256(f"{STUBS_VERSION}:{source}".encode("utf-8")).hexdigest()[:16]
+    return STUB_HEADER.format(digest, hints)
+
+
+def read_header(path: Union[str, Path]) -> Optional[str]:
+    """
+    :param path: the stub file
+    :return: the first line of the stub, None if there is no stub
+    """
+    try:
+        with open(path, "r") as f:
+            return f.readline().rstrip("\n")
+    except FileNotFoundError:
+        return None
+
+
+def is_foreign(header: Optional[str]) -> bool:
+    """
+    :param header: the first line of an existing stub, see read_header
+    :return: whether the stub exists and was not written by autopy
+    """
+    return header is not None and not header.startswith(STUB_HEADER_PREFIX)
+
+
+def _ellipsis() -> ast.expr:
+    return ast.Constant(value=Ellipsis)
+
+
+def _stub_body(body: List[ast.stmt]) -> List[ast.stmt]:
+    return body or [ast.Expr(value=_ellipsis())]
+
+
+def _annotation(name: str, annotation: ast.expr, value: bool = False) -> ast.AnnAssign:
+    return ast.AnnAssign(target=ast.Name(id=name), annotation=annotation, value=_ellipsis() if value else None,
+                         simple=1)
+
+
+def _is_main_check(test: ast.expr) -> bool:
+    """`if __name__ == "__main__":`"""
+    return isinstance(test, ast.Compare) and isinstance(test.left, ast.Name) and test.left.id == "__name__"
+
+
+class StubBuilder:
+    def __init__(self, tree: ast.Module, annotations: Optional[Annotations] = None) -> None:
+        """
+        builds the stub of a module
+        :param tree: the parsed module
+        :param annotations: more hints, they are written into the stub where the module has no hint (the module
+        itself is not rewritten)
+        """
+        self.tree = tree
+        self.annotations = annotations or Annotations()
+        # classes and imported names, an assignment of one of them is an alias
+        self.types: Set[str] = set()
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef):
+                self.types.add(node.name)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                self.types.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+        self.scopes: List[str] = []
+        # the typing names that the added hints use
+        self.typing: Set[str] = set()
+        self.incomplete = False
+
+    def build(self) -> str:
+        """:return: the source of the stub"""
+        body = self.statements(self.tree.body, in_class=False)
+        imports = []
+        missing = sorted(self.typing - self.types)
+        if missing:
+            imports.append(f"from typing import {', '.join(missing)}")
+        if self.incomplete:
+            imports.append(INCOMPLETE_IMPORT)
+        position = 0
+        while position < len(body) and isinstance(body[position], ast.ImportFrom) and \
+                body[position].module == "__future__":
+            position += 1
+        body[position:position] = [ast.parse(statement).body[0] for statement in imports]
+        module = ast.Module(body=body, type_ignores=[])
+        lines = [line for line in STUB_BODY.sub(": ...", ast.unparse(module)).splitlines() if line.strip()]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def hint(self, hint: Optional[str]) -> Optional[ast.expr]:
+        """a hint of the annotations as an expression, None if it is missing or does not parse"""
+        if hint is None:
+            return None
+        try:
+            expression = ast.parse(hint, mode="eval").body
+        except SyntaxError:
+            logger.debug(f"ignoring a hint that does not parse: {hint!r}")
+            return None
+        self.typing.update(node.id for node in ast.walk(expression) if isinstance(node, ast.Name) and
+                           node.id in TYPING_NAMES)
+        return expression
+
+    def statements(self, body: List[ast.stmt], in_class: bool) -> List[ast.stmt]:
+        stubs: List[ast.stmt] = []
+        for node in body:
+            stubs.extend(self.statement(node, in_class))
+        return stubs
+
+    def statement(self, node: ast.stmt, in_class: bool) -> List[ast.stmt]:
+        """the stub of a single statement, empty for the statements that stubs leave out"""
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            return [node]
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            return [self.function(node)]
+        if isinstance(node, ast.ClassDef):
+            return [self.cls(node)]
+        if isinstance(node, ast.AnnAssign):
+            if isinstance(node.target, ast.Name) and node.target.id == "__all__":
+                return [node]
+            if isinstance(node.target, ast.Name):
+                # the default of a class attribute matters (dataclasses, named tuples), its value does not
+                return [_annotation(node.target.id, node.annotation, value=in_class and node.value is not None)]
+            return []
+        if isinstance(node, ast.Assign):
+            return self.assignment(node, in_class)
+        if isinstance(node, ast.If):
+            if _is_main_check(node.test):
+                return []
+            body = self.statements(node.body, in_class)
+            orelse = self.statements(node.orelse, in_class)
+            if not body and not orelse:
+                return []
+            return [ast.If(test=node.test, body=_stub_body(body), orelse=orelse)]
+        if isinstance(node, ast.Try) or (hasattr(ast, "TryStar") and isinstance(node, ast.TryStar)):
+            # the names of the successful path, e.g. `try: import ujson as json` and not the fallback
+            return self.statements(node.body, in_class)
+        return []
+
+    def assignment(self, node: ast.Assign, in_class: bool) -> List[ast.stmt]:
+        if len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name == "__all__" or self.is_alias(node.value):
+                return [node]
+            hint = self.hint(self.annotations.variables.get((".".join(self.scopes), name)))
+            if hint is not None:
+                return [_annotation(name, hint, value=in_class)]
+        names = [sub_node.id for target in node.targets for sub_node in ast.walk(target)
+                 if isinstance(sub_node, ast.Name)]
+        self.incomplete = self.incomplete or bool(names)
+        return [_annotation(name, ast.Name(id=INCOMPLETE)) for name in dict.fromkeys(names)]
+
+    def is_alias(self, value: ast.expr) -> bool:
+        """whether an assigned value is a type (`Alias = MyClass`, `Items = List[str]`)"""
+        if isinstance(value, ast.Name):
+            return value.id in self.types
+        if isinstance(value, (ast.Subscript, ast.Attribute)):
+            base = value.value
+            while isinstance(base, (ast.Subscript, ast.Attribute)):
+                base = base.value
+            names = ALIAS_NAMES | self.types if isinstance(value, ast.Subscript) else self.types
+            return isinstance(base, ast.Name) and base.id in names
+        return False
+
+    def function(self, node: FunctionNode) -> FunctionNode:
+        function = self.annotations.functions.get(".".join(self.scopes + [node.name]))
+        hints = function.arguments if function is not None else {}
+
+        def argument(arg: ast.arg) -> ast.arg:
+            if arg.annotation is not None or arg.arg not in hints:
+                return arg
+            stub_arg = copy.copy(arg)
+            stub_arg.annotation = self.hint(hints[arg.arg])
+            return stub_arg
+
+        args = copy.copy(node.args)
+        args.posonlyargs = [argument(arg) for arg in node.args.posonlyargs]
+        args.args = [argument(arg) for arg in node.args.args]
+        args.kwonlyargs = [argument(arg) for arg in node.args.kwonlyargs]
+        args.vararg = argument(node.args.vararg) if node.args.vararg else None
+        args.kwarg = argument(node.args.kwarg) if node.args.kwarg else None
+        args.defaults = [_ellipsis() for _ in node.args.defaults]
+        args.kw_defaults = [None if default is None else _ellipsis() for default in node.args.kw_defaults]
+        stub = copy.copy(node)
+        stub.args = args
+        if node.returns is None and function is not None:
+            stub.returns = self.hint(function.returns)
+        stub.body = [ast.Expr(value=_ellipsis())]
+        return stub
+
+    def cls(self, node: ast.ClassDef) -> ast.ClassDef:
+        self.scopes.append(node.name)
+        body = self.statements(node.body, in_class=True)
+        defined = {child.target.id for child in body if isinstance(child, ast.AnnAssign)}
+        defined.update(target.id for child in body if isinstance(child, ast.Assign) for target in child.targets)
+        defined.update(child.name for child in body if isinstance(child, DEFINITION_NODES))
+        attributes = []
+        for name, annotation in self.instance_attributes(node):
+            if name not in defined:
+                defined.add(name)
+                if annotation is None:
+                    self.incomplete = True
+                attributes.append(_annotation(name, annotation or ast.Name(id=INCOMPLETE)))
+        self.scopes.pop()
+        # the attributes of the class, then the attributes of the instances, then the methods and nested classes
+        definitions = [child for child in body if isinstance(child, DEFINITION_NODES)]
+        body = [child for child in body if not isinstance(child, DEFINITION_NODES)] + attributes + definitions
+        stub = copy.copy(node)
+        stub.body = _stub_body(body)
+        return stub
+
+    def instance_attributes(self, node: ast.ClassDef) -> List[Tuple[str, Optional[ast.expr]]]:
+        """
+        the attributes that the methods of a class assign to the instance (`self.x = ...`)
+        :param node: the class, its name is the last scope
+        :return: the name and the hint of every attribute in the order of the methods, the first hint of an attribute
+        wins and attributes without a hint anywhere have None
+        """
+        attributes: Dict[str, Optional[ast.expr]] = {}
+        for method in node.body:
+            if not isinstance(method, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            positional = method.args.posonlyargs + method.args.args
+            if not positional or any(isinstance(decorator, ast.Name) and decorator.id in ("staticmethod", "classmethod")
+                                     for decorator in method.decorator_list):
+                continue
+            instance = positional[0].arg
+            scope = ".".join(self.scopes + [method.name])
+            for child in scope_walk(method.body):
+                targets: List[ast.expr] = []
+                annotation = None
+                if isinstance(child, ast.AnnAssign):
+                    targets, annotation = [child.target], child.annotation
+                elif isinstance(child, ast.Assign):
+                    targets = child.targets
+                for target in targets:
+                    if isinstance(target, ast.Attribute) and isinstance(target.value, ast.Name) and \
+                            target.value.id == instance and attributes.get(target.attr) is None:
+                        if annotation is None:
+                            key = (scope, f"{instance}.{target.attr}")
+                            attributes[target.attr] = self.hint(self.annotations.variables.get(key))
+                        else:
+                            attributes[target.attr] = annotation
+        return list(attributes.items())
+
+
+def module_stub(tree: ast.Module, annotations: Optional[Annotations] = None) -> str:
+    """
+    :param tree: the parsed module
+    :param annotations: more hints, e.g. the inferred ones or the ones of the model
+    :return: the source of its stub
+    """
+    return StubBuilder(tree, annotations).build()
+
+
+def write_stub(path: Union[str, Path], stub: str) -> bool:
+    """
+    :param path: the stub file
+    :param stub: the source of the stub
+    :return: whether the file was written, an unchanged stub is not written again
+    """
+    path = Path(path)
+    try:
+        with open(path, "r") as f:
+            if f.read() == stub:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, "w") as f:
+        f.write(stub)
+    return True
+
+
+def generate_stub(path: str, infer: bool = True, force: bool = False) -> Tuple[str, str, Optional[str]]:
+    """
+    write the stub of a single module offline, runs inside the worker processes
+    :param path: path to a python file
+    :param infer: add the hints that can be inferred locally
+    :param force: overwrite the stub even if it was not written by autopy
+    :return: the path, what became of its stub (WRITTEN, UNCHANGED, FOREIGN or FAILED), and the error if it failed
+    """
+    try:
+        with open(path, "r") as f:
+            source = f.read()
+        header = stub_header(source, INFERRED if infer else EXISTING)
+        existing = read_header(stub_path(path))
+        if existing in (header, stub_header(source, MODEL)):
+            # the module did not change since its stub was written, here or with the hints of the model (which are
+            # not replaced by the local ones), it is not parsed again
+            return path, UNCHANGED, None
+        if is_foreign(existing) and not force:
+            return path, FOREIGN, None
+        tree = ast.parse(source, path)
+        stub = module_stub(tree, infer_annotations(tree) if infer else None)
+        return path, WRITTEN if write_stub(stub_path(path), f"{header}\n{stub}") else UNCHANGED, None
+    except (OSError, SyntaxError, UnicodeDecodeError, ValueError) as e:
+        return path, FAILED, f"{type(e).__name__}: {e}"
+
+
+def generate_stubs(files: Iterable[Union[str, Path]], infer: bool = True, workers: Optional[int] = None,
+                   chunksize: int = 32, force: bool = False) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    write the stubs of many modules offline, nothing is sent to the model
+    :param files: python files
+    :param infer: add the hints that can be inferred locally
+    :param workers: number of worker processes, defaults to the number of cores
+    :param chunksize: number of files sent to a worker at once
+    :param force: overwrite the stubs that were not written by autopy
+    :return: the path of every file, what became of its stub, and the error if it failed, see generate_stub
+    """
+    paths = [str(file) for file in files]
+    workers = workers or os.cpu_count() or 1
+    infers = [infer] * len(paths)
+    forces = [force] * len(paths)
+    if len(paths) < MIN_FILES_FOR_POOL or workers == 1:
+        results = list(map(generate_stub, paths, infers, forces))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, min(chunksize, len(paths) // workers))
+            results = list(executor.map(generate_stub, paths, infers, forces, chunksize=chunksize))
+    for path, outcome, _ in results:
+        if outcome == FOREIGN:
+            logger.warning(f"{stub_path(path)} was not written by autopy, it is left as it is (use --force to "
+                           f"overwrite it)")
+    logger.info(f"wrote {sum(outcome == WRITTEN for _, outcome, _ in results)} stubs of {len(results)} files")
+    return results
@@ -0,0 +1,420 @@
+"""
+Project symbol index.
+
+the model only sees the file it types, so the types of the names the file imports from other modules of the project
+are guesses. the index maps every module of the project to compact stubs of its module level names - the signatures of
+its functions, the attributes and method signatures of its classes and its annotated variables - and the prompt of
+every chunk gets the stubs of the imported names the chunk actually uses, within a token budget.
+
+the index is built once per project with ast (no code is imported or executed) and persisted in the cache directory.
+on the next run only the files whose mtime or size changed are parsed again.
+"""
+import ast
+import copy
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from autopy.completion.cache import DEFAULT_CACHE_DIR
+from autopy.type.utils.annotations import scope_walk
+from autopy.type.utils.chunker import DEFINITION_NODES, approximate_tokens
+from autopy.type.utils.files import collect_python_files
+
+logger = logging.getLogger(__name__)
+
+# bump when the content of the stubs changes, older indexes are rebuilt
+SYMBOLS_VERSION = 1
+# default token budget of the project context of a single prompt
+DEFAULT_CONTEXT_TOKENS = 256
+# longest module level constant that is kept in the stubs
+MAX_CONSTANT_LENGTH = 60
+# introduces the context in the prompts
+CONTEXT_PROMPT = ("\n these are the signatures of names that the code imports from other modules of the project, use "
+                  "them for the type hints but do not output them:\n")
+# the body of a stub on its own line
+STUB_BODY = re.compile(r":\n[ \t]+\.\.\.$", re.MULTILINE)
+
+
+def find_root(path: Union[str, Path]) -> Path:
+    """the directory that contains the top-level package of a file - the first parent without an __init__.py"""
+    directory = Path(path).resolve().parent
+    while (directory / "__init__.py").is_file() and directory.parent != directory:
+        directory = directory.parent
+    return directory
+
+
+def module_name(path: Union[str, Path], root: Union[str, Path]) -> str:
+    """the dotted name of a module, `pkg/sub/mod.py` is `pkg.sub.mod` and `pkg/__init__.py` is `pkg`"""
+    parts = list(Path(path).resolve().relative_to(Path(root).resolve()).with_suffix("").parts)
+    if parts and parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+def _unparse(stub: ast.stmt) -> str:
+    """the stub in as few lines as possible, `def f(x: int) -> int: ...`"""
+    return "\n".join(line for line in STUB_BODY.sub(": ...", ast.unparse(stub)).splitlines() if line.strip())
+
+
+def _is_private(name: str) -> bool:
+    return name.startswith("_") and not (name.startswith("__") and name.endswith("__"))
+
+
+def _function_stub(node: Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> ast.stmt:
+    stub = copy.copy(node)
+    stub.body = [ast.Expr(value=ast.Constant(value=Ellipsis))]
+    return stub
+
+
+def _class_stub(node: ast.ClassDef) -> ast.ClassDef:
+    """the class with its annotated attributes (of the class and of the instances) and the signatures of its methods"""
+    body: List[ast.stmt] = []
+    attributes: Set[str] = set()
+    methods = []
+    for child in node.body:
+        if isinstance(child, ast.AnnAssign) and isinstance(child.target, ast.Name):
+            body.append(ast.AnnAssign(target=child.target, annotation=child.annotation, value=None, simple=1))
+            attributes.add(child.target.id)
+        elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            methods.append(child)
+    for method in methods:
+        positional = method.args.posonlyargs + method.args.args
+        instance = positional[0].arg if positional else None
+        for child in scope_walk(method.body):
+            if isinstance(child, ast.AnnAssign) and isinstance(child.target, ast.Attribute) and \
+                    isinstance(child.target.value, ast.Name) and child.target.value.id == instance and \
+                    child.target.attr not in attributes and not _is_private(child.target.attr):
+                attributes.add(child.target.attr)
+                body.append(ast.AnnAssign(target=ast.Name(id=child.target.attr), annotation=child.annotation,
+                                          value=None, simple=1))
+    body += [_function_stub(method) for method in methods if not _is_private(method.name)]
+    stub = copy.copy(node)
+    stub.body = body or [ast.Expr(value=ast.Constant(value=Ellipsis))]
+    return stub
+
+
+def module_symbols(tree: ast.Module) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    the stubs of the public module level names of a module
+    :param tree: the parsed module
+    :return: mapping from a name to its stub, and mapping from a re-exported name to `module:name` (an import of the
+    module, relative imports are kept relative, e.g. `.sub:name`)
+    """
+    symbols: Dict[str, str] = {}
+    aliases: Dict[str, str] = {}
+    for node in tree.body:
+        if isinstance(node, DEFINITION_NODES):
+            if not _is_private(node.name):
+                stub = _class_stub(node) if isinstance(node, ast.ClassDef) else _function_stub(node)
+                symbols[node.name] = _unparse(stub)
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            if not _is_private(node.target.id):
+                symbols[node.target.id] = f"{node.target.id}: {ast.unparse(node.annotation)}"
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            value = ast.unparse(node.value)
+            if isinstance(node.value, ast.Constant) and len(value) <= MAX_CONSTANT_LENGTH and \
+                    not _is_private(node.targets[0].id):
+                symbols[node.targets[0].id] = f"{node.targets[0].id} = {value}"
+        elif isinstance(node, ast.ImportFrom):
+            for alias in node.names:
+                if alias.name != "*":
+                    aliases[alias.asname or alias.name] = f"{'.' * node.level}{node.module or ''}:{alias.name}"
+    return symbols, aliases
+
+
+def resolve_module(module: str, level: int, current: str, is_package: bool) -> str:
+    """
+    the absolute name of an imported module
+    :param module: the module of the import statement, may be empty for `from . import x`
+    :param level: the number of leading dots
+    :param current: the name of the importing module
+    :param is_package: whether the importing module is an __init__.py
+    """
+    if not level:
+        return module
+    parts = current.split(".") if current else []
+    if not is_package:
+        parts = parts[:-1]
+    parts = parts[:len(parts) - (level - 1)] if level > 1 else parts
+    return ".".join(parts + ([module] if module else []))
+
+
+class ModuleEntry:
+    def __init__(self, path: str, mtime_ns: int, size: int, symbols: Dict[str, str], aliases: Dict[str, str],
+                 is_package: bool) -> None:
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.symbols = symbols
+        self.aliases = aliases
+        self.is_package = is_package
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+class SymbolIndex:
+    def __init__(self, root: Union[str, Path], path: Union[str, Path, None] = None) -> None:
+        """
+        index of the module level names of a project. every module is named after the top-level package of its own
+        file (see find_root), so a project can have several roots, e.g. `src` and `tests`
+        :param root: the directory of the project, all the roots are in it
+        :param path: the json file of the index, defaults to a file per root in DEFAULT_CACHE_DIR/symbols
+        """
+        self.root = Path(root).resolve()
+        if path is None:
+            digest = hashlib.sha256(str(self.root).encode("utf-8")).hexdigest()[:16]
+            path = DEFAULT_CACHE_DIR / "symbols" / f"{digest}.json"
+        self.path = Path(path)
+        self.modules: Dict[str, ModuleEntry] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.is_file():
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"ignoring unreadable symbol index {self.path}: {e}")
+            return
+        if data.get("version") != SYMBOLS_VERSION or data.get("root") != str(self.root):
+            return
+        self.modules = {name: ModuleEntry(**entry) for name, entry in data["modules"].items()}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = {
+                "version": SYMBOLS_VERSION,
+                "root": str(self.root),
+                "modules": {name: entry.to_dict() for name, entry in self.modules.items()},
+            }
+        with open(self.path, "w") as f:
+            json.dump(data, f)
+
+    def update(self, files: Optional[Iterable[Union[str, Path]]] = None) -> int:
+        """
+        index the files that changed since they were indexed, and forget the modules that don't exist anymore
+        :param files: the python files of the project, defaults to every python file under the root
+        :return: the number of modules that were parsed or forgotten, the index has to be saved if it is not 0
+        """
+        if files is None:
+            files = collect_python_files(self.root)
+        seen = set()
+        parsed = 0
+        # the root of every directory, the files of a directory share it
+        roots: Dict[Path, Path] = {}
+        for file in files:
+            path = Path(file).resolve()
+            try:
+                path.relative_to(self.root)
+            except ValueError:
+                continue
+            if path.parent not in roots:
+                roots[path.parent] = find_root(path)
+            name = module_name(path, roots[path.parent])
+            seen.add(name)
+            stat = os.stat(path)
+            entry = self.modules.get(name)
+            if entry is not None and entry.path == str(path) and entry.mtime_ns == stat.st_mtime_ns and \
+                    entry.size == stat.st_size:
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    tree = ast.parse(f.read())
+            except (SyntaxError, UnicodeDecodeError, ValueError) as e:
+                logger.debug(f"{path} can't be indexed: {e}")
+                tree = ast.Module(body=[], type_ignores=[])
+            symbols, aliases = module_symbols(tree)
+            with self._lock:
+                self.modules[name] = ModuleEntry(str(path), stat.st_mtime_ns, stat.st_size, symbols, aliases,
+                                                 path.name == "__init__.py")
+            parsed += 1
+        with self._lock:
+            forgotten = len(self.modules) - len(seen)
+            self.modules = {name: entry for name, entry in self.modules.items() if name in seen}
+        logger.info(f"symbol index of {self.root}: {len(self.modules)} modules, {parsed} were parsed")
+        return parsed + forgotten
+
+    def lookup(self, module: str, name: str, depth: int = 3) -> Optional[Tuple[str, str]]:
+        """
+        find the stub of a module level name, re-exports (e.g. in an __init__.py) are followed
+        :param module: absolute name of the module
+        :param name: the name in the module
+        :param depth: maximal number of re-exports to follow
+        :return: the module that defines the name and the stub, None if the name is not in the project
+        """
+        entry = self.modules.get(module)
+        if entry is None:
+            return None
+        if name in entry.symbols:
+            return module, entry.symbols[name]
+        if name in entry.aliases and depth > 0:
+            target, _, target_name = entry.aliases[name].partition(":")
+            level = len(target) - len(target.lstrip("."))
+            return self.lookup(resolve_module(target.lstrip("."), level, module, entry.is_package), target_name,
+                               depth - 1)
+        return None
+
+    def context(self, path: Union[str, Path], tree: ast.Module) -> "ProjectContext":
+        """the context of a file of the project"""
+        return ProjectContext(self, module_name(path, find_root(path)), Path(path).name == "__init__.py", tree)
+
+
+class ProjectContext:
+    def __init__(self, index: SymbolIndex, module: str, is_package: bool, tree: ast.Module) -> None:
+        """
+        the imports of a single file, resolved against the symbol index
+        :param index: the symbol index of the project
+        :param module: the name of the file's module
+        :param is_package: whether the file is an __init__.py
+        :param tree: the parsed file
+        """
+        self.index = index
+        # local name -> (module, name), name is None for imported modules
+        self.imports: Dict[str, Tuple[str, Optional[str]]] = {}
+        for node in scope_walk(tree.body):
+            if isinstance(node, ast.ImportFrom):
+                source = resolve_module(node.module or "", node.level, module, is_package)
+                for alias in node.names:
+                    if alias.name == "*":
+                        continue
+                    if f"{source}.{alias.name}" in index.modules:
+                        self.imports[alias.asname or alias.name] = (f"{source}.{alias.name}", None)
+                    else:
+                        self.imports[alias.asname or alias.name] = (source, alias.name)
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.asname:
+                        self.imports[alias.asname] = (alias.name, None)
+                    else:
+                        self.imports[alias.name.split(".")[0]] = (alias.name.split(".")[0], None)
+
+    def _used(self, nodes: List[ast.stmt]) -> List[Tuple[str, str]]:
+        """the (module, name) pairs of the project that the nodes use, in the order of their first use"""
+        used: Dict[Tuple[str, str], None] = {}
+        for node in nodes:
+            for sub_node in ast.walk(node):
+                if isinstance(sub_node, ast.Name) and sub_node.id in self.imports:
+                    module, name = self.imports[sub_node.id]
+                    if name is not None:
+                        used[(module, name)] = None
+                elif isinstance(sub_node, ast.Attribute):
+                    # `module.name` and `package.module.name`
+                    chain = []
+                    value = sub_node
+                    while isinstance(value, ast.Attribute):
+                        chain.append(value.attr)
+                        value = value.value
+                    if isinstance(value, ast.Name) and value.id in self.imports and \
+                            self.imports[value.id][1] is None:
+                        module = self.imports[value.id][0]
+                        for attribute in reversed(chain):
+                            if f"{module}.{attribute}" not in self.index.modules:
+                                used[(module, attribute)] = None
+                                break
+                            module = f"{module}.{attribute}"
+        return list(used)
+
+    def for_nodes(self, nodes: List[ast.stmt], max_tokens: int = DEFAULT_CONTEXT_TOKENS,
+                  count_tokens: Callable[[str], int] = approximate_tokens) -> str:
+        """
+        the stubs of the names from other modules of the project that the nodes use
+        :param nodes: the statements that are sent to the model
+        :param max_tokens: token budget of the context, stubs that don't fit are left out
+        :param count_tokens: function that counts the tokens of a text
+        :return: the stubs grouped by their module, empty if the nodes don't use anything from the project
+        """
+        modules: Dict[str, List[str]] = {}
+        tokens = 0
+        stubs = set()
+        for module, name in self._used(nodes):
+            found = self.index.lookup(module, name)
+            if found is None or found in stubs:
+                continue
+            stub_tokens = count_tokens(found[1])
+            if tokens + stub_tokens > max_tokens:
+                continue
+            tokens += stub_tokens
+            stubs.add(found)
+            modules.setdefault(found[0], []).append(found[1])
+        return "\n".join(f"# {module}\n" + "\n".join(module_stubs) for module, module_stubs in modules.items())
+
+
+def context_prompt(context: str) -> str:
+    """the part of a prompt with the context, empty when there is no context"""
+    return CONTEXT_PROMPT + context if context else ""
+
+
+def merge_contexts(contexts: Iterable[str]) -> str:
+    """
+    merge the contexts of several prompts into one, every stub appears once
+    :param contexts: contexts in the format of ProjectContext.for_nodes
+    :return: the stubs of all the contexts grouped by their module
+    """
+    modules: Dict[str, Dict[str, None]] = {}
+    for context in contexts:
+        module = None
+        stub: List[str] = []
+        # a trailing header flushes the last stub
+        for line in context.splitlines() + ["# "]:
+            if line[:1] in (" ", "\t") and stub:
+                # a line of the class stub above
+                stub.append(line)
+                continue
+            if stub and module is not None:
+                modules.setdefault(module, {})["\n".join(stub)] = None
+            stub = []
+            if line.startswith("# "):
+                module = line[2:]
+            elif line:
+                stub = [line]
+    return "\n".join(f"# {module}\n" + "\n".join(stubs) for module, stubs in modules.items() if stubs)
+
+
+def project_files(files: Iterable[Union[str, Path]]) -> List[Path]:
+    """
+    the python files that the given files can import from the project - the whole top-level package of a file that is
+    part of a package, and the modules next to a file that is not. the directories around them are never walked, so a
+    single script in a large directory (e.g. the home directory) indexes only its neighbours
+    :param files: python files of the project
+    :return: sorted list of python files, including the given ones
+    """
+    found = {Path(file).resolve() for file in files}
+    walked = set()
+    for file in list(found):
+        root = find_root(file)
+        parts = file.relative_to(root).parts
+        # the top-level package of the file, or the directory of a file that is not in a package
+        top = root / parts[0] if len(parts) > 1 else root
+        if top in walked:
+            continue
+        walked.add(top)
+        if top != root:
+            found.update(path.resolve() for path in collect_python_files(top))
+        else:
+            found.update(path.resolve() for path in collect_python_files(os.path.join(glob.escape(str(root)), "*.py")))
+    return sorted(found)
+
+
+def build_index(files: List[Union[str, Path]], index_path: Union[str, Path, None] = None) -> SymbolIndex:
+    """
+    build (or update) the symbol index of the project that the files belong to
+    :param files: python files of the project
+    :param index_path: the json file of the index
+    :return: the updated index, it is saved before it is returned
+    """
+    roots = {find_root(file) for file in files}
+    root = Path(os.path.commonpath([str(root) for root in roots])) if roots else Path.cwd()
+    index = SymbolIndex(root, index_path)
+    if index.update(project_files(files)):
+        index.save()
+    return index
@@ -1,9 +1,18 @@
-from typing import List
-import threading
-import openai
+import ast
+import logging
+from functools import partial
+from typing import List, Optional
 from pathlib import Path
 from autopy.models.models import ModelType
+from autopy.type.utils.chunker import Chunk, chunk_source
+from autopy.type.utils.incremental import fingerprint, match_typed, typed_imports
+from autopy.type.utils.reassemble import reassemble
+from autopy.type.utils.validator import Validator
+from autopy.completion.cache import CompletionCache, make_key
+from autopy.completion.client import CompletionClient, CompletionRequest
+from autopy.completion.tokens import chunk_budget, completion_budget, count_tokens
 
+logger = logging.getLogger(__name__)
 
 
 def get_file_from_path(path: Path) -> str:
@@ -42,56 +51,83 @@ def send_file_to_openai(file: str, batch_size: int = 10) -> List[str]:
     return [send_batch_to_openai(batch) for batch in batches]
 
 
-def slice_and_complete(filepath: Path, instruction: str, number_of_workers=2) -> None:
-    """Slices a Python file into 4 chunks and uses OpenAI's Completion API to complete each chunk with the given instruction.
+def slice_and_complete(
+        filepath: Path,
+        instruction: str,
+        number_of_workers=2,
+        max_tokens_per_chunk: Optional[int] = None,
+        cache: Optional[CompletionCache] = None,
+        client: Optional[CompletionClient] = None
+) -> None:
+    """Slices a Python file into chunks on top-level function and class boundaries and uses OpenAI's Completion API to
+    complete each chunk with the given instruction.
 
     Args:
     - filepath (str): The filepath of the Python file to slice.
     - instruction (str): The instruction to provide to the Completion API.
+    - number_of_workers (int): The number of chunks to spread the file across (when the file is large enough).
+    - max_tokens_per_chunk (int): The token budget of the code of a single chunk, by default the largest chunk whose
+      typed version still fits in the context of the model.
+    - cache (CompletionCache): Optional completion cache, chunks that did not change since the last run are not sent.
+    - client (CompletionClient): Optional completion client, by default a client with number_of_workers requests in
+      flight is created.
 
     """
-    output = [None] * number_of_workers
     # Read the Python file
     with open(filepath, "r") as f:
         contents = f.read()
 
-    imports = "\n".join([line for line in contents.split("\n") if
-                         line.strip(" ").startswith("import") or line.strip(" ").startswith("from")])
-
-    # Split the file into 4 chunks
-    chunk_size = len(contents) // number_of_workers
-    chunks = {i: contents[i * chunk_size:(i + 1) * chunk_size] for i in range(number_of_workers)}
-
-    # Create a list of threads
-    threads = []
-
-    # Define a completion function
-    def complete_chunk(chunk: str, chunk_number: int) -> None:
-        # Use the Completion API to complete the chunk
-        model_engine = ModelType.TEXT_DAVINCI_003.value
-        if chunk_number == 0:
-            prompt = f"{instruction}\n{chunk}"
-        else:
-            prompt = f"{instruction}\n{imports}\n{chunk}"
-        completions = openai.Completion.create(engine=model_engine, prompt=prompt, max_tokens=4096 - len(prompt))
-        # Print the completions
-        print(completions.choices[0].text)
-        output[chunk_number] = completions.choices[0].text
-
-    # Create a thread for each chunk
+    # Split the file on top-level statements, each chunk carries the imports and names it uses
+    model_engine = ModelType.TEXT_DAVINCI_003.value
+    if max_tokens_per_chunk is None:
+        max_tokens_per_chunk = chunk_budget(instruction, model_engine)
+    chunks = chunk_source(
+        contents,
+        max_tokens=max_tokens_per_chunk,
+        count_tokens=partial(count_tokens, model=model_engine),
+        min_chunks=number_of_workers
+    )
+    if client is None:
+        client = CompletionClient(max_concurrency=number_of_workers, cache=cache)
+
+    def validate_chunk(chunk: Chunk, text: str) -> bool:
+        # invalid chunks fail fast and only they are requested again
+        return validator.validate(ast.Module(body=chunk.nodes, type_ignores=[]), chunk.strip_header(text)).valid
+
+    # Complete all the chunks concurrently, the client bounds the number of requests in flight
+    validator = Validator()
+    requests = []
+    sent = []
     for chunk in chunks:
-        thread = threading.Thread(target=complete_chunk, args=(chunks[chunk], chunk))
-        thread.start()
-        threads.append(thread)
-
-    # Wait for all threads to complete
-    for thread in threads:
-        thread.join()
-
-    # Write the output to a file
-    for i, chunk in enumerate(output):
-        with open(filepath.parent / f"{filepath.stem}_typed_{i}.py", "w") as f:
-            f.write(chunk)
-
+        prompt = f"{instruction}\n{chunk.prompt_source}"
+        try:
+            max_tokens = completion_budget(prompt, model_engine)
+        except ValueError as e:
+            # a single statement that is longer than the context of the model is left as it is
+            logger.warning(f"lines {chunk.start_line}-{chunk.end_line} are too long for {model_engine}: {e}")
+            continue
+        sent.append(chunk)
+        requests.append(CompletionRequest(
+            prompt=prompt,
+            max_tokens=max_tokens,
+            model=model_engine,
+            cache_key=make_key(model_engine, instruction, chunk.prompt_source),
+            validate=partial(validate_chunk, chunk),
+        ))
+    completions = client.complete_many(requests)
+
+    # Match the typed statements to the original ones, the statements of chunks that stayed invalid after the retries
+    # are checked one by one
+    units = {}
+    imports = []
+    for chunk, completion in zip(sent, completions):
+        typed = chunk.strip_header(completion.text)
+        for index, typed_statement in match_typed(chunk.nodes, typed).items():
+            node = chunk.nodes[index]
+            if completion.valid or validator.validate_node(node, typed_statement).valid:
+                units[fingerprint(node)] = typed_statement
+        imports.extend(typed_imports(typed))
+
+    # Put every typed statement in the place of the original one and write the output to a file
     with open(filepath.parent / f"{filepath.stem}_typed.py", "w") as f:
-        f.write("".join(output))
+        f.write(reassemble(contents, ast.parse(contents), units, imports, filename=str(filepath)))
@@ -1,66 +1,233 @@
+import ast
+import copy
 from pathlib import Path
-from typing import Dict
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 
-class Validator:
+class ArgumentCoverage:
+    def __init__(self, name: str, kind: str, lineno: int, annotated: bool) -> None:
+        """
+        :param name: the name of the argument
+        :param kind: one of posonly, arg, vararg, kwonly, kwarg
+        :param lineno: the line of the argument
+        :param annotated: whether the argument has a type hint
+        """
+        self.name = name
+        self.kind = kind
+        self.lineno = lineno
+        self.annotated = annotated
 
-    def __init__(self):
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "kind": self.kind, "lineno": self.lineno, "annotated": self.annotated}
+
+
+class FunctionCoverage:
+    def __init__(self, name: str, lineno: int, is_async: bool, returns_annotated: bool,
+                 arguments: List[ArgumentCoverage]) -> None:
         """
-        Validator class for validating the input parameters.
+        :param name: qualified name of the function, e.g. `MyClass.method`
+        :param lineno: the line of the `def`
+        :param is_async: whether the function is `async def`
+        :param returns_annotated: whether the function has a return type hint
+        :param arguments: the arguments that can be annotated (self and cls of methods are skipped)
         """
-        self.score: int = 0
-        self.score_per_argument: Dict[str, int] = {}
-
-    def validate_function_signature(self, line: str) -> bool:
-        """
-        this function takes as input a function signature and make sure that it has type hints.
-        :param line: the function signature
-        :return: the function signature with type hints
-        """
-        statements = [
-            "->" in line,
-            "def" in line,
-            "(" in line,
-            ")" in line
-        ]
-        args = line.split("(")[1].split(")")[0].split(",")
-        for arg in args:
-            if arg == "self":
-                continue
-            else:
-                statements.append(":" in arg)
-        self.score_per_argument.update(
-            {
-
-            }
-        )
-        if all(statements):
-            return True
-        else:
-            return False
+        self.name = name
+        self.lineno = lineno
+        self.is_async = is_async
+        self.returns_annotated = returns_annotated
+        self.arguments = arguments
 
-    @staticmethod
-    def validate_var(line: str) -> bool:
+    @property
+    def annotated(self) -> int:
+        return int(self.returns_annotated) + sum(argument.annotated for argument in self.arguments)
+
+    @property
+    def total(self) -> int:
+        return 1 + len(self.arguments)
+
+    @property
+    def missing(self) -> List[str]:
+        """names of the arguments without hints, `return` if the return type is missing"""
+        missing = [argument.name for argument in self.arguments if not argument.annotated]
+        if not self.returns_annotated:
+            missing.append("return")
+        return missing
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "lineno": self.lineno,
+            "async": self.is_async,
+            "returns_annotated": self.returns_annotated,
+            "arguments": [argument.to_dict() for argument in self.arguments],
+        }
+
+
+class VariableCoverage:
+    def __init__(self, name: str, scope: str, lineno: int, annotated: bool) -> None:
         """
-        this function takes as input a variable assignment and make sure that it has type hints.
-        :param line: the variable assignment
-        :return: the variable assignment with type hints
+        :param name: the assigned name, e.g. `x` or `self.x`
+        :param scope: qualified name of the enclosing function or class, empty for module level variables
+        :param lineno: the line of the assignment
+        :param annotated: whether the assignment has a type hint
         """
-        statements = [
-            "=" in line,
-            ":" in line
-        ]
-        try:
-            hint = line.split(":")[1].split("=")[0].strip()
-        except IndexError:
-            return False
-        if all(statements):
-            return True
+        self.name = name
+        self.scope = scope
+        self.lineno = lineno
+        self.annotated = annotated
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "scope": self.scope, "lineno": self.lineno, "annotated": self.annotated}
+
+
+class ClassCoverage:
+    def __init__(self, name: str, lineno: int) -> None:
+        """
+        :param name: qualified name of the class
+        :param lineno: the line of the `class`
+        """
+        self.name = name
+        self.lineno = lineno
+        self.methods: List[FunctionCoverage] = []
+        self.attributes: List[VariableCoverage] = []
+
+    @property
+    def annotated(self) -> int:
+        return sum(method.annotated for method in self.methods) + sum(
+            attribute.annotated for attribute in self.attributes)
+
+    @property
+    def total(self) -> int:
+        return sum(method.total for method in self.methods) + len(self.attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "lineno": self.lineno,
+            "methods": [method.name for method in self.methods],
+            "attributes": [attribute.to_dict() for attribute in self.attributes],
+            "annotated": self.annotated,
+            "total": self.total,
+        }
+
+
+class CoverageReport:
+    def __init__(self, path: Optional[str] = None) -> None:
+        """
+        type hints coverage of a single file
+        :param path: the path of the file, if the report was created from a file
+        """
+        self.path = path
+        self.functions: List[FunctionCoverage] = []
+        self.classes: List[ClassCoverage] = []
+        self.variables: List[VariableCoverage] = []
+
+    @property
+    def annotated(self) -> int:
+        return sum(function.annotated for function in self.functions) + sum(
+            variable.annotated for variable in self.variables)
+
+    @property
+    def total(self) -> int:
+        return sum(function.total for function in self.functions) + len(self.variables)
+
+    @property
+    def score(self) -> float:
+        """the annotated fraction of everything that can be annotated, a file with nothing to annotate is covered"""
+        return self.annotated / self.total if self.total else 1.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "score": self.score,
+            "annotated": self.annotated,
+            "total": self.total,
+            "functions": [function.to_dict() for function in self.functions],
+            "classes": [cls.to_dict() for cls in self.classes],
+            "variables": [variable.to_dict() for variable in self.variables],
+        }
+
+
+class _CoverageVisitor(ast.NodeVisitor):
+    """walks the tree once and fills a CoverageReport"""
+
+    def __init__(self, report: CoverageReport) -> None:
+        self.report = report
+        # stack of the enclosing definitions, (qualified name, ClassCoverage or None for functions)
+        self.scopes: List[Tuple[str, Optional[ClassCoverage]]] = []
+
+    def _qualname(self, name: str) -> str:
+        return ".".join([scope for scope, _ in self.scopes] + [name])
+
+    def _enclosing_class(self) -> Optional[ClassCoverage]:
+        return self.scopes[-1][1] if self.scopes else None
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        coverage = ClassCoverage(self._qualname(node.name), node.lineno)
+        self.report.classes.append(coverage)
+        self.scopes.append((node.name, coverage))
+        self.generic_visit(node)
+        self.scopes.pop()
+
+    def _visit_function(self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> None:
+        args = node.args
+        positional = [("posonly", arg) for arg in args.posonlyargs] + [("arg", arg) for arg in args.args]
+        enclosing_class = self._enclosing_class()
+        decorators = {decorator.id for decorator in node.decorator_list if isinstance(decorator, ast.Name)}
+        if enclosing_class is not None and positional and "staticmethod" not in decorators:
+            # self / cls are never annotated
+            positional = positional[1:]
+        arguments = [(kind, arg) for kind, arg in positional]
+        if args.vararg:
+            arguments.append(("vararg", args.vararg))
+        arguments += [("kwonly", arg) for arg in args.kwonlyargs]
+        if args.kwarg:
+            arguments.append(("kwarg", args.kwarg))
+
+        coverage = FunctionCoverage(
+            name=self._qualname(node.name),
+            lineno=node.lineno,
+            is_async=isinstance(node, ast.AsyncFunctionDef),
+            returns_annotated=node.returns is not None,
+            arguments=[ArgumentCoverage(arg.arg, kind, arg.lineno, arg.annotation is not None)
+                       for kind, arg in arguments],
+        )
+        self.report.functions.append(coverage)
+        if enclosing_class is not None:
+            enclosing_class.methods.append(coverage)
+        self.scopes.append((node.name, None))
+        self.generic_visit(node)
+        self.scopes.pop()
+
+    visit_FunctionDef = _visit_function
+    visit_AsyncFunctionDef = _visit_function
+
+    def _add_variable(self, target: ast.expr, lineno: int, annotated: bool) -> None:
+        if isinstance(target, ast.Name):
+            name = target.id
+        elif isinstance(target, ast.Attribute) and isinstance(target.value, ast.Name):
+            name = f"{target.value.id}.{target.attr}"
         else:
-            return False
+            # subscripts and unpacking can not be annotated
+            return
+        scope = ".".join(scope for scope, _ in self.scopes)
+        variable = VariableCoverage(name, scope, lineno, annotated)
+        self.report.variables.append(variable)
+        enclosing_class = self._enclosing_class()
+        if enclosing_class is None and name.startswith("self.") and len(self.scopes) > 1:
+            # instance attributes assigned inside a method belong to the class of the method
+            enclosing_class = self.scopes[-2][1]
+        if enclosing_class is not None:
+            enclosing_class.attributes.append(variable)
 
+    def visit_Assign(self, node: ast.Assign) -> None:
+        if len(node.targets) == 1:
+            self._add_variable(node.targets[0], node.lineno, annotated=False)
+        self.generic_visit(node)
 
-import ast
+    def visit_AnnAssign(self, node: ast.AnnAssign) -> None:
+        self._add_variable(node.target, node.lineno, annotated=True)
+        self.generic_visit(node)
 
 
 class ValidatorParser:
@@ -68,39 +235,174 @@ class ValidatorParser:
         """
         Validator class for validating the input parameters.
         """
-        # counter count the number of variables and functions that don't have type hints
-        # total count the total number of variables and functions at the file that can be type hinted in a perfect world
-        self.counter = 0
-        self.total = 0
 
-    def validate(self, filepath: str) -> float:
+    @staticmethod
+    def analyze(source: Union[str, ast.AST], path: Optional[str] = None) -> CoverageReport:
+        """
+        create a type hints coverage report in a single pass over the tree
+        :param source: python source code or an already parsed tree
+        :param path: the path of the file, only used for the report
+        :return: the coverage report
+        """
+        tree = ast.parse(source) if isinstance(source, str) else source
+        report = CoverageReport(path)
+        _CoverageVisitor(report).visit(tree)
+        return report
+
+    def analyze_file(self, filepath: Union[str, Path]) -> CoverageReport:
         with open(filepath, 'r') as f:
-            tree = ast.parse(f.read())
-
-        # Validate variable declarations
-        for node in ast.walk(tree):
-            if isinstance(node, ast.AnnAssign):
-                self.counter += 1
-                self.total += 1
-            elif isinstance(node, ast.Assign):
-                self.total += 1
-
-        # Validate function type hints
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                if node.returns:
-                    self.counter += 1
-                self.total += 1
-                for arg in node.args.args:
-                    if arg.annotation:
-                        self.counter += 1
-                    self.total += 1
-
-        # Calculate score
-        score = (self.counter / self.total)
-        self.counter = 0
-        self.total = 0
-        return score
+            return self.analyze(f.read(), str(filepath))
+
+    def validate(self, filepath: Union[str, Path]) -> float:
+        """
+        :param filepath: path to a python file
+        :return: the fraction of the variables, arguments and return types in the file that have type hints
+        """
+        return self.analyze_file(filepath).score
+
+
+# imports that the model adds for the hints, they are not part of the code itself
+ANNOTATION_MODULES = {"typing", "typing_extensions", "__future__"}
+
+
+class ValidationResult:
+    def __init__(self, errors: Optional[List[str]] = None) -> None:
+        """
+        :param errors: the reasons the typed code is not valid, empty if it is valid
+        """
+        self.errors = errors or []
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+    def __bool__(self) -> bool:
+        return self.valid
+
+    def __repr__(self) -> str:
+        return f"ValidationResult(errors={self.errors})"
+
+
+class _AnnotationStripper(ast.NodeTransformer):
+    """removes every type hint from a tree, so typed and untyped versions of the same code are equal"""
+
+    def visit_arg(self, node: ast.arg) -> ast.arg:
+        node.annotation = None
+        node.type_comment = None
+        return node
+
+    def _visit_function(self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> ast.AST:
+        node.returns = None
+        node.type_comment = None
+        self.generic_visit(node)
+        return self._keep_body(node)
+
+    visit_FunctionDef = _visit_function
+    visit_AsyncFunctionDef = _visit_function
+
+    def visit_AnnAssign(self, node: ast.AnnAssign) -> Optional[ast.AST]:
+        if node.value is None:
+            # a bare declaration (`x: int`) does not do anything at runtime
+            return None
+        return ast.Assign(targets=[node.target], value=self.visit(node.value), type_comment=None)
+
+    def visit_Assign(self, node: ast.Assign) -> ast.AST:
+        node.type_comment = None
+        self.generic_visit(node)
+        return node
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> Optional[ast.AST]:
+        return None if node.module in ANNOTATION_MODULES else node
+
+    def visit_Import(self, node: ast.Import) -> Optional[ast.AST]:
+        node.names = [alias for alias in node.names if alias.name not in ANNOTATION_MODULES]
+        return node if node.names else None
+
+    def generic_visit(self, node: ast.AST) -> ast.AST:
+        super().generic_visit(node)
+        return self._keep_body(node)
+
+    @staticmethod
+    def _keep_body(node: ast.AST) -> ast.AST:
+        # dropping declarations may leave an empty body, which is the same code as a body with `pass`
+        if not isinstance(node, ast.Module) and isinstance(getattr(node, "body", None), list) and not node.body:
+            node.body = [ast.Pass()]
+        return node
+
+
+def strip_annotations(tree: ast.AST) -> ast.AST:
+    """
+    :param tree: the tree to strip, it is not modified
+    :return: a copy of the tree without type hints and without the imports of the typing modules
+    """
+    return _AnnotationStripper().visit(copy.deepcopy(tree))
+
+
+class Validator:
+    def __init__(self, require_returns: bool = True, require_arguments: bool = True,
+                 require_variables: bool = False) -> None:
+        """
+        validates the code the model returns against the code that was sent to it.
+        :param require_returns: every function must have a return type hint
+        :param require_arguments: every argument (besides self and cls) must have a type hint
+        :param require_variables: every assignment must have a type hint
+        """
+        self.require_returns = require_returns
+        self.require_arguments = require_arguments
+        self.require_variables = require_variables
+
+    def validate(self, original: Union[str, ast.AST], typed: str, filename: str = "<typed>") -> ValidationResult:
+        """
+        make sure that the typed code compiles, that it is the original code apart from the type hints, and that the
+        signatures (and optionally the variables) have hints. the checks stop at the first failing one.
+        :param original: the code that was sent to the model, source or parsed tree
+        :param typed: the code that the model returned
+        :param filename: the file name used in the compilation errors
+        :return: the validation result
+        """
+        try:
+            typed_tree = ast.parse(typed, filename)
+            compile(typed_tree, filename, "exec")
+        except (SyntaxError, ValueError) as e:
+            return ValidationResult([f"the typed code does not compile: {e}"])
+
+        original_tree = ast.parse(original) if isinstance(original, str) else original
+        original_body = strip_annotations(original_tree).body
+        typed_body = strip_annotations(typed_tree).body
+        for position, (original_node, typed_node) in enumerate(zip(original_body, typed_body)):
+            if ast.dump(original_node) != ast.dump(typed_node):
+                return ValidationResult([
+                    f"the typed code changed the statement in line {getattr(typed_node, 'lineno', position)}"])
+        if len(original_body) != len(typed_body):
+            return ValidationResult(
+                [f"the typed code has {len(typed_body)} statements instead of {len(original_body)}"])
+
+        return ValidationResult(self.hint_errors(ValidatorParser.analyze(typed_tree, filename)))
+
+    def hint_errors(self, report: CoverageReport) -> List[str]:
+        """
+        :param report: coverage report of typed code
+        :return: a description of every hint that is required and missing
+        """
+        errors = []
+        for function in report.functions:
+            missing = [name for name in function.missing if
+                       (name == "return" and self.require_returns) or (name != "return" and self.require_arguments)]
+            if missing:
+                errors.append(f"{function.name} (line {function.lineno}) has no hints for {', '.join(missing)}")
+        if self.require_variables:
+            errors += [f"{variable.name} (line {variable.lineno}) has no hint"
+                       for variable in report.variables if not variable.annotated]
+        return errors
+
+    def validate_node(self, node: ast.stmt, typed: str) -> ValidationResult:
+        """
+        validate the typed version of a single top-level statement
+        :param node: the original statement
+        :param typed: the typed version of the statement
+        :return: the validation result
+        """
+        return self.validate(ast.Module(body=[node], type_ignores=[]), typed)
 
 
 if __name__ == '__main__':
@@ -111,4 +413,3 @@ if __name__ == '__main__':
     print(val.validate(path_n))
     # print(val.validate(path / "examples/test.py"))
     print(val.validate(path_t))
-    # print(val.validate_function_signature("def hello(a: int, b: int) -> int:"))
@@ -0,0 +1,294 @@
+"""
+End-to-end benchmarks of the pipeline.
+
+every scenario runs on synthetic inputs of growing size against FakeBackend (a local stand-in for the model with
+configurable latency, generation speed and injected rate limit errors), once with an empty completion cache and once
+more with the cache of the first pass. every scenario and size runs in a fresh process, so the memory peak of the
+process (its max rss) belongs to that scenario only - the peak of the warm pass includes the cold pass before it. the
+results are written as json so runs can be compared over time:
+
+    python -m benchmarks.run --sizes 10 --sizes 100 --latency 0.05 --failure-rate 0.02
+    python -m benchmarks.run --baseline benchmarks/results/<previous>.json
+"""
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import click
+
+from autopy import metrics
+from autopy.completion.cache import CompletionCache
+from autopy.completion.client import CompletionClient
+from autopy.completion.fake import FakeBackend
+from benchmarks.synthetic import generate_codebase, generate_csv, hints_responder, ml_responder, typing_responder
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - windows
+    resource = None
+
+RESULTS_DIR = Path(__file__).parent / "results"
+SCENARIOS = ("autopy", "hints", "stubs", "slice", "ml")
+INSTRUCTION = "add type hints to each and every variable in each class, follow the PEP8 guidelines"
+
+
+class BenchmarkConfig:
+    def __init__(self, latency: float = 0.0, tokens_per_second: Optional[float] = None, failure_rate: float = 0.0,
+                 workers: int = 8, definitions: int = 20, seed: int = 0) -> None:
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.workers = workers
+        self.definitions = definitions
+        self.seed = seed
+
+    def client(self, responder: Callable[[str], str], cache_path: Path) -> CompletionClient:
+        backend = FakeBackend(responder, latency=self.latency, tokens_per_second=self.tokens_per_second,
+                              failure_rate=self.failure_rate, seed=self.seed)
+        # short backoff, the injected failures should cost retries and not minutes of sleeping
+        return CompletionClient(backend=backend, max_concurrency=self.workers, max_retries=10, base_delay=0.01,
+                                max_delay=0.1, cache=CompletionCache(cache_path))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+def memory_peak() -> Optional[int]:
+    """the max rss of the current process in bytes"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(scenario: str, size: int, pass_: str, files: int, run: Callable[[], None]) -> Dict[str, Any]:
+    """run a scenario once and collect its throughput, memory peak and cache hit rate"""
+    metrics.reset()
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    counters = metrics.summary()["counters"]
+    tokens = counters.get("tokens_in", 0) + counters.get("tokens_out", 0)
+    lookups = counters.get("cache_hits", 0) + counters.get("cache_misses", 0)
+    result = {
+        "scenario": scenario,
+        "size": size,
+        "pass": pass_,
+        "files": files,
+        "elapsed": elapsed,
+        "files_per_second": files / elapsed if elapsed else 0.0,
+        "tokens": tokens,
+        "tokens_per_second": tokens / elapsed if elapsed else 0.0,
+        "memory_peak": memory_peak(),
+        "cache_hit_rate": counters.get("cache_hits", 0) / lookups if lookups else 0.0,
+        "retries": counters.get("retries", 0),
+    }
+    click.echo(f"{scenario:<8}{size:>7} {pass_:<5}{result['files_per_second']:>10.2f} files/s"
+               f"{result['tokens_per_second']:>12.0f} tokens/s  hit rate {result['cache_hit_rate']:.2f}")
+    return result
+
+
+def clean_outputs(files: List[Path]) -> None:
+    """remove the typed files, the stubs and the manifests, so the next pass types everything again (via the cache)"""
+    for file in files:
+        for output in file.parent.glob(f"{file.stem}_typed*"):
+            output.unlink()
+        file.with_suffix(".pyi").unlink(missing_ok=True)
+
+
+def bench_autopy(config: BenchmarkConfig, size: int, workdir: Path) -> List[Dict[str, Any]]:
+    from autopy.type.batch import BatchRunner
+
+    files = generate_codebase(workdir / "code", size, config.definitions, config.seed)
+    client = config.client(typing_responder, workdir / "completions.sqlite3")
+    runner = BatchRunner(api_key="benchmark", workers=config.workers, client=client)
+    results = []
+    for pass_ in ("cold", "warm"):
+        clean_outputs(files)
+        results.append(measure("autopy", size, pass_, len(files), lambda: runner.run(files)))
+    client.close()
+    return results
+
+
+def bench_hints(config: BenchmarkConfig, size: int, workdir: Path) -> List[Dict[str, Any]]:
+    from autopy.type.batch import BatchRunner
+
+    files = generate_codebase(workdir / "code", size, config.definitions, config.seed)
+    client = config.client(hints_responder, workdir / "completions.sqlite3")
+    # only the hints are requested, and they are written as diffs so every pass types the same files
+    runner = BatchRunner(api_key="benchmark", workers=config.workers, client=client, output="diff")
+    results = []
+    for pass_ in ("cold", "warm"):
+        clean_outputs(files)
+        results.append(measure("hints", size, pass_, len(files), lambda: runner.run(files)))
+    client.close()
+    return results
+
+
+def bench_stubs(config: BenchmarkConfig, size: int, workdir: Path) -> List[Dict[str, Any]]:
+    from autopy.type.batch import BatchRunner
+
+    files = generate_codebase(workdir / "code", size, config.definitions, config.seed)
+    client = config.client(hints_responder, workdir / "completions.sqlite3")
+    runner = BatchRunner(api_key="benchmark", workers=config.workers, client=client, output="pyi")
+    results = []
+    for pass_ in ("cold", "warm"):
+        clean_outputs(files)
+        results.append(measure("stubs", size, pass_, len(files), lambda: runner.run(files)))
+    client.close()
+    return results
+
+
+def bench_slice(config: BenchmarkConfig, size: int, workdir: Path) -> List[Dict[str, Any]]:
+    from autopy.type.utils.utils import slice_and_complete
+
+    files = generate_codebase(workdir / "code", size, config.definitions, config.seed)
+    client = config.client(typing_responder, workdir / "completions.sqlite3")
+
+    def run() -> None:
+        for file in files:
+            slice_and_complete(file, INSTRUCTION, number_of_workers=config.workers, client=client)
+
+    results = []
+    for pass_ in ("cold", "warm"):
+        clean_outputs(files)
+        results.append(measure("slice", size, pass_, len(files), run))
+    client.close()
+    return results
+
+
+def bench_ml(config: BenchmarkConfig, size: int, workdir: Path) -> List[Dict[str, Any]]:
+    try:
+        # autopy.ml.autopy_ml imports its dependencies lazily, so they are imported here to skip the scenario without
+        # them instead of failing in the middle of it
+        import numpy  # noqa: F401
+        import pandas  # noqa: F401
+        import sklearn  # noqa: F401
+
+        from autopy.ml.autopy_ml import AutoPyML
+    except ImportError as e:
+        click.echo(f"skipping the ml scenario: {e}", err=True)
+        return []
+
+    # the size of the ml scenario is thousands of rows
+    csv_path = generate_csv(workdir / "data.csv", size * 1000, config.seed)
+    client = config.client(ml_responder, workdir / "completions.sqlite3")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    results = []
+    try:
+        for pass_ in ("cold", "warm"):
+            def run() -> None:
+                AutoPyML("benchmark", csv_path, target="target", client=client,
+                         cache_dir=workdir / f"cache_{pass_}").run()
+
+            results.append(measure("ml", size, pass_, 1, run))
+    finally:
+        os.chdir(cwd)
+        client.close()
+    return results
+
+
+BENCHMARKS = {"autopy": bench_autopy, "hints": bench_hints, "stubs": bench_stubs, "slice": bench_slice,
+              "ml": bench_ml}
+
+
+def run_scenario(scenario: str, config: BenchmarkConfig, size: int) -> List[Dict[str, Any]]:
+    """run a scenario in a temporary directory, this is the entry point of the benchmark process"""
+    logging.basicConfig(level=logging.WARNING)
+    # the injected failures are expected, their retries are counted in the results
+    logging.getLogger("autopy.completion.client").setLevel(logging.ERROR)
+    workdir = Path(tempfile.mkdtemp(prefix=f"autopy_bench_{scenario}_"))
+    try:
+        return BENCHMARKS[scenario](config, size, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """
+    :return: a description of every scenario that is slower than in the baseline by more than max_regression
+    """
+    previous = {(result["scenario"], result["size"], result["pass"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["scenario"], result["size"], result["pass"]))
+        if not before or not before["files_per_second"]:
+            continue
+        change = result["files_per_second"] / before["files_per_second"] - 1
+        if change < -max_regression:
+            regressions.append(f"{result['scenario']} size {result['size']} ({result['pass']}): "
+                               f"{before['files_per_second']:.2f} -> {result['files_per_second']:.2f} files/s")
+    return regressions
+
+
+@click.command(help="benchmark the typing pipeline against a local stand-in for the model")
+@click.option("--scenario", "scenarios", multiple=True, type=click.Choice(SCENARIOS), help="Default: all.")
+@click.option("--sizes", multiple=True, type=click.IntRange(min=1), help="Number of files (thousands of rows for ml).")
+@click.option("--definitions", default=20, show_default=True, help="Functions and classes per synthetic file.")
+@click.option("--latency", default=0.0, show_default=True, help="Seconds before every response.")
+@click.option("--tokens-per-second", default=None, type=float, help="Generation speed of the fake model.")
+@click.option("--failure-rate", default=0.0, show_default=True, help="Probability of an injected rate limit error.")
+@click.option("-w", "--workers", default=8, show_default=True, type=click.IntRange(min=1))
+@click.option("--seed", default=0, show_default=True)
+@click.option("--output", default=None, type=click.Path(dir_okay=False), help="Default: benchmarks/results/.")
+@click.option("--baseline", default=None, type=click.Path(exists=True, dir_okay=False),
+              help="Results of a previous run, exit with 1 if a scenario got slower.")
+@click.option("--max-regression", default=0.2, show_default=True, help="Allowed slowdown relatively to the baseline.")
+def main(scenarios, sizes, definitions, latency, tokens_per_second, failure_rate, workers, seed, output, baseline,
+         max_regression) -> None:
+    config = BenchmarkConfig(latency, tokens_per_second, failure_rate, workers, definitions, seed)
+    results = []
+    for scenario in scenarios or SCENARIOS:
+        for size in sizes or (10, 50):
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results.extend(executor.submit(run_scenario, scenario, config, size).result())
+
+    created = datetime.now(timezone.utc)
+    report = {
+        "created": created.isoformat(),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": config.to_dict(),
+        "results": results,
+    }
+    if output is None:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        output = RESULTS_DIR / f"bench-{created.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+    click.echo(f"results were written to {output}")
+
+    if baseline:
+        with open(baseline, "r") as f:
+            regressions = compare(results, json.load(f), max_regression)
+        for regression in regressions:
+            click.echo(f"regression: {regression}", err=True)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
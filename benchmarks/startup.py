@@ -0,0 +1,96 @@
+"""
+Startup time budgets of the cli.
+
+every subcommand runs in a fresh interpreter (the best of a few runs, minus the startup of a bare interpreter) and
+must stay within its budget. the run also fails if a command imported one of the heavy backends that should only be
+imported on first use:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeat 10 --output startup.json
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import click
+
+SAMPLE_FILE = str(Path(__file__).resolve().parent.parent / "autopy" / "metrics.py")
+# the cli arguments of every measured command and its budget in milliseconds on top of the bare interpreter
+BUDGETS: Dict[Tuple[str, ...], float] = {
+    ("--help",): 150,
+    ("run", "--help"): 150,
+    ("coverage", "--help"): 150,
+    ("check", "--help"): 150,
+    ("stubs", "--help"): 150,
+    # the offline commands do actual work, they analyze a single file without the index
+    ("coverage", "--path", SAMPLE_FILE, "--no_index", "--json"): 200,
+}
+# modules that no command may import before it does actual work
+HEAVY_MODULES = ("openai", "pandas", "numpy", "sklearn", "nbformat", "nbconvert", "dash", "tiktoken", "asyncio")
+
+COMMAND_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from autopy.type.cli.main import autopy_cli
+try:
+    autopy_cli.main({args!r}, standalone_mode=False)
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "modules": [name for name in {heavy!r} if name in sys.modules]}}),
+      file=sys.stderr)
+"""
+
+
+def measure_command(args: Tuple[str, ...], repeat: int) -> Tuple[float, List[str]]:
+    """
+    run a command in fresh interpreters
+    :param args: the cli arguments
+    :param repeat: number of runs, the fastest one is kept
+    :return: the time of the imports and the command in milliseconds and the heavy modules it imported
+    """
+    script = COMMAND_SCRIPT.format(args=list(args), heavy=HEAVY_MODULES)
+    best = float("inf")
+    modules: List[str] = []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+        result = json.loads(process.stderr.strip().splitlines()[-1])
+        best = min(best, result["elapsed"] * 1000)
+        modules = result["modules"]
+    return best, modules
+
+
+def baseline(repeat: int) -> float:
+    """the time of the imports of a bare interpreter (site and the standard library it loads) in milliseconds"""
+    script = "import time; start = time.perf_counter(); import json, sys; print(time.perf_counter() - start)"
+    return min(float(subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                                    check=True).stdout) * 1000 for _ in range(repeat))
+
+
+@click.command(help="check the startup time of every cli command against its budget")
+@click.option("--repeat", default=5, show_default=True, type=click.IntRange(min=1), help="Runs of every command.")
+@click.option("--output", default=None, type=click.Path(dir_okay=False), help="Write the results as json.")
+def main(repeat: int, output: Optional[str]) -> None:
+    bare = baseline(repeat)
+    results = []
+    failed = False
+    for args, budget in BUDGETS.items():
+        elapsed, modules = measure_command(args, repeat)
+        elapsed = max(elapsed - bare, 0.0)
+        ok = elapsed <= budget and not modules
+        failed |= not ok
+        results.append({"command": " ".join(args), "elapsed": elapsed, "budget": budget, "heavy_modules": modules})
+        status = "ok" if ok else "FAILED"
+        click.echo(f"{' '.join(args):<30}{elapsed:>8.1f} ms  budget {budget:>6.0f} ms  {status}"
+                   + (f"  imported {', '.join(modules)}" if modules else ""))
+    if output:
+        with open(output, "w") as f:
+            json.dump({"python": sys.version.split()[0], "baseline": bare, "results": results}, f, indent=1)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
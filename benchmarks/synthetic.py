@@ -0,0 +1,141 @@
+"""
+Synthetic inputs and a deterministic stand-in for the model.
+
+the generated modules are plain python without type hints, and the responder types them the way the model would - it
+annotates the arguments and the return value of every function of the code part of the prompt, and keeps everything
+else as is (including the context header of a chunk) so the output passes the validation of the pipeline.
+"""
+import csv
+import json
+import random
+import re
+from pathlib import Path
+from typing import List, Union
+
+CODE_MARKER = "this is the code:\n"
+TEMPLATE_MARKER = "the template:\n"
+SIGNATURE = re.compile(r"^(?P<indent>\s*)(?P<prefix>(?:async\s+)?def\s+\w+)\((?P<args>.*)\)(?:\s*->\s*(?P<returns>[^:]+))?:"
+                       r"(?P<rest>\s*(?:#.*)?)$")
+
+ML_SCRIPT = '''# load the data
+import pandas as pd
+df = pd.read_csv(path)
+# drop the nulls
+df = df.dropna(axis=0)
+# print the statistics of every column
+print(df.describe(include="all"))
+'''
+
+
+def _annotate_argument(argument: str) -> str:
+    argument = argument.strip()
+    if not argument or argument in ("self", "cls", "*", "/") or argument.startswith("*") or ":" in argument:
+        return argument
+    if "=" in argument:
+        name, default = argument.split("=", 1)
+        return f"{name.strip()}: int = {default.strip()}"
+    return f"{argument}: int"
+
+
+def annotate(code: str) -> str:
+    """annotate every single line signature of the code, the hints that already exist are kept"""
+    lines = []
+    for line in code.split("\n"):
+        match = SIGNATURE.match(line)
+        if match:
+            arguments = ", ".join(_annotate_argument(argument) for argument in match["args"].split(","))
+            line = f"{match['indent']}{match['prefix']}({arguments}) -> {match['returns'] or 'int'}:{match['rest']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def typing_responder(prompt: str) -> str:
+    """the completion of a typing prompt - the code part of the prompt with type hints"""
+    if CODE_MARKER in prompt:
+        code = prompt.split(CODE_MARKER, 1)[1]
+    else:
+        # slice_and_complete sends the instruction and the chunk separated by a new line
+        code = prompt.split("\n", 1)[1] if "\n" in prompt else prompt
+    return annotate(code)
+
+
+def hints_responder(prompt: str) -> str:
+    """the completion of an annotations-only prompt - the json template with `int` in the place of every hint"""
+    template = json.loads(prompt.split(TEMPLATE_MARKER, 1)[1].split("\n", 1)[0])
+    for function in template.get("functions", {}).values():
+        function["arguments"] = {name: "int" for name in function["arguments"]}
+        if "returns" in function:
+            function["returns"] = "int"
+    for variable in template.get("variables", []):
+        variable[2] = "int"
+    return json.dumps(template)
+
+
+def ml_responder(prompt: str) -> str:
+    return ML_SCRIPT
+
+
+def generate_module(index: int, definitions: int, seed: int = 0) -> str:
+    """
+    a module with functions, classes, constants and module level code
+    :param index: number of the module, part of the names
+    :param definitions: number of top-level functions and classes
+    :param seed: seed of the shape of the module
+    :return: the source of the module
+    """
+    rng = random.Random(seed * 100003 + index)
+    parts = [f'"""synthetic module {index}"""', "import os", "from collections import OrderedDict", "",
+             f"CONSTANT_{index} = {rng.randint(0, 1000)}", ""]
+    for number in range(definitions):
+        if rng.random() < 0.7:
+            body = [f"    total = a + b * {rng.randint(1, 9)}"]
+            body += [f"    total = total + len(os.sep) + {line}" for line in range(rng.randint(1, 8))]
+            body.append("    return total")
+            parts += ["", f"def function_{number}(a, b=1):", *body, ""]
+        else:
+            parts += [
+                "",
+                f"class Model{number}:",
+                "    def __init__(self, value):",
+                "        self.value = value",
+                "        self.cache = OrderedDict()",
+                "",
+                "    def method(self, other):",
+                f"        return self.value + other + CONSTANT_{index}",
+                "",
+            ]
+    parts += ["", "if __name__ == '__main__':", "    print(CONSTANT_%d)" % index, ""]
+    return "\n".join(parts)
+
+
+def generate_codebase(root: Union[str, Path], files: int, definitions: int = 20, seed: int = 0) -> List[Path]:
+    """write `files` synthetic modules into root, in sub packages of 50 modules"""
+    root = Path(root)
+    paths = []
+    for index in range(files):
+        package = root / f"package_{index // 50}"
+        package.mkdir(parents=True, exist_ok=True)
+        path = package / f"module_{index}.py"
+        path.write_text(generate_module(index, definitions, seed))
+        paths.append(path)
+    return paths
+
+
+def generate_csv(path: Union[str, Path], rows: int, seed: int = 0) -> Path:
+    """a csv file with numeric, categorical and partially empty columns and a binary target"""
+    rng = random.Random(seed)
+    path = Path(path)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "age", "income", "city", "segment", "score", "target"])
+        for row in range(rows):
+            writer.writerow([
+                row,
+                rng.randint(18, 90),
+                "" if rng.random() < 0.05 else round(rng.lognormvariate(10, 1), 2),
+                rng.choice(["tel aviv", "haifa", "jerusalem", "beer sheva", "eilat"]),
+                rng.choice("abcd"),
+                round(rng.random(), 4),
+                int(rng.random() < 0.3),
+            ])
+    return path
@@ -26,11 +26,11 @@ setup(
     author_email="itayd@post.bgu.ac.il",
     license="GNU AGPLv3",
     python_requires=">=3.9.1",
-    packages=find_packages(),
+    packages=find_packages(exclude=("benchmarks", "benchmarks.*")),
     install_requires=load_requires("requirements.txt"),
     entry_points={
         "console_scripts": [
-            "autopy_type = autopy_type.cli.main:autopy_cli",
+            "autopy_type = autopy.type.cli.main:autopy_cli",
         ],
     },
     include_package_data=True,
@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from autopy.completion.client import CompletionClient
+from autopy.completion.fake import FakeBackend
+from autopy.completion.tokens import context_size, count_tokens
+from autopy.models.models import ModelType
+from autopy.type.autopy_type import AutoPy
+
+MODEL = ModelType.TEXT_DAVINCI_003.value
+
+
+def code_responder(prompt: str) -> str:
+    """respond with the code of the prompt as it is"""
+    return prompt.split("this is the code:\n", 1)[-1]
+
+
+def test_statement_longer_than_the_context_is_left_untyped(tmp_path: Path) -> None:
+    huge = "TABLE = [" + ", ".join(f"'value_{i}'" for i in range(3000)) + "]\n"
+    assert count_tokens(huge, MODEL) > context_size(MODEL)
+    path = tmp_path / "module.py"
+    path.write_text("def add(a, b):\n    return a + b\n\n\n" + huge + "\n\ndef sub(a, b):\n    return a - b\n")
+    backend = FakeBackend(code_responder)
+    client = CompletionClient(backend=backend)
+
+    autopy = AutoPy(api_key="test", path=path, model=MODEL, client=client)
+    autopy.run(infer=False)
+    client.close()
+
+    typed = (tmp_path / "module_typed.py").read_text()
+    assert huge in typed
+    assert "def add(a, b)" in typed and "def sub(a, b)" in typed
+    # the other statements were still sent to the model
+    assert backend.calls >= 1
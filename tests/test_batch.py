@@ -0,0 +1,39 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from autopy.completion.client import CompletionClient
+from autopy.completion.fake import FakeBackend
+from autopy.type.autopy_type import AutoPy
+from autopy.type.batch import BatchRunner
+
+
+def single_file_responder(prompt: str) -> str:
+    """fails every shared request, so every file falls back to a request of its own"""
+    if "---- unit" in prompt:
+        return ""
+    return prompt.split("this is the code:\n", 1)[-1]
+
+
+def test_files_are_planned_once(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    files = []
+    for i in range(3):
+        path = tmp_path / f"module_{i}.py"
+        path.write_text(f"def function_{i}(a, b):\n    return a + b\n")
+        files.append(path)
+    planned: List[Path] = []
+    plan = AutoPy.plan
+
+    def counting_plan(autopy: AutoPy, *args, **kwargs):
+        planned.append(Path(autopy.path))
+        return plan(autopy, *args, **kwargs)
+
+    monkeypatch.setattr(AutoPy, "plan", counting_plan)
+    client = CompletionClient(backend=FakeBackend(single_file_responder))
+    report = BatchRunner(api_key="test", client=client, project_context=False).run(files)
+    client.close()
+
+    assert not report.failures
+    assert sorted(planned) == files
+    assert all((tmp_path / f"module_{i}_typed.py").exists() for i in range(3))
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from autopy.completion.cache import CompletionCache
+from autopy.completion.client import CompletionClient
+from autopy.completion.fake import FakeBackend
+from autopy.type.autopy_type import AutoPy
+
+
+SOURCE = "def add(a, b):\n    return a + b\n"
+TYPED = "def add(a: int, b: int) -> int:\n    return a + b\n"
+
+
+def typed_responder(prompt: str) -> str:
+    return TYPED
+
+
+def test_empty_cache_is_truthy(tmp_path: Path) -> None:
+    cache = CompletionCache(tmp_path / "completions.sqlite3")
+    assert len(cache) == 0
+    assert cache
+    cache.close()
+
+
+def test_second_run_hits_the_cache(tmp_path: Path) -> None:
+    path = tmp_path / "module.py"
+    path.write_text(SOURCE)
+    cache = CompletionCache(tmp_path / "completions.sqlite3")
+    backend = FakeBackend(typed_responder)
+    client = CompletionClient(backend=backend, cache=cache)
+
+    AutoPy(api_key="test", path=path, client=client).run(incremental=False, infer=False)
+    assert len(cache) >= 1
+    calls = backend.calls
+
+    AutoPy(api_key="test", path=path, client=client).run(incremental=False, infer=False)
+    assert backend.calls == calls
+    assert cache.hits >= 1
+    assert (tmp_path / "module_typed.py").read_text() == TYPED
+    client.close()
@@ -0,0 +1,34 @@
+from autopy.type.utils.chunker import chunk_source
+
+SOURCE = '''def helper(a):
+    return a
+
+
+class Point:
+    x: int
+
+    def norm(self):
+        ...
+
+
+def describe(point: Point) -> str:
+    """line1
+
+    line2"""
+    return helper(point.x)
+'''
+
+
+def test_strip_header_keeps_the_lines_of_the_chunk() -> None:
+    chunks = chunk_source(SOURCE, max_tokens=1, include=lambda node: node.name == "describe")
+    assert len(chunks) == 1
+    chunk = chunks[0]
+    assert "..." in chunk.header and "x: int" in chunk.header
+    # the model returns the header followed by the chunk
+    assert chunk.strip_header(chunk.prompt_source) == chunk.source
+    assert chunk.strip_header("\n" + chunk.prompt_source) == chunk.source
+
+
+def test_strip_header_of_a_chunk_sent_without_its_header() -> None:
+    chunk = chunk_source(SOURCE, max_tokens=1, include=lambda node: node.name == "Point")[0]
+    assert chunk.strip_header(chunk.source) == chunk.source
@@ -0,0 +1,114 @@
+import asyncio
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from autopy.completion.cache import CompletionCache
+from autopy.completion.client import Completion, CompletionClient, CompletionError, CompletionRequest
+from autopy.completion.fake import FakeBackend, RateLimitError
+
+MODEL = "text-davinci-003"
+
+
+def failing_responder(prompt: str) -> str:
+    if prompt == "fail":
+        raise RateLimitError("injected failure")
+    return prompt.upper()
+
+
+def test_failed_request_does_not_fail_the_others() -> None:
+    client = CompletionClient(backend=FakeBackend(failing_responder), max_retries=1, base_delay=0)
+    completions = client.complete_many([CompletionRequest(prompt, 16, MODEL) for prompt in ("a", "fail", "b")])
+    client.close()
+
+    assert [completion.text for completion in completions] == ["A", "", "B"]
+    assert [completion.valid for completion in completions] == [True, False, True]
+    assert isinstance(completions[1].error, CompletionError)
+    assert completions[0].error is None
+
+
+class ScriptedBackend:
+    """a backend that raises the given errors in order, and then completes every prompt"""
+
+    def __init__(self, *errors: Exception, latency: float = 0.0) -> None:
+        self.errors = list(errors)
+        self.latency = latency
+        self.max_tokens: List[int] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, model: str, prompt: str, max_tokens: int) -> Completion:
+        self.max_tokens.append(max_tokens)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.errors:
+                raise self.errors.pop(0)
+            return Completion(prompt.upper(), prompt_tokens=1, completion_tokens=1)
+        finally:
+            self.in_flight -= 1
+
+
+class InvalidRequestError(Exception):
+    """has the name of the openai error"""
+
+
+def test_retryable_errors_are_retried() -> None:
+    backend = ScriptedBackend(RateLimitError("slow down"), ConnectionError("reset"))
+    client = CompletionClient(backend=backend, max_retries=2, base_delay=0)
+    assert client.complete(CompletionRequest("a", 16, MODEL)).text == "A"
+    assert client.retries == 2
+    assert client.requests == 3
+    client.close()
+
+
+def test_retries_are_bounded() -> None:
+    backend = ScriptedBackend(*(RateLimitError("slow down") for _ in range(3)))
+    client = CompletionClient(backend=backend, max_retries=2, base_delay=0)
+    with pytest.raises(CompletionError, match="after 3 attempts"):
+        client.complete(CompletionRequest("a", 16, MODEL))
+    client.close()
+
+
+def test_other_errors_are_not_retried() -> None:
+    backend = ScriptedBackend(ValueError("bad request"))
+    client = CompletionClient(backend=backend, base_delay=0)
+    with pytest.raises(CompletionError, match="bad request"):
+        client.complete(CompletionRequest("a", 16, MODEL))
+    assert client.requests == 1
+    client.close()
+
+
+def test_context_length_error_lowers_max_tokens() -> None:
+    backend = ScriptedBackend(InvalidRequestError("This model's maximum context length is 4097 tokens"))
+    client = CompletionClient(backend=backend, base_delay=0)
+    client.complete(CompletionRequest("a", 100, MODEL))
+    assert backend.max_tokens == [100, 90]
+    client.close()
+
+
+def test_backoff_is_bounded_by_max_delay() -> None:
+    client = CompletionClient(backend=ScriptedBackend(), base_delay=1.0, max_delay=5.0)
+    assert all(0 <= client.backoff(attempt) <= min(5.0, 2 ** attempt) for attempt in range(10) for _ in range(20))
+
+
+def test_requests_in_flight_are_bounded() -> None:
+    backend = ScriptedBackend(latency=0.01)
+    client = CompletionClient(backend=backend, max_concurrency=3)
+    completions = client.complete_many([CompletionRequest(str(i), 16, MODEL) for i in range(12)])
+    client.close()
+    assert [completion.text for completion in completions] == [str(i) for i in range(12)]
+    assert backend.max_in_flight == 3
+
+
+def test_invalid_completion_is_requested_again_and_not_cached(tmp_path: Path) -> None:
+    backend = FakeBackend(lambda prompt: "not valid")
+    cache = CompletionCache(tmp_path / "completions.sqlite3")
+    client = CompletionClient(backend=backend, cache=cache, max_invalid_retries=1)
+    completion = client.complete(CompletionRequest("a", 16, MODEL, cache_key="key", validate=lambda text: False))
+    client.close()
+    assert not completion.valid
+    assert backend.calls == 2
+    assert cache.get("key") is None
@@ -0,0 +1,108 @@
+import ast
+from pathlib import Path
+from typing import List
+
+from autopy.completion.client import CompletionClient
+from autopy.completion.fake import FakeBackend
+from autopy.type.autopy_type import AutoPy
+from autopy.type.utils.incremental import Manifest, fingerprint, manifest_path_for, match_typed
+
+SOURCE = '''import os
+
+
+def add(a, b):
+    return a + b
+
+
+def sub(a, b):
+    return a - b
+
+
+TOTAL = add(1, 2)
+'''
+TYPED = '''import os
+from typing import Any
+
+
+def add(a: int, b: int) -> int:
+    return a + b
+
+
+def sub(a: int, b: int) -> int:
+    return a - b
+
+
+TOTAL: int = add(1, 2)
+'''
+
+
+def test_fingerprint_ignores_formatting_and_comments() -> None:
+    original = ast.parse("def f(a, b):\n    return a + b\n").body[0]
+    reformatted = ast.parse("\n\n# a comment\ndef f(a,\n      b):  # another\n    return (a + b)\n").body[0]
+    changed = ast.parse("def f(a, b):\n    return a - b\n").body[0]
+    assert fingerprint(original) == fingerprint(reformatted)
+    assert fingerprint(original) != fingerprint(changed)
+
+
+def test_match_typed_matches_definitions_by_name_and_statements_by_order() -> None:
+    nodes = ast.parse(SOURCE).body
+    # the model returned the definitions in another order
+    typed = ("def sub(a: int, b: int) -> int:\n    return a - b\n\n\n"
+             "def add(a: int, b: int) -> int:\n    return a + b\n\n\n"
+             "TOTAL: int = add(1, 2)\n")
+    matched = match_typed(nodes, typed)
+    assert matched == {
+        1: "def add(a: int, b: int) -> int:\n    return a + b",
+        2: "def sub(a: int, b: int) -> int:\n    return a - b",
+        3: "TOTAL: int = add(1, 2)",
+    }
+    assert match_typed(nodes, "def add(a: int") == {}
+
+
+def test_manifest_splices_the_typed_statements_that_did_not_change(tmp_path: Path) -> None:
+    tree = ast.parse(SOURCE)
+    manifest = Manifest("model", "instructions")
+    manifest.update(tree.body, TYPED)
+    assert manifest.missing(tree) == []
+    assert manifest.imports == ["import os", "from typing import Any"]
+
+    path = manifest_path_for(tmp_path / "module_typed.py")
+    manifest.save(path)
+    loaded = Manifest.load(path)
+    assert loaded is not None and loaded.matches("model", "instructions")
+    assert not loaded.matches("other model", "instructions")
+
+    changed = SOURCE.replace("return a - b", "return b - a")
+    changed_tree = ast.parse(changed)
+    assert [node.name for node in loaded.missing(changed_tree)] == ["sub"]
+    typed = loaded.splice(changed, changed_tree)
+    assert "def add(a: int, b: int) -> int:" in typed
+    assert "def sub(a, b):\n    return b - a" in typed
+    assert "TOTAL: int = add(1, 2)" in typed
+
+
+def test_second_run_sends_only_the_changed_statements(tmp_path: Path) -> None:
+    prompts: List[str] = []
+
+    def responder(prompt: str) -> str:
+        prompts.append(prompt)
+        return TYPED if "def add" in prompt.split("this is the code:", 1)[-1] else \
+            "def sub(a: int, b: int) -> int:\n    return b - a\n"
+
+    path = tmp_path / "module.py"
+    path.write_text(SOURCE)
+    client = CompletionClient(backend=FakeBackend(responder))
+    AutoPy(api_key="test", path=path, client=client).run(infer=False)
+    assert manifest_path_for(tmp_path / "module_typed.py").is_file()
+
+    path.write_text(SOURCE.replace("return a - b", "return b - a"))
+    prompts.clear()
+    AutoPy(api_key="test", path=path, client=client).run(infer=False)
+    client.close()
+
+    assert len(prompts) == 1
+    code = prompts[0].split("this is the code:", 1)[-1]
+    assert "def sub" in code and "def add" not in code
+    typed = (tmp_path / "module_typed.py").read_text()
+    assert "def add(a: int, b: int) -> int:" in typed
+    assert "def sub(a: int, b: int) -> int:\n    return b - a" in typed
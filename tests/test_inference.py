@@ -0,0 +1,36 @@
+import ast
+
+from autopy.type.utils.inference import infer_annotations
+
+
+def test_module_variable_rebound_with_global_is_not_annotated() -> None:
+    source = (
+        "counter = 0\n"
+        "name = 1\n"
+        "\n"
+        "\n"
+        "def rename():\n"
+        "    global name\n"
+        "    name = 'a'\n"
+    )
+    variables = infer_annotations(ast.parse(source)).variables
+    assert variables[("", "counter")] == "int"
+    assert ("", "name") not in variables
+
+
+def test_variable_rebound_with_nonlocal_is_not_annotated() -> None:
+    source = (
+        "def outer():\n"
+        "    total = 0\n"
+        "    value = 1\n"
+        "\n"
+        "    def inner():\n"
+        "        nonlocal value\n"
+        "        value = 'a'\n"
+        "\n"
+        "    inner()\n"
+        "    return total + value\n"
+    )
+    variables = infer_annotations(ast.parse(source)).variables
+    assert variables[("outer", "total")] == "int"
+    assert ("outer", "value") not in variables
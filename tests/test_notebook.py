@@ -0,0 +1,33 @@
+from autopy.ml.notebook import markdown_lines, split_cells
+
+SCRIPT = '''# Load the data
+import os
+
+
+def f():
+    return 1
+# Evaluate
+score = f()
+
+
+def g():
+    x = 1
+# inside the function
+    return x
+'''
+
+
+def test_comment_after_a_block_becomes_a_markdown_cell() -> None:
+    assert markdown_lines(SCRIPT) == {0, 6}
+    cells = split_cells(SCRIPT)
+    assert [(cell.kind, cell.lines[0]) for cell in cells] == [
+        ("markdown", "# Load the data"),
+        ("code", "import os"),
+        ("markdown", "# Evaluate"),
+        ("code", "score = f()"),
+    ]
+
+
+def test_comments_inside_statements_stay_in_the_code() -> None:
+    code = "data = [\n# not a cell\n    1,\n]\n@decorator\n# not a cell\ndef g():\n    pass\n"
+    assert markdown_lines(code) == set()
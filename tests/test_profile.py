@@ -0,0 +1,26 @@
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pandas")
+
+from autopy.ml import profile as profile_module  # noqa: E402
+from autopy.ml.profile import file_key, profile_csv  # noqa: E402
+
+
+def test_profile_is_cached_until_the_file_changes(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = tmp_path / "data.csv"
+    path.write_text("a,b\n1,x\n2,y\n")
+    key = file_key(path)
+    assert profile_csv(path, cache_dir=tmp_path / "profiles").rows == 2
+
+    read_chunks = profile_module.read_chunks
+    reads = []
+    monkeypatch.setattr(profile_module, "read_chunks", lambda *args: reads.append(args) or read_chunks(*args))
+    assert profile_csv(path, cache_dir=tmp_path / "profiles").rows == 2
+    assert not reads
+
+    path.write_text("a,b\n1,x\n2,y\n3,z\n")
+    assert file_key(path) != key
+    assert profile_csv(path, cache_dir=tmp_path / "profiles").rows == 3
+    assert reads
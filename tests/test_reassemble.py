@@ -0,0 +1,77 @@
+import ast
+from typing import Dict
+
+from autopy.type.utils.incremental import fingerprint
+from autopy.type.utils.reassemble import ImportBlock, reassemble
+
+SOURCE = '''"""the module"""
+from __future__ import annotations
+
+import os
+
+
+# adds two numbers
+def add(a, b):
+    return a + b
+
+x = 1; y = 2
+
+
+def first(items):
+    return items[0]  # the first one
+'''
+
+
+def typed_units(tree: ast.Module, *typed: str) -> Dict[str, str]:
+    """the typed version of every definition of the tree, in the order of the definitions"""
+    definitions = [node for node in tree.body if isinstance(node, ast.FunctionDef)]
+    return {fingerprint(node): source for node, source in zip(definitions, typed)}
+
+
+def test_typed_statements_replace_the_original_ones_in_place() -> None:
+    tree = ast.parse(SOURCE)
+    units = typed_units(tree, "def add(a: int, b: int) -> int:\n    return a + b",
+                        "def first(items: List[Any]) -> Any:\n    return items[0]")
+    module = reassemble(SOURCE, tree, units, imports=["import os", "from collections import OrderedDict"])
+
+    assert module == '''"""the module"""
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from typing import Any, List
+
+
+# adds two numbers
+def add(a: int, b: int) -> int:
+    return a + b
+
+x = 1; y = 2
+
+
+def first(items: List[Any]) -> Any:
+    return items[0]
+'''
+
+
+def test_statements_without_a_typed_version_are_kept() -> None:
+    tree = ast.parse(SOURCE)
+    assert reassemble(SOURCE, tree, {}) == SOURCE
+
+
+def test_typed_statement_that_breaks_the_module_is_reverted() -> None:
+    tree = ast.parse(SOURCE)
+    units = typed_units(tree, "def add(a: int, b: int) -> int:\n    return a +",
+                        "def first(items: list) -> int:\n    return items[0]")
+    module = reassemble(SOURCE, tree, units)
+    compile(module, "<typed>", "exec")
+    assert "def add(a, b):\n    return a + b" in module
+    assert "def first(items: list) -> int:" in module
+
+
+def test_import_block_drops_the_names_that_are_already_bound() -> None:
+    original = ImportBlock()
+    original.add_source("import os\nfrom typing import List")
+    needed = ImportBlock()
+    needed.add_source("import os\nimport sys\nfrom typing import List, Dict\nfrom .models import User as List")
+    assert needed.difference(original, bound={"sys"}).render(future=False) == ["from typing import Dict"]
@@ -0,0 +1,61 @@
+import os
+from pathlib import Path
+
+from autopy.type.utils.scanner import compare, missing_annotations, scan
+
+TYPED = "def add(a: int, b: int) -> int:\n    return a + b\n"
+UNTYPED = "def add(a, b):\n    return a + b\n"
+
+
+def write(path: Path, source: str) -> Path:
+    path.write_text(source)
+    return path
+
+
+def test_unchanged_files_are_not_analyzed_again(tmp_path: Path) -> None:
+    index = tmp_path / "coverage.sqlite3"
+    typed = write(tmp_path / "typed.py", TYPED)
+    untyped = write(tmp_path / "untyped.py", UNTYPED)
+    write(tmp_path / "broken.py", "def add(a, b)\n")
+
+    first = scan([tmp_path], index_path=index, workers=1)
+    assert (first.analyzed, first.skipped) == (3, 0)
+    assert first.reports[str(typed.resolve())]["score"] == 1.0
+    assert first.reports[str(untyped.resolve())]["score"] == 0.0
+    assert list(first.errors) == [str((tmp_path / "broken.py").resolve())]
+
+    second = scan([tmp_path], index_path=index, workers=1)
+    assert (second.analyzed, second.skipped) == (0, 3)
+    assert second.to_dict() == first.to_dict()
+
+    # a touched file is compared by its hash and is not analyzed again, an edited file is
+    stat = os.stat(typed)
+    os.utime(typed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    write(untyped, TYPED.replace("add", "sum"))
+    third = scan([tmp_path], index_path=index, workers=1)
+    assert (third.analyzed, third.skipped) == (1, 2)
+    assert third.reports[str(untyped.resolve())]["score"] == 1.0
+
+
+def test_scan_without_the_index_analyzes_everything(tmp_path: Path) -> None:
+    write(tmp_path / "module.py", UNTYPED)
+    scan([tmp_path], index_path=tmp_path / "coverage.sqlite3", workers=1)
+    result = scan([tmp_path], use_index=False, workers=1)
+    assert (result.analyzed, result.skipped) == (1, 0)
+    report = next(iter(result.reports.values()))
+    assert missing_annotations(report) == ["1: add (a, b, return)"]
+
+
+def test_compare_reports_regressions_only(tmp_path: Path) -> None:
+    write(tmp_path / "module.py", TYPED)
+    baseline = scan([tmp_path], use_index=False, workers=1).to_dict(tmp_path)
+    write(tmp_path / "module.py", UNTYPED)
+    write(tmp_path / "new.py", UNTYPED)
+    current = scan([tmp_path], use_index=False, workers=1).to_dict(tmp_path)
+
+    regressions = compare(current, baseline)
+    assert regressions == [
+        "total coverage dropped from 100.0% to 0.0%",
+        "module.py: coverage dropped from 100.0% to 0.0%",
+    ]
+    assert compare(baseline, baseline) == []
@@ -0,0 +1,70 @@
+import json
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from autopy.completion.client import CompletionClient
+from autopy.completion.fake import FakeBackend
+from autopy.models.models import OutputType
+from autopy.type.autopy_type import AutoPy
+from autopy.type.cli.main import autopy_cli
+from autopy.type.utils.stubs import FOREIGN, STUB_HEADER_PREFIX, UNCHANGED, WRITTEN, generate_stubs
+
+SOURCE = "def add(a, b):\n    return a + b\n\n\nTOTAL = 0\n"
+HAND_WRITTEN = "def add(a: int, b: int) -> int: ...\n\nTOTAL: int\n"
+
+
+def hints_responder(prompt: str) -> str:
+    """the hints of SOURCE, in the format the model returns them"""
+    return json.dumps({
+        "functions": {"add": {"arguments": {"a": "int", "b": "int"}, "returns": "int"}},
+        "variables": [["", "TOTAL", "int"]],
+    })
+
+
+def test_hand_written_stub_is_left_alone(tmp_path: Path) -> None:
+    path = tmp_path / "module.py"
+    path.write_text(SOURCE)
+    stub = tmp_path / "module.pyi"
+    stub.write_text(HAND_WRITTEN)
+
+    assert generate_stubs([path]) == [(str(path), FOREIGN, None)]
+    assert stub.read_text() == HAND_WRITTEN
+
+    backend = FakeBackend(hints_responder)
+    client = CompletionClient(backend=backend)
+    AutoPy(api_key="test", path=path, client=client, output=OutputType.PYI.value).run(infer=False)
+    client.close()
+    assert stub.read_text() == HAND_WRITTEN
+    assert backend.calls == 0
+
+    result = CliRunner().invoke(autopy_cli, ["stubs", "-p", str(path)])
+    assert result.exit_code == 0
+    assert "1 were not written by autopy" in result.output
+    assert stub.read_text() == HAND_WRITTEN
+
+
+def test_force_overwrites_a_hand_written_stub(tmp_path: Path) -> None:
+    path = tmp_path / "module.py"
+    path.write_text(SOURCE)
+    stub = tmp_path / "module.pyi"
+    stub.write_text(HAND_WRITTEN)
+
+    assert generate_stubs([path], force=True) == [(str(path), WRITTEN, None)]
+    assert stub.read_text().startswith(STUB_HEADER_PREFIX)
+    assert generate_stubs([path]) == [(str(path), UNCHANGED, None)]
+
+
+def test_offline_stubs_keep_the_stub_of_the_model(tmp_path: Path) -> None:
+    path = tmp_path / "module.py"
+    path.write_text(SOURCE)
+    client = CompletionClient(backend=FakeBackend(hints_responder))
+    AutoPy(api_key="test", path=path, client=client, output=OutputType.PYI.value).run(infer=False)
+    client.close()
+    stub = tmp_path / "module.pyi"
+    typed = stub.read_text()
+    assert typed.startswith(STUB_HEADER_PREFIX)
+    assert "def add(a: int, b: int) -> int" in typed
+
+    assert generate_stubs([path]) == [(str(path), UNCHANGED, None)]
+    assert stub.read_text() == typed
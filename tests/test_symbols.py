@@ -0,0 +1,54 @@
+import ast
+from pathlib import Path
+
+from autopy.type.utils.symbols import SymbolIndex, build_index
+
+
+def write(path: Path, source: str = "def f(x: int) -> int:\n    return x\n") -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(source)
+    return path
+
+
+def test_script_indexes_only_its_neighbours(tmp_path: Path) -> None:
+    script = write(tmp_path / "script.py", "from helpers import f\n")
+    write(tmp_path / "helpers.py")
+    write(tmp_path / "projects" / "other" / "module.py")
+
+    index = build_index([script], index_path=tmp_path / "index.json")
+    assert set(index.modules) == {"script", "helpers"}
+
+
+def test_package_file_indexes_its_whole_package(tmp_path: Path) -> None:
+    write(tmp_path / "pkg" / "__init__.py", "")
+    write(tmp_path / "pkg" / "sub" / "__init__.py", "")
+    module = write(tmp_path / "pkg" / "sub" / "module.py", "from pkg.core import f\n")
+    write(tmp_path / "pkg" / "core.py")
+    write(tmp_path / "unrelated" / "module.py")
+
+    index = build_index([module], index_path=tmp_path / "index.json")
+    assert set(index.modules) == {"pkg", "pkg.sub", "pkg.sub.module", "pkg.core"}
+    assert index.lookup("pkg.core", "f") is not None
+
+
+def test_removed_module_is_forgotten_on_disk(tmp_path: Path) -> None:
+    script = write(tmp_path / "script.py", "from helpers import f\n")
+    helpers = write(tmp_path / "helpers.py")
+    build_index([script], index_path=tmp_path / "index.json")
+
+    helpers.unlink()
+    build_index([script], index_path=tmp_path / "index.json")
+    assert set(SymbolIndex(tmp_path, tmp_path / "index.json").modules) == {"script"}
+
+
+def test_src_layout_with_tests_names_modules_after_their_own_root(tmp_path: Path) -> None:
+    write(tmp_path / "src" / "pkg" / "__init__.py", "")
+    write(tmp_path / "src" / "pkg" / "core.py")
+    module = write(tmp_path / "src" / "pkg" / "module.py", "from pkg.core import f\n\nvalue = f(1)\n")
+    test = write(tmp_path / "tests" / "test_core.py", "from pkg.core import f\n")
+
+    index = build_index([module, test], index_path=tmp_path / "index.json")
+    assert {"pkg", "pkg.core", "pkg.module", "test_core"} <= set(index.modules)
+    assert index.lookup("pkg.core", "f") is not None
+    tree = ast.parse(module.read_text())
+    assert "def f(x: int) -> int" in index.context(module, tree).for_nodes(tree.body)
@@ -0,0 +1,27 @@
+import sys
+import types
+
+import pytest
+
+from autopy.completion import tokens
+from autopy.completion.tokens import completion_budget, context_size, count_tokens
+
+
+@pytest.fixture
+def offline_tiktoken(monkeypatch: pytest.MonkeyPatch):
+    """a tiktoken that can't download its encodings"""
+    def get_encoding(name: str):
+        raise ConnectionError(f"can't download {name}")
+
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(get_encoding=get_encoding))
+    tokens._encoding.cache_clear()
+    tokens._count.cache_clear()
+    yield
+    tokens._encoding.cache_clear()
+    tokens._count.cache_clear()
+
+
+def test_offline_tokenizer_falls_back_to_the_estimate(offline_tiktoken: None) -> None:
+    text = "def add(a, b):\n    return a + b\n"
+    assert count_tokens(text) == tokens._estimate(text)
+    assert completion_budget(text, "text-davinci-003") == context_size("text-davinci-003") - count_tokens(text) - 16
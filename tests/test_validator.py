@@ -0,0 +1,131 @@
+import ast
+from pathlib import Path
+
+from autopy.type.utils.validator import Validator, ValidatorParser, strip_annotations
+
+SOURCE = '''class Point:
+    origin: "Point"
+
+    def __init__(self, x: int, y):
+        self.x = x
+        self.y: int = y
+
+    @staticmethod
+    def parse(text) -> "Point":
+        return Point(0, 0)
+
+    async def move(self, *args: int, dx, **kwargs) -> None:
+        pass
+
+
+def distance(a, /, b: Point = None, *, scale: float = 1.0):
+    total = 0
+    pair, other = 1, 2
+    return total
+
+
+LIMIT = 10
+'''
+
+
+def test_analyze_reports_every_function_argument_and_variable() -> None:
+    report = ValidatorParser.analyze(SOURCE)
+    functions = {function.name: function for function in report.functions}
+    assert list(functions) == ["Point.__init__", "Point.parse", "Point.move", "distance"]
+
+    # self is skipped, the arguments of static methods are not
+    assert [argument.name for argument in functions["Point.__init__"].arguments] == ["x", "y"]
+    assert functions["Point.__init__"].missing == ["y", "return"]
+    assert [argument.name for argument in functions["Point.parse"].arguments] == ["text"]
+    move = functions["Point.move"]
+    assert move.is_async
+    assert [(argument.name, argument.kind) for argument in move.arguments] == [
+        ("args", "vararg"), ("dx", "kwonly"), ("kwargs", "kwarg")]
+    assert move.missing == ["dx", "kwargs"]
+    assert [argument.kind for argument in functions["distance"].arguments] == ["posonly", "arg", "kwonly"]
+
+    variables = {(variable.scope, variable.name): variable.annotated for variable in report.variables}
+    # unpacking can not be annotated, so it is not counted
+    assert variables == {
+        ("Point", "origin"): True,
+        ("Point.__init__", "self.x"): False,
+        ("Point.__init__", "self.y"): True,
+        ("distance", "total"): False,
+        ("", "LIMIT"): False,
+    }
+    point = report.classes[0]
+    assert [attribute.name for attribute in point.attributes] == ["origin", "self.x", "self.y"]
+    assert [method.name for method in point.methods] == ["Point.__init__", "Point.parse", "Point.move"]
+
+
+def test_score_counts_the_annotated_fraction(tmp_path: Path) -> None:
+    report = ValidatorParser.analyze(SOURCE)
+    # 6 of the 13 hints of the functions and 2 of the 5 variables
+    assert (report.annotated, report.total) == (8, 18)
+    assert report.score == 8 / 18
+    assert ValidatorParser.analyze("print('nothing to annotate')\n").score == 1.0
+
+    path = tmp_path / "module.py"
+    path.write_text(SOURCE)
+    assert ValidatorParser().validate(path) == 8 / 18
+    assert ValidatorParser().analyze_file(path).to_dict()["path"] == str(path)
+
+
+ORIGINAL = """def scale(values, factor=2):
+    result = []
+    for value in values:
+        result.append(value * factor)
+    return result
+"""
+TYPED = """from typing import List
+
+
+def scale(values: List[int], factor: int = 2) -> List[int]:
+    result: List[int] = []
+    for value in values:
+        result.append(value * factor)
+    return result
+"""
+
+
+def test_typed_code_that_only_adds_hints_is_valid() -> None:
+    assert Validator().validate(ORIGINAL, TYPED).valid
+    # formatting and comments do not matter, and neither do bare declarations
+    assert Validator().validate(ORIGINAL, "import typing\n\n\ndef scale(values: list, factor: int=2) -> list:  # x\n"
+                                          "    result: list = []\n    count: int\n"
+                                          "    for value in values:\n        result.append(value * factor)\n"
+                                          "    return result\n").valid
+
+
+def test_typed_code_that_changes_the_code_is_not_valid() -> None:
+    changed = TYPED.replace("value * factor", "value + factor")
+    result = Validator().validate(ORIGINAL, changed)
+    assert not result.valid
+    assert "changed the statement in line 4" in result.errors[0]
+
+    assert not Validator().validate(ORIGINAL, TYPED + "\n\nprint(scale([1]))\n").valid
+    result = Validator().validate(ORIGINAL, TYPED.replace("return result", "return result["))
+    assert result.errors[0].startswith("the typed code does not compile")
+
+
+def test_missing_hints_are_errors() -> None:
+    untyped_return = TYPED.replace(") -> List[int]:", "):")
+    assert Validator().validate(ORIGINAL, untyped_return).errors == ["scale (line 4) has no hints for return"]
+    assert Validator(require_returns=False).validate(ORIGINAL, untyped_return).valid
+    untyped_variable = TYPED.replace("result: List[int] =", "result =")
+    assert not Validator(require_variables=True).validate(ORIGINAL, untyped_variable).valid
+
+
+def test_validate_node_checks_a_single_statement() -> None:
+    node = ast.parse(ORIGINAL).body[0]
+    assert Validator().validate_node(node, TYPED).valid
+    changed = "def scale(values: list, factor: int = 3) -> list:\n    return []\n"
+    assert not Validator().validate_node(node, changed).valid
+
+
+def test_strip_annotations_does_not_modify_the_tree() -> None:
+    tree = ast.parse(TYPED)
+    dump = ast.dump(tree)
+    stripped = strip_annotations(tree)
+    assert ast.dump(tree) == dump
+    assert ast.dump(stripped) == ast.dump(strip_annotations(ast.parse(ORIGINAL)))